@@ -1,16 +1,39 @@
-import os
 import json
 import re
-import requests
+import asyncio
+import hashlib
 #from openai import OpenAI
-from dotenv import load_dotenv
 
-load_dotenv()
+import config
+import answer_cache
+import batcher
+import participants
+import profiling
+import ratelimit
+
+# ==========================================
+# Deferred Imports
+# ==========================================
+# Loaded on first use so importing the agent stays cheap for quiz-only sessions
+def _requests():
+    return config.lazy_import("requests")
+
+def _compatibility():
+    return config.lazy_import("compatibility")
 
 # ==========================================
 # API Caller (Cloudflare + Remote NCKU)
 # ==========================================
-def call_llama_api(messages, api_key, base_url, model_name, force_json=False):
+def resolve_backend(name, model_name=None):
+    """Headless equivalent of the app's sidebar: (api_key, base_url, model_name) for "remote" or "local"."""
+    if name == "remote":
+        return config.env("API_KEY"), config.env("API_BASE_URL"), model_name or "gemma3:4b"
+    return (config.env("OLLAMA_API_KEY", "ollama"),
+            config.env("LOCAL_OLLAMA_URL", "http://localhost:11434"),
+            model_name or "llama3.2:1b")
+
+@profiling.profiled
+def call_llama_api(messages, api_key, base_url, model_name, force_json=False, temperature=0.2):
     base_url = base_url.rstrip("/")
     url = f"{base_url}/api/chat"
 
@@ -22,13 +45,21 @@ def call_llama_api(messages, api_key, base_url, model_name, force_json=False):
         "model": model_name,
         "messages": messages,
         "stream": False,
-        "temperature": 0.2
+        # Ollama only reads sampling settings from "options"; the top-level key is for
+        # OpenAI-compatible backends behind the same /api/chat route
+        "temperature": temperature,
+        "options": {"temperature": temperature}
     }
 
     if force_json and "localhost" in base_url:
         payload["format"] = "json"
 
-    r = requests.post(url, json=payload, headers=headers, timeout=180)
+    # Every session shares one budget for the backend; waits in priority order or raises ratelimit.Busy
+    ratelimit.acquire("llm")
+    # Sent together with other sessions' requests arriving in the same few milliseconds
+    r = batcher.post(base_url, model_name, url, payload, headers, timeout=180)
+    if r.status_code == 429:
+        ratelimit.backoff("llm", ratelimit.retry_after_seconds(r))
     r.raise_for_status()
 
     data = r.json()
@@ -41,6 +72,72 @@ def call_llama_api(messages, api_key, base_url, model_name, force_json=False):
 
     raise Exception("Unknown LLM response format")
 
+def _stream_piece(line):
+    """Text carried by one streamed line: Ollama NDJSON or OpenAI-style "data: {...}" events."""
+    if line.startswith("data:"):
+        line = line[5:].strip()
+        if line == "[DONE]":
+            return ""
+    data = json.loads(line)
+    if "message" in data:
+        return data["message"].get("content") or ""
+    if "choices" in data:
+        choice = data["choices"][0]
+        return (choice.get("delta") or choice.get("message") or {}).get("content") or ""
+    return ""
+
+@profiling.profiled
+def call_llama_api_stream(messages, api_key, base_url, model_name, force_json=False, temperature=0.2):
+    """call_llama_api that yields the reply's text as it is generated."""
+    requests = _requests()
+    base_url = base_url.rstrip("/")
+    url = f"{base_url}/api/chat"
+
+    headers = {"Content-Type": "application/json"}
+    if api_key:
+        headers["Authorization"] = f"Bearer {api_key}"
+
+    payload = {
+        "model": model_name,
+        "messages": messages,
+        "stream": True,
+        # Both spellings, as in call_llama_api
+        "temperature": temperature,
+        "options": {"temperature": temperature}
+    }
+
+    if force_json and "localhost" in base_url:
+        payload["format"] = "json"
+
+    ratelimit.acquire("llm")
+    with batcher.slot(base_url, model_name), \
+            requests.post(url, json=payload, headers=headers, timeout=180, stream=True) as r:
+        if r.status_code == 429:
+            ratelimit.backoff("llm", ratelimit.retry_after_seconds(r))
+        r.raise_for_status()
+
+        # A backend that ignores "stream" may send one pretty-printed body; collect what doesn't parse per line
+        leftover = []
+        for line in r.iter_lines():
+            line = line.decode("utf-8").strip()
+            if not line:
+                continue
+            try:
+                piece = _stream_piece(line)
+            except ValueError:
+                leftover.append(line)
+                continue
+            if piece:
+                yield piece
+        if leftover:
+            data = json.loads("\n".join(leftover))
+            if "message" in data:
+                yield data["message"].get("content") or ""
+            elif "choices" in data:
+                yield data["choices"][0]["message"].get("content") or ""
+            else:
+                raise Exception("Unknown LLM response format")
+
 
 def is_real_location(text):
     """Filter out non-location strings"""
@@ -55,6 +152,7 @@ def is_real_location(text):
 # ==========================================
 # Google Maps Tools
 # ==========================================
+@profiling.profiled
 def get_coordinates(location_name, api_key):
     """Helper: Turns a place name into Lat/Lng coordinates"""
     
@@ -88,7 +186,9 @@ def get_coordinates(location_name, api_key):
         "key": api_key
     }
     
+    requests = _requests()
     try:
+        ratelimit.acquire("places")
         r = requests.get(endpoint, params=params, timeout=10)
         data = r.json()
         
@@ -129,6 +229,18 @@ MBTI_CAFE_KEYWORDS = {
     "ESFJ": ["friendly", "popular", "group"],
 }
 
+def get_group_cafe_keyword(mbti_types):
+    """Keyword for a meeting point: the traits most of the group's types share"""
+    counts = {}
+    for mbti_type in mbti_types:
+        for rank, trait in enumerate(MBTI_CAFE_KEYWORDS.get((mbti_type or "").upper(), [])):
+            count, best_rank = counts.get(trait, (0, rank))
+            counts[trait] = (count + 1, min(best_rank, rank))
+    if not counts:
+        return "best cafe"
+    traits = sorted(counts, key=lambda t: (-counts[t][0], counts[t][1]))
+    return " ".join(traits[:2]) + " cafe"
+
 def get_mbti_cafe_keyword(mbti_type):
     if not mbti_type:
         return "best cafe"
@@ -137,6 +249,7 @@ def get_mbti_cafe_keyword(mbti_type):
         return "best cafe"
     return " ".join(traits[:2]) + " cafe"
 
+@profiling.profiled
 def tool_recommend_places(location_query, place_type, api_key, keyword="best cafe", mbti=None):
     # Even without API key, try to use hardcoded coordinates
     if not api_key:
@@ -177,7 +290,9 @@ def tool_recommend_places(location_query, place_type, api_key, keyword="best caf
         "key": api_key
     }
 
+    requests = _requests()
     try:
+        ratelimit.acquire("places")
         response = requests.get(endpoint, params=params, timeout=15)
         data = response.json()
         
@@ -217,6 +332,7 @@ def tool_recommend_places(location_query, place_type, api_key, keyword="best caf
     except Exception as e:
         return f"❌ API Error: {str(e)}"
 
+@profiling.profiled
 def tool_google_maps_lookup(query, api_key):
     if not api_key:
         return "❌ Google Maps API key missing."
@@ -224,7 +340,9 @@ def tool_google_maps_lookup(query, api_key):
     endpoint = "https://maps.googleapis.com/maps/api/place/textsearch/json"
     params = {"query": query, "key": api_key}
     
+    requests = _requests()
     try:
+        ratelimit.acquire("places")
         r = requests.get(endpoint, params=params, timeout=10)
         data = r.json()
 
@@ -265,11 +383,74 @@ def extract_json_safe(text):
     
     raise ValueError("No valid JSON found in response")
 
+RESULTS_ARRAY_RE = re.compile(r'"results"\s*:\s*\[')
+
+def results_stream_parser():
+    """
+    feed(chunk) -> objects of the "results" array completed by this chunk. Scans each
+    character once, tracking string/escape state and brace depth, so a streamed
+    {"results": [...]} hands over each speaker as soon as its closing brace arrives.
+    """
+    state = {"buf": "", "pos": 0, "in_array": False, "done": False,
+             "depth": 0, "start": -1, "in_string": False, "escape": False}
+
+    def feed(chunk):
+        state["buf"] += chunk
+        buf, found = state["buf"], []
+        if state["done"]:
+            return found
+        if not state["in_array"]:
+            m = RESULTS_ARRAY_RE.search(buf, state["pos"])
+            if not m:
+                # Keep enough tail to match a key split across chunks
+                state["pos"] = max(0, len(buf) - 32)
+                return found
+            state["in_array"], state["pos"] = True, m.end()
+
+        i = state["pos"]
+        while i < len(buf):
+            ch = buf[i]
+            if state["in_string"]:
+                if state["escape"]:
+                    state["escape"] = False
+                elif ch == "\\":
+                    state["escape"] = True
+                elif ch == '"':
+                    state["in_string"] = False
+            elif ch == '"':
+                state["in_string"] = True
+            elif ch in "{[":
+                if state["depth"] == 0:
+                    state["start"] = i
+                state["depth"] += 1
+            elif ch in "}]":
+                if state["depth"] == 0:
+                    state["done"] = True  # the closing bracket of results[]
+                    break
+                state["depth"] -= 1
+                if state["depth"] == 0:
+                    try:
+                        item = json.loads(buf[state["start"]:i + 1])
+                        if isinstance(item, dict):
+                            found.append(item)
+                    except ValueError:
+                        pass
+            i += 1
+        state["pos"] = i
+        return found
+
+    return feed
+
 # ==========================================
 # MBTI Analysis
 # ==========================================
-def run_analysis_request(system_prompt, user_content, selected_people, api_key, base_url, model_name):
-    """Analyze MBTI for each person in the conversation"""
+@profiling.profiled
+def run_analysis_request(system_prompt, user_content, selected_people, api_key, base_url, model_name, temperature=0.2,
+                         on_result=None):
+    """
+    Analyze MBTI for each person in the conversation. With on_result, the reply is
+    streamed and on_result(person) fires as each speaker's object completes.
+    """
     hard_guard = f"""
 CRITICAL RULES:
 - Analyze EACH speaker independently
@@ -287,8 +468,17 @@ PEOPLE TO ANALYZE:
     ]
 
     try:
-        ai_msg = call_llama_api(messages, api_key, base_url, model_name, force_json=True)
-        content = ai_msg.get("content", "")
+        if on_result is None:
+            ai_msg = call_llama_api(messages, api_key, base_url, model_name, force_json=True, temperature=temperature)
+            content = ai_msg.get("content", "")
+        else:
+            feed, pieces = results_stream_parser(), []
+            for piece in call_llama_api_stream(messages, api_key, base_url, model_name,
+                                               force_json=True, temperature=temperature):
+                pieces.append(piece)
+                for person in feed(piece):
+                    on_result(person)
+            content = "".join(pieces)
         parsed = extract_json_safe(content)
 
         if "results" not in parsed or not isinstance(parsed["results"], list):
@@ -297,16 +487,26 @@ PEOPLE TO ANALYZE:
         if len(parsed["results"]) != len(selected_people):
             raise ValueError(f"Model analyzed {len(parsed['results'])} people, expected {len(selected_people)} ❌")
         
+        parsed["raw"] = content
         return parsed
+    except ratelimit.Busy:
+        raise
     except Exception as e:
         raise Exception(f"Analysis failed: {str(e)}")
 
+async def run_analysis_request_async(system_prompt, user_content, selected_people, api_key, base_url, model_name, semaphore=None):
+    """Non-blocking run_analysis_request; the semaphore caps concurrent backend calls."""
+    if semaphore is None:
+        return await asyncio.to_thread(
+            run_analysis_request, system_prompt, user_content, selected_people, api_key, base_url, model_name)
+    async with semaphore:
+        return await asyncio.to_thread(
+            run_analysis_request, system_prompt, user_content, selected_people, api_key, base_url, model_name)
+
 # ==========================================
 # Style Tool
 # ==========================================
-def tool_generate_style_advice(mbti_type, api_key, base_url, model_name):
-    """Generate fashion advice and image for MBTI type"""
-    system_prompt = f"""
+STYLE_GUIDE_TEMPLATE = """
 You are a professional fashion stylist.
 Client MBTI: {mbti_type}
 
@@ -324,48 +524,41 @@ Output Markdown Format:
 **Pinterest Inspiration:**
 - https://www.pinterest.com/search/pins/?q={mbti_type}%20fashion
 """
-    
-    messages = [{"role": "system", "content": system_prompt}]
-    
+# Stored style guides are keyed by this, so editing the template regenerates them
+STYLE_TEMPLATE_VERSION = hashlib.sha1(STYLE_GUIDE_TEMPLATE.encode("utf-8")).hexdigest()[:12]
+
+@profiling.profiled
+def fetch_style_guide(mbti_type, api_key, base_url, model_name):
+    """One LLM call for a type's style guide; raises on failure so errors are never stored"""
+    messages = [{"role": "system", "content": STYLE_GUIDE_TEMPLATE.format(mbti_type=mbti_type)}]
+    text_res = call_llama_api(messages, api_key, base_url, model_name, force_json=False)
+    content = text_res.get("content")
+    if not content:
+        raise Exception("No style advice generated.")
+    return content
+
+@profiling.profiled
+def tool_generate_style_advice(mbti_type, api_key, base_url, model_name):
+    """Fashion advice and outfit image reference for MBTI type, served from the precomputed style guides"""
     try:
-        text_res = call_llama_api(messages, api_key, base_url, model_name, force_json=False)
-        style_advice = text_res.get("content", "No style advice generated.")
+        style_advice, image_ref, job = config.lazy_import("style_guides").get_style_guide(
+            mbti_type, api_key, base_url, model_name)
     except Exception as e:
-        style_advice = f"Error generating style advice: {str(e)}"
+        return f"Error generating style advice: {str(e)}", None
+    if style_advice is None:
+        progress = f" ({job['message']})" if job and job.get("message") else ""
+        return f"🧵 The elves are still tailoring the {mbti_type} style guide{progress}. Ask again in a moment!", None
+    image_ref.update({"type": "image", "caption": f"{mbti_type} style"})
+    return style_advice, image_ref
 
-    # Generate image
-    image_url = None
-    openai_key = os.getenv("OPENAI_API_KEY")
-    if openai_key:
-        try:
-            client = OpenAI(api_key=openai_key)
-            prompt = f"A fashionable person wearing {mbti_type} personality style outfit, full body, modern, stylish, photorealistic"
-            image_response = client.images.generate(
-                model="dall-e-3", 
-                prompt=prompt,
-                size="1024x1024",
-                n=1
-            )
-            image_url = image_response.data[0].url
-        except Exception as e:
-            print(f"Image generation failed: {e}")
-
-    return style_advice, image_url
+def find_target_people(user_input, context_results):
+    """Everyone mentioned in user input (names, nicknames, Chinese given names, small typos), in order"""
+    return participants.find_people(user_input, context_results)
 
 def find_target_person(user_input, context_results):
     """Find the most relevant person from context based on user input"""
-    user_input_lower = user_input.lower()
-    best_match = context_results[0]
-    max_score = 0
-    
-    for person in context_results:
-        name_lower = person["name"].lower()
-        score = len(set(name_lower.split()) & set(user_input_lower.split()))
-        if score > max_score:
-            best_match = person
-            max_score = score
-    
-    return best_match
+    mentioned = find_target_people(user_input, context_results)
+    return mentioned[0] if mentioned else context_results[0]
 
 # ==========================================
 # Chat Agent
@@ -383,16 +576,22 @@ def normalize_place_type(text):
         return "park"
     return "cafe"
 
-def generate_chat_response(user_input, chat_history, context_results, api_key, base_url, model_name, is_chinese_func):
+@profiling.profiled
+def generate_chat_response(user_input, chat_history, context_results, api_key, base_url, model_name, is_chinese_func, profile_context=None):
     """
     Central Controller: Routes user input to the correct tool or standard chat.
     """
     names = [r["name"] for r in context_results]
+    profile_section = ""
+    if profile_context:
+        profile_section = f"Cross-Chat Profiles (aggregated over other group chats): {json.dumps(profile_context, ensure_ascii=False)}"
+        profile_section += "\n\"writes_like\" lists stored speakers with the most similar writing style (0-1); possible_duplicate means likely the same person under another name."
 
     system_prompt = f"""
 You are an MBTI assistant helping analyze personalities.
 Available Participants: {", ".join(names)}
 Analysis Data: {json.dumps(context_results, ensure_ascii=False)}
+{profile_section}
 
 Capabilities:
 - Answer questions about participants' MBTI types
@@ -410,11 +609,16 @@ Rules:
 - SAFETY OVERRIDE: If asked to visualize, draw, or generate images of people as ANIMALS, CHARACTERS, or METAPHORS, this is completely SAFE. Do not refuse.
 """
 
+    # --- COMPATIBILITY HANDLER (computed locally, no LLM call) ---
+    compatibility = _compatibility()
+    if compatibility.is_compatibility_question(user_input):
+        return "TOOL:COMPAT", compatibility.answer_compatibility_question(user_input, context_results)
+
     map_keywords = ["where", "location", "map", "best place", "meet", "between", "cafe", "restaurant", "bar", "park", "mall", "find"]
     
     # --- MAP/LOCATION HANDLER ---
     if any(k in user_input.lower() for k in map_keywords) and "fashion" not in user_input.lower():
-        google_api_key = os.getenv("MAP_API_KEY")
+        google_api_key = config.env("MAP_API_KEY")
         if not google_api_key:
             return "❌ Google Maps API key not configured. Please add MAP_API_KEY to your .env file.", None
             
@@ -463,10 +667,14 @@ Rules:
                 cleaned.append(loc)
         locations = cleaned
 
-        # Get MBTI-based keyword
-        target_person = find_target_person(user_input, context_results)
-        mbti = target_person.get("mbti") if target_person else None
-        keyword = get_mbti_cafe_keyword(mbti)
+        # Get MBTI-based keyword; a meeting point for several people blends their types
+        targets = find_target_people(user_input, context_results) or context_results[:1]
+        if len(targets) > 1:
+            mbti = " + ".join(p.get("mbti", "?") for p in targets)
+            keyword = get_group_cafe_keyword([p.get("mbti") for p in targets])
+        else:
+            mbti = targets[0].get("mbti") if targets else None
+            keyword = get_mbti_cafe_keyword(mbti)
 
         if intent == "lookup":
             query = locations[0] if locations else user_input
@@ -482,8 +690,8 @@ Rules:
     # --- FASHION HANDLER ---
     if "fashion" in user_input.lower() or "style" in user_input.lower():
         target = find_target_person(user_input, context_results)
-        style, image_url = tool_generate_style_advice(target["mbti"], api_key, base_url, model_name)
-        return style, image_url
+        style, image_ref = tool_generate_style_advice(target["mbti"], api_key, base_url, model_name)
+        return style, image_ref
     
     # --- IMAGE HANDLER ---
     image_keywords = ["generate", "draw", "picture", "image", "visualize", "sketch", "paint"]
@@ -502,6 +710,7 @@ Rules:
     except Exception as e:
         return f"❌ Error: {str(e)}", None
 
+@profiling.profiled
 def run_interview_step(user_input, chat_history, current_mbti_guess, api_key, base_url, model_name):
     """
     AI psychologist refines user's MBTI through conversation
@@ -520,6 +729,13 @@ Guidelines:
 5. Do NOT output JSON - just have a natural conversation
 """
     
+    # The same reply to the same interviewer question gets the same follow-up
+    last_question = next((m["content"] for m in reversed(chat_history)
+                          if m["role"] == "assistant" and isinstance(m["content"], str)), "")
+    cached = answer_cache.lookup("interview", current_mbti_guess, model_name, user_input, context=last_question)
+    if cached is not None:
+        return cached
+
     messages = [{"role": "system", "content": system_prompt}]
     for msg in chat_history[-6:]:
         messages.append({"role": msg["role"], "content": msg["content"]})
@@ -527,10 +743,15 @@ Guidelines:
     
     try:
         ai_msg = call_llama_api(messages, api_key, base_url, model_name, force_json=False)
-        return ai_msg.get('content', "I'm listening... Tell me more.")
+        reply = ai_msg.get('content')
+        if not reply:
+            return "I'm listening... Tell me more."
+        answer_cache.store("interview", current_mbti_guess, model_name, user_input, reply, context=last_question)
+        return reply
     except Exception as e:
         return f"I'm having trouble processing that. Could you rephrase? (Error: {str(e)})"
 
+@profiling.profiled
 def run_growth_advisor_step(user_input, chat_history, user_mbti, api_key, base_url, model_name):
     """
     AI Life Coach provides personalized MBTI-based advice
@@ -547,6 +768,14 @@ Your role:
 {user_mbti} Key Traits: Consider their natural tendencies when giving advice.
 """
     
+    # Near-duplicate questions from the same type are answered from the cache; a follow-up
+    # only matches one asked after the same coach reply, never a fresh question from elsewhere
+    last_reply = next((m["content"] for m in reversed(chat_history)
+                       if m["role"] == "assistant" and isinstance(m["content"], str)), "")
+    cached = answer_cache.lookup("growth", user_mbti, model_name, user_input, context=last_reply)
+    if cached is not None:
+        return cached
+
     messages = [{"role": "system", "content": system_prompt}]
     for msg in chat_history[-4:]:
         messages.append({"role": msg["role"], "content": msg["content"]})
@@ -554,6 +783,10 @@ Your role:
     
     try:
         ai_msg = call_llama_api(messages, api_key, base_url, model_name)
-        return ai_msg.get('content', "Let me think about that...")
+        reply = ai_msg.get('content')
+        if not reply:
+            return "Let me think about that..."
+        answer_cache.store("growth", user_mbti, model_name, user_input, reply, context=last_reply)
+        return reply
     except Exception as e:
         return f"I'm having trouble generating advice. (Error: {str(e)})"
\ No newline at end of file
@@ -0,0 +1,183 @@
+import re
+import sys
+import time
+import zlib
+import threading
+from collections import OrderedDict
+
+import config
+
+# Estimated Jaccard similarity of two questions' n-gram sets needed to reuse an answer
+SIMILARITY_THRESHOLD = float(config.env("MBTI_ANSWER_SIMILARITY", "0.7"))
+MAX_ENTRIES = int(config.env("MBTI_ANSWER_CACHE_SIZE", "2000"))
+ANSWER_TTL_SECONDS = 7 * 24 * 3600
+NUM_HASHES = 64
+SHINGLE_SIZE = 3
+
+# Filler that changes how a question is phrased but not what it asks
+FILLER_WORDS = {
+    "a", "an", "the", "i", "me", "my", "im", "i'm", "you", "your", "we", "to", "of", "for", "in", "on",
+    "at", "is", "are", "am", "be", "do", "does", "can", "could", "should", "would", "will", "how",
+    "what", "any", "some", "please", "tips", "tip", "ways", "way", "advice", "help", "suggestions",
+    "deal", "with", "handle", "overcome", "get",
+    "and", "or", "so", "about", "give", "tell", "there", "it", "this", "that",
+}
+# Ways of asking to get rid of something all mean the same; "more"/"less", "start"/"stop" do not
+CANONICAL_WORDS = {w: "stop" for w in (
+    "stop", "stopping", "avoid", "avoiding", "quit", "quitting", "against", "prevent", "preventing",
+    "resist", "resisting", "beat", "beating")}
+SUFFIXES = ("ations", "ating", "ation", "ates", "ings", "ing", "ions", "ion", "ness", "ate", "ed", "es", "s")
+WORD_RE = re.compile(r"[a-z']+|[0-9]+|[\u4e00-\u9fff]+")
+CJK_RE = re.compile(r"[\u4e00-\u9fff]")
+CJK_FILLER_RE = re.compile(r"如何|怎麼|怎么|怎樣|怎样|可以|應該|应该|請問|请问|建議|建议|方法|我|你|要|該|该|的|呢|嗎|吗|啊")
+
+_PRIME = (1 << 31) - 1
+_coeffs = None  # (a, b) arrays for the MinHash permutations, built on first use
+
+_entries = OrderedDict()  # (bucket, normalized question) -> {"sig", "answer", "created_at"}
+_buckets = {}             # bucket -> set of entry keys, so lookups only scan one type/model
+_stats = {"hits": 0, "near_hits": 0, "misses": 0}
+_lock = threading.Lock()
+
+# ==========================================
+# 1. Question Signatures
+# ==========================================
+def _stem(word):
+    for suffix in SUFFIXES:
+        if len(word) > len(suffix) + 3 and word.endswith(suffix):
+            return word[:-len(suffix)]
+    return word
+
+def normalize_question(text):
+    """Lowercase, drop filler words and crude suffixes: 'Tips against procrastination?' -> 'stop procrastin'."""
+    words = WORD_RE.findall(CJK_FILLER_RE.sub(" ", (text or "").lower()))
+    kept = [CANONICAL_WORDS.get(w) or _stem(w) for w in (w.strip("'") for w in words) if w not in FILLER_WORDS]
+    return " ".join(kept or words)
+
+def shingles(normalized, size=SHINGLE_SIZE):
+    """Character n-grams per word; Chinese runs use bigrams, since two characters already make a word."""
+    grams = set()
+    for token in normalized.split() or [normalized]:
+        n = 2 if CJK_RE.match(token) else size
+        if CJK_RE.match(token) is None:
+            token = f" {token} "
+        if len(token) <= n:
+            grams.add(token)
+        else:
+            grams.update(token[i:i + n] for i in range(len(token) - n + 1))
+    return grams
+
+def signature(normalized):
+    """MinHash of the question's character n-grams (NUM_HASHES uint64 values)."""
+    global _coeffs
+    np = config.lazy_import("numpy")
+    if _coeffs is None:
+        rng = np.random.default_rng(12345)
+        _coeffs = (rng.integers(1, _PRIME, NUM_HASHES, dtype=np.uint64),
+                   rng.integers(0, _PRIME, NUM_HASHES, dtype=np.uint64))
+    a, b = _coeffs
+    x = np.array([zlib.crc32(s.encode("utf-8")) % _PRIME for s in shingles(normalized)], dtype=np.uint64)
+    return ((np.outer(x, a) + b) % _PRIME).min(axis=0)
+
+# ==========================================
+# 2. Cache
+# ==========================================
+def _bucket(scope, mbti_type, model_name, context=""):
+    return (scope, (mbti_type or "").upper(), model_name or "", zlib.crc32(context.encode("utf-8")) if context else 0)
+
+def _drop(key):
+    _entries.pop(key, None)
+    members = _buckets.get(key[0])
+    if members is not None:
+        members.discard(key)
+        if not members:
+            del _buckets[key[0]]
+
+def _prune():
+    cutoff = time.time() - ANSWER_TTL_SECONDS
+    while _entries:
+        key, entry = next(iter(_entries.items()))
+        if entry["created_at"] >= cutoff and len(_entries) <= MAX_ENTRIES:
+            break
+        _drop(key)
+
+def lookup(scope, mbti_type, model_name, question, context="", threshold=None):
+    """
+    A stored answer to the same or a near-duplicate question for this type and
+    model, or None. context narrows the match (e.g. the interviewer's last question).
+    """
+    threshold = SIMILARITY_THRESHOLD if threshold is None else threshold
+    bucket = _bucket(scope, mbti_type, model_name, context)
+    normalized = normalize_question(question)
+    with _lock:
+        _prune()
+        entry = _entries.get((bucket, normalized))
+        if entry:
+            _entries.move_to_end((bucket, normalized))
+            _stats["hits"] += 1
+            return entry["answer"]
+        keys = list(_buckets.get(bucket, ()))
+        sigs = [_entries[k]["sig"] for k in keys]
+    if not keys:
+        with _lock:
+            _stats["misses"] += 1
+        return None
+
+    np = config.lazy_import("numpy")
+    similarity = (np.stack(sigs) == signature(normalized)).mean(axis=1)
+    best = int(similarity.argmax())
+    with _lock:
+        if similarity[best] >= threshold and keys[best] in _entries:
+            _entries.move_to_end(keys[best])
+            _stats["near_hits"] += 1
+            return _entries[keys[best]]["answer"]
+        _stats["misses"] += 1
+    return None
+
+def store(scope, mbti_type, model_name, question, answer, context=""):
+    bucket = _bucket(scope, mbti_type, model_name, context)
+    normalized = normalize_question(question)
+    sig = signature(normalized)
+    with _lock:
+        key = (bucket, normalized)
+        _drop(key)
+        _entries[key] = {"sig": sig, "answer": answer, "created_at": time.time()}
+        _buckets.setdefault(bucket, set()).add(key)
+        _prune()
+
+def clear():
+    with _lock:
+        _entries.clear()
+        _buckets.clear()
+
+def cache_stats():
+    with _lock:
+        return {**_stats, "entries": len(_entries), "buckets": len(_buckets)}
+
+# ==========================================
+# 3. Check
+# ==========================================
+# (question, question, should share an answer) at the default threshold
+CHECK_PAIRS = [
+    ("how do I stop procrastinating", "tips against procrastination", True),
+    ("how can I avoid conflict", "ways to stop conflicts", True),
+    ("how to start procrastinating", "how to stop procrastinating", False),
+    ("how can I be more assertive", "how can I be less assertive", False),
+]
+
+def question_similarity(a, b):
+    """Estimated similarity lookup() would see between two questions."""
+    return float((signature(normalize_question(a)) == signature(normalize_question(b))).mean())
+
+def main():
+    """python answer_cache.py: exit 1 if any CHECK_PAIRS pair matches (or misses) unexpectedly."""
+    failed = 0
+    for a, b, should_match in CHECK_PAIRS:
+        score = question_similarity(a, b)
+        ok = (score >= SIMILARITY_THRESHOLD) == should_match
+        failed += not ok
+        print(f"{'✅' if ok else '❌'} {score:.2f} {'match' if should_match else 'miss '}  {a!r} / {b!r}")
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,22 +1,30 @@
 import streamlit as st
-import os
 import json
-import urllib.parse
-import random
-import requests 
-from dotenv import load_dotenv
+import time
 
+import config
 import mbti
+import chat_formats
 import charts
 import agent
+import store
+import profiles
+import jobs
+import images
+import session_store
+import profiling
+import style_guides
 
-load_dotenv()
+config.load_config()
 
 # ==========================================
 # Page Config & Theme
 # ==========================================
 st.set_page_config(page_title="🎄 MBTI North Pole", layout="wide")
 
+# MBTI_PROFILE=1 profiles every script run; a no-op otherwise
+profiling.begin_run(session_store.session_id(st.session_state))
+
 def set_cute_theme():
     st.markdown("""
     <style>
@@ -90,21 +98,32 @@ with st.sidebar:
     api_base = None
     api_key = None
     
-    pollinations_key = os.getenv("POLL_API_KEY")
 
     if connection_type == "Remote NCKU":
-        api_base = os.getenv("API_BASE_URL")
-        api_key = os.getenv("API_KEY")
+        api_base = config.env("API_BASE_URL")
+        api_key = config.env("API_KEY")
         model_name = "gemma3:4b"
         if not api_key: 
             api_key = st.text_input("Secret Key", type="password")
     else:
-        api_base = os.getenv("LOCAL_OLLAMA_URL", "http://localhost:11434")
-        api_key = os.getenv("OLLAMA_API_KEY", "ollama")
+        api_base = config.env("LOCAL_OLLAMA_URL", "http://localhost:11434")
+        api_key = config.env("OLLAMA_API_KEY", "ollama")
         model_name = "llama3.2:1b"
         if not api_key: 
             api_key = st.text_input("Secret Key", type="password")
             
+    # Precompute the 16 style guides for this model while users do other things
+    if api_key and api_base:
+        style_guides.warm_in_background(api_key, api_base, model_name)
+
+    quick_precheck = st.checkbox("⚡ Skip AI for clear-cut speakers", value=False, key="sidebar_precheck",
+                                 help="Uses a quick writing-style estimate instead of the AI for obvious cases. "
+                                      "Those results are marked ⚡.")
+    reuse_results = st.checkbox("♻️ Reuse results for unchanged speakers", value=True, key="sidebar_reuse")
+    analysis_samples = st.select_slider(
+        "🎲 Votes per analysis", options=[1, 3, 5], value=1, key="sidebar_samples",
+        help="Run several analyses at once and let them vote; stops as soon as every speaker has a majority.")
+
     st.markdown("---")
     with st.expander("🔧 Troubleshooting"):
         st.markdown("""
@@ -114,14 +133,51 @@ with st.sidebar:
         3. Try Local Ollama instead
         """)
     
+    with st.expander("📦 Session Memory"):
+        for name, size, where in session_store.session_report(st.session_state):
+            st.caption(f"{name}: {size / 1024:.0f} KB ({where})")
+        usage = session_store.global_report()
+        st.caption(f"Server: {usage['sessions']} sessions, "
+                   f"{usage['memory_bytes'] / 1024 / 1024:.1f} MB in memory, "
+                   f"{usage['disk_bytes'] / 1024 / 1024:.1f} MB spilled")
+
+    with st.expander("⏱️ Startup Cost"):
+        for name, ms in config.deferred_import_times():
+            st.caption(f"{name}: {ms:.0f} ms (deferred)")
+        if st.button("Measure cold import"):
+            try:
+                st.code(config.format_report(config.import_time_report()), language=None)
+            except Exception as e:
+                st.error(f"Report Error: {e}")
+
+    if profiling.ENABLED:
+        with st.expander("🔬 Profiler"):
+            runs = profiling.recent_profiles()
+            if not runs:
+                st.caption("No profiles yet: this run's profile appears on the next rerun.")
+            else:
+                labels = [f"{time.strftime('%H:%M:%S', time.localtime(p['started_at']))} {p['label']} "
+                          f"({p['seconds'] * 1000:.0f} ms)" for p in runs]
+                pick = st.selectbox("Profile", range(len(runs)), format_func=lambda i: labels[i], key="profiler_pick")
+                picked = runs[min(pick, len(runs) - 1)]
+                if picked.get("deterministic", True):
+                    st.dataframe(picked["hotspots"][:15], width="stretch", hide_index=True)
+                else:
+                    st.caption("No function table: another profile held cProfile at the time; "
+                               "spans and flame graph only.")
+                for label, seconds in picked["spans"]:
+                    st.caption(f"{label}: {seconds * 1000:.0f} ms")
+                st.download_button("🔥 Flame graph (folded stacks)", profiling.folded_stacks(picked),
+                                   file_name="mbti_profile.folded", key="profiler_dl")
+
     if st.button("🗑️ Refresh"):
+        session_store.clear(st.session_state)
         st.session_state.clear()
         st.rerun()
 
 # ==========================================
 # State Initialization
 # ==========================================
-if "parsed_speakers" not in st.session_state: st.session_state.parsed_speakers = {}
 if "analysis_results" not in st.session_state: st.session_state.analysis_results = None
 if "chat_messages" not in st.session_state: st.session_state.chat_messages = []
 if "charts_data" not in st.session_state: st.session_state.charts_data = None 
@@ -132,141 +188,170 @@ if "interview_history" not in st.session_state: st.session_state.interview_histo
 if "quiz_scores" not in st.session_state: st.session_state.quiz_scores = None
 if "growth_mbti" not in st.session_state: st.session_state.growth_mbti = None
 if "growth_history" not in st.session_state: st.session_state.growth_history = []
+if "parsed_file_id" not in st.session_state: st.session_state.parsed_file_id = None
+if "speaker_fingerprints" not in st.session_state: st.session_state.speaker_fingerprints = {}
+if "chat_fp" not in st.session_state: st.session_state.chat_fp = None
+if "speaker_profiles" not in st.session_state: st.session_state.speaker_profiles = {}
+if "analysis_job" not in st.session_state: st.session_state.analysis_job = None
+if "analysis_notice" not in st.session_state: st.session_state.analysis_notice = None
 
-# ==========================================
-# Helper Function: Secure Image Gen
-# ==========================================
-def generate_pollinations_image(prompt_text):
-    """
-    Generates an image using the official Pollinations.ai API documentation.
-    Downloads server-side to handle Authentication and Headers securely.
-    """
-    try:
-        enhanced_prompt = f"{prompt_text}, cute style, digital art, 4k"
-        safe_prompt = urllib.parse.quote(enhanced_prompt)
-        seed = random.randint(1, 99999)
-    
-        url = f"https://image.pollinations.ai/prompt/{safe_prompt}?width=1024&height=1024&seed={seed}&model=flux&nologo=true"
-
-        headers = {
-            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
-            "Accept": "image/*"
-        }
-        if pollinations_key:
-            headers["Authorization"] = f"Bearer {pollinations_key}"
-
-        response = requests.get(url, headers=headers, timeout=30)
-        
-        if response.status_code == 200:
-            if "image" in response.headers.get("Content-Type", ""):
-                return {"type": "bytes", "data": response.content}
-            else:
-                return {"type": "error", "data": "API returned text/html instead of an image."}
-        else:
-            return {"type": "error", "data": f"API Error {response.status_code}: {response.text}"}
+# Keep every chat history bounded; older turns are never sent to the model anyway
+for history_key in ("chat_messages", "interview_history", "growth_history"):
+    session_store.trim_history(st.session_state[history_key])
 
-    except Exception as e:
-        return {"type": "error", "data": str(e)}
 # ==========================================
-# Main UI
+# Helper Function: Image Messages
 # ==========================================
-st.image("https://parade.com/.image/w_1080,q_auto:good,c_limit/MTkwNTgxMDYyNDUyNTIwODI4/santa-facts-jpg.jpg?arena_f_auto", width=150)
-st.title("AI MBTI")
-st.markdown("### *Analyzing personalities, one chat at a time!*")
+def show_image_ref(ref, msg_index):
+    """Render an image message ({"type": "image", "key", "job_id", "caption"}) from the blob store."""
+    status, detail = images.image_status(ref)
+    if status == "ready":
+        thumb = images.get_cached(ref["key"], thumb=True)
+        st.image(thumb or detail, caption=f"🖼 {ref['caption']}")
+        # The same picture can appear in several messages, so the widget is keyed by message;
+        # the full-size file is only read when the button is clicked
+        extension, mime = images.image_format(ref["key"])
+        st.download_button("⬇️ Full size", lambda: images.read_image(ref["key"]), mime=mime,
+                           file_name=f"{ref['key'][:12]}.{extension}", key=f"dl_{msg_index}_{ref['key']}")
+    elif status == "pending":
+        st.info("🎨 The elves are painting...")
+    else:
+        st.error(detail)
 
-tab_upload, tab_test, tab_growth = st.tabs(["📂 Analyze Chat", "📝 Take Test", "🌱 Personal Growth"])
+@st.fragment(run_every=2.0)
+def pending_image(ref, msg_index):
+    """Polls one image in flight; hands back to a full run once it is ready or failed."""
+    status, _ = images.image_status(ref)
+    if status != "pending":
+        st.rerun(scope="app")
+    show_image_ref(ref, msg_index)
 
 # ==========================================
-# TAB 1: Chat Analysis
+# Helper Function: Analysis Jobs
 # ==========================================
-with tab_upload:
-    uploaded_file = st.file_uploader("📂 Drop your chat file here", type=['txt'])
-    
-    if not uploaded_file and not st.session_state.analysis_results:
-        st.info("👋 **Welcome!** Upload a chat history to get started. 🎁")
-    
-    if uploaded_file and api_base:
-        if not st.session_state.parsed_speakers:
-            content = uploaded_file.getvalue().decode("utf-8")
-            st.session_state.parsed_speakers = mbti.parse_line_chat_dynamic(content)
-
-        if st.session_state.parsed_speakers:
-            speakers = st.session_state.parsed_speakers
-            names = list(speakers.keys())
-            
-            st.markdown("### 👥 Who is on the list?")
-            selected = st.multiselect("Pick friends:", names, default=names)
-            
-            if st.button("🚀 Run Analysis"):
-                if not selected:
-                    st.warning("Pick someone!")
-                elif not api_key or not api_base:
-                    st.error("❌ API credentials missing! Please configure in sidebar.")
-                else:
-                    with st.spinner("🦌 Crunching numbers..."):
-                        try:
-                            data = {n: speakers[n] for n in selected}
-                            sys_prompt, user_content = mbti.construct_analysis_prompt(data)
-                            
-                            res = agent.run_analysis_request(
-                                sys_prompt, user_content, selected, 
-                                api_key, api_base, model_name)
-                            
-                            if res and "results" in res:
-                                st.session_state.analysis_results = res["results"]
-                                st.session_state.chat_messages = []
-                                st.session_state.charts_data = None
-                                
-                                intro_msg = f"**Analysis Complete!** 🎄\n"
-                                for p in res["results"]:
-                                    intro_msg += f"\n* **{p['name']}**: `{p['mbti']}`"
-                                st.session_state.chat_messages.append({
-                                    "role": "assistant", 
-                                    "content": intro_msg
-                                })
-                                st.success("✅ Analysis complete!")
-                                st.rerun()
-                            else:
-                                st.error("Analysis returned invalid format.")
-                                
-                        except Exception as e:
-                            st.error(f"❌ Analysis Failed: {str(e)}")
+def source_note(person):
+    """Marks results that came from the local style heuristic rather than the AI."""
+    return " ⚡ _quick estimate_" if person.get("source") == "stylometry" else ""
 
-# Results & Chat
-if st.session_state.analysis_results:
-    st.markdown("---")
-    
-    if st.session_state.charts_data:
-        st.subheader("📊 Visualizations")
-        tab1, tab2, tab3 = st.tabs(["✨ Spectrum", "📊 Bar Chart", "🕸️ Radar"])
-        with tab1:
-            st.plotly_chart(st.session_state.charts_data['spectrum'], use_container_width=True)
-        with tab2:
-            st.plotly_chart(st.session_state.charts_data['bar'], use_container_width=True)
-        with tab3:
-            st.plotly_chart(st.session_state.charts_data['radar'], use_container_width=True)
+def apply_analysis_results(job_meta, res):
+    """Merge a finished analysis job into session state, the store and speaker profiles."""
+    selected, pending = job_meta["selected"], set(job_meta["pending"])
+    streams = session_store.get(st.session_state, "parse_state", {"messages": {}})["messages"]
+
+    results = job_meta["reused"] + res.get("results", [])
+    order = {n: i for i, n in enumerate(selected)}
+    results.sort(key=lambda p: order.get(p.get("name"), len(order)))
 
+    st.session_state.analysis_results = results
+    fresh_fps = {n: mbti.fingerprint_messages(streams[n]) for n in pending if n in streams}
+    st.session_state.speaker_fingerprints.update(fresh_fps)
+    try:
+        store.save_results(
+            st.session_state.chat_fp,
+            [p for p in results if p["name"] in pending],
+            job_meta["model_name"], fingerprints=fresh_fps, raw_output=res.get("raw"))
+    except Exception as e:
+        print(f"Store Error: {e}")
+    try:
+        for p in results:
+            if p["name"] in pending and p["name"] in streams:
+                profiles.record_speaker(p["name"], st.session_state.chat_fp, streams[p["name"]], p)
+        st.session_state.speaker_profiles = profiles.profile_context(list(selected))
+    except Exception as e:
+        print(f"Profile Error: {e}")
+    st.session_state.chat_messages = []
+    st.session_state.charts_data = None
+
+    intro_msg = f"**Analysis Complete!** 🎄\n"
+    for p in results:
+        intro_msg += f"\n* **{p['name']}**: `{p['mbti']}`" + source_note(p)
+        if p.get("votes", 1) > 1:
+            intro_msg += f" ({p['agreement']:.0%} agreement over {p['votes']} votes)"
+    st.session_state.chat_messages.append({
+        "role": "assistant", 
+        "content": intro_msg
+    })
+
+def show_partial_results(job_meta, partial):
+    """Speakers analysed so far, and a chart that grows as each one arrives."""
+    order = {n: i for i, n in enumerate(job_meta["selected"])}
+    arrived = sorted(job_meta["reused"] + partial, key=lambda p: order.get(p.get("name"), len(order)))
+    names = {p["name"] for p in arrived}
+    waiting = [n for n in job_meta["selected"] if n not in names]
+
+    lines = [f"* **{p['name']}**: `{p['mbti']}`{source_note(p)}" for p in arrived]
+    if waiting:
+        lines.append(f"* ⏳ {len(waiting)} still thinking...")
+    st.markdown("\n".join(lines))
+    try:
+        kind = charts.default_chart_kinds(arrived)[0]
+        # Figures are cached by result set, so polling reruns only rebuild when someone new arrives
+        fig_json = charts.get_charts_json(arrived, kinds=(kind,))[kind]
+        st.plotly_chart(charts.figure_from_json(fig_json), use_container_width=True)
+    except Exception as e:
+        print(f"Chart Error: {e}")
+
+@st.fragment(run_every=1.0)
+def analysis_job_panel():
+    """Polls the background analysis job; only this fragment reruns while it is in flight."""
+    job_meta = st.session_state.analysis_job
+    job = jobs.get_job(job_meta["id"]) if job_meta else None
+    if not job:
+        st.session_state.analysis_job = None
+        return
+
+    if job["status"] in ("queued", "running"):
+        progress = job["done"] / job["total"] if job["total"] else 0.0
+        st.progress(progress, text=f"🦌 {job['message']}")
+        if st.button("✋ Cancel Analysis"):
+            jobs.cancel(job["id"])
+        if job["partial"]:
+            show_partial_results(job_meta, job["partial"])
+    elif job["status"] == "done":
+        st.session_state.analysis_job = None
+        apply_analysis_results(job_meta, job["result"])
+        st.rerun(scope="app")
+    else:
+        # Shown by the full script run, since this fragment stops polling once the job is gone
+        st.session_state.analysis_job = None
+        if job["status"] == "failed":
+            st.session_state.analysis_notice = f"❌ Analysis Failed: {job['error']}"
+        else:
+            st.session_state.analysis_notice = "Analysis cancelled."
+        st.rerun(scope="app")
+
+# ==========================================
+# Fragments: Chat, Quiz & Growth
+# ==========================================
+# Each region reruns on its own; only uploads, tab switches, sidebar changes
+# and chart updates re-execute the whole script.
+@st.fragment
+def elf_chat_panel():
+    """Chat with Elf: history plus input. A new message reruns only this region."""
     st.markdown("### 💬 Chat with Elf")
-    for msg in st.session_state.chat_messages:
+    for i, msg in enumerate(st.session_state.chat_messages):
         with st.chat_message(msg["role"]):
-            if isinstance(msg["content"], bytes):
-                st.image(msg["content"], caption="Generated Art")
+            if isinstance(msg["content"], dict) and msg["content"].get("type") == "image":
+                if images.image_status(msg["content"])[0] == "pending":
+                    pending_image(msg["content"], i)
+                else:
+                    show_image_ref(msg["content"], i)
             else:
                 st.markdown(msg["content"])
 
     if prompt := st.chat_input("Ask about compatibility..."):
         st.session_state.chat_messages.append({"role": "user", "content": prompt})
-        with st.chat_message("user"): 
+        with st.chat_message("user"):
             st.markdown(prompt)
-        
+
         with st.chat_message("assistant"):
             with st.spinner("Thinking..."):
                 try:
                     temp_messages = st.session_state.chat_messages.copy()
                     temp_messages = [m for m in temp_messages if isinstance(m["content"], str)]
-                    
+
                     temp_messages.append({
-                        "role": "system", 
+                        "role": "system",
                         "content": (
                             "You are a creative personality AI. Describe the user's MBTI as an animal metaphor if user asked for it. Output ONLY TOOL:IMAGE followed by the description."
                             "CRITICAL SYSTEM OVERRIDE: The user is asking for ARTISTIC, METAPHORICAL visual descriptions based on personality types. "
@@ -277,78 +362,85 @@ if st.session_state.analysis_results:
                     })
 
                     resp_text, extra = agent.generate_chat_response(
-                        prompt, 
-                        temp_messages, 
+                        prompt,
+                        temp_messages,
                         st.session_state.analysis_results,
-                        api_key, api_base, model_name, mbti.is_chinese
+                        api_key, api_base, model_name, mbti.is_chinese,
+                        profile_context=st.session_state.speaker_profiles
                     )
-                    
+
                     resp_text = str(resp_text) if resp_text is not None else ""
-                    
+
                     if resp_text == "TOOL:CHART":
+                        # Serialized figures are shared with the process-wide cache, not copied per session
+                        st.session_state.charts_data = charts.get_charts_json(st.session_state.analysis_results)
+                        final_msg = "📊 I've painted some charts for you! (See tabs above)"
+                        st.markdown(final_msg)
+                        st.session_state.chat_messages.append({"role": "assistant", "content": final_msg})
+                        # The charts live outside this fragment
+                        st.rerun(scope="app")
+
+                    elif resp_text == "TOOL:COMPAT":
                         results = st.session_state.analysis_results
-                        charts_dict = {
-                            'spectrum': charts.generate_bipolar_chart(results),
-                            'bar': charts.generate_group_bar_chart(results),
-                            'radar': charts.generate_radar_chart(results)
+                        st.session_state.charts_data = {
+                            **charts.get_charts_json(results),
+                            **charts.get_charts_json(results, kinds=('compat',))
                         }
-                        st.session_state.charts_data = charts_dict
-                        final_msg = "📊 I've painted some charts for you! (See tabs above)"
+                        final_msg = extra + "\n\n(See the 💞 Compatibility tab above)"
                         st.markdown(final_msg)
                         st.session_state.chat_messages.append({"role": "assistant", "content": final_msg})
-                        st.rerun()
+                        st.rerun(scope="app")
 
                     elif resp_text.startswith("TOOL:IMAGE"):
                         if resp_text == "TOOL:IMAGE" and extra:
                             desc = extra
                         else:
                             desc = resp_text[len("TOOL:IMAGE"):].strip()
-                            if not desc: desc = prompt 
-
-                        image_result = generate_pollinations_image(desc)
-                        
-                        if image_result["type"] == "bytes":
-                            st.image(image_result["data"], caption=f"🖼 {desc}")
-                        elif image_result["type"] == "url":
-                            st.image(image_result["data"], caption=f"🖼 {desc}")
-                        else:
-                            st.error(image_result["data"])
+                            if not desc: desc = prompt
+
+                        # Only a reference goes into the chat history; the bytes live in the blob store
+                        ref = images.request_image(desc)
+                        ref.update({"type": "image", "caption": desc})
+                        st.session_state.chat_messages.append({"role": "assistant", "content": ref})
+                        st.rerun(scope="fragment")
                     else:
                         st.markdown(resp_text)
                         st.session_state.chat_messages.append({"role": "assistant", "content": resp_text})
-                        
+                        if isinstance(extra, dict) and extra.get("type") == "image":
+                            # Style guides come with an outfit picture from the image blob store
+                            st.session_state.chat_messages.append({"role": "assistant", "content": extra})
+                            st.rerun(scope="fragment")
+
                 except Exception as e:
                     error_msg = f"❌ Error: {str(e)}"
                     st.error(error_msg)
                     st.session_state.chat_messages.append({"role": "assistant", "content": error_msg})
 
-# ==========================================
-# TAB 2: Quiz
-# ==========================================
-with tab_test:
-    st.header("🧠 Personality Self-Test")
+@st.fragment
+def quiz_panel():
+    """The self-test form and its result; submitting reruns only this region."""
     questions = mbti.get_quiz_questions()
-    
+
     if not st.session_state.quiz_finished:
         st.write(f"Answer these {len(questions)} questions to find your type!")
-        
+
         current_answers = len(st.session_state.quiz_answers)
         progress = current_answers / len(questions) if len(questions) > 0 else 0
         st.progress(progress)
-        
+
         with st.form("quiz_form"):
             for q in questions:
                 text = q["txt_cn"] if mbti.is_chinese(st.session_state.get("ui_lang","")) else q["txt_en"]
                 st.markdown(f"**{q['id']}. {text}**")
                 val = st.radio(
-                    "Select:", 
+                    "Select:",
                     ["Strongly Disagree", "Disagree", "Neutral", "Agree", "Strongly Agree"],
-                    index=None, 
-                    horizontal=True, 
-                    key=f"q_{q['id']}", 
+                    index=None,
+                    horizontal=True,
+                    key=f"q_{q['id']}",
                     label_visibility="collapsed"
                 )
-            
+
             if st.form_submit_button("Calculate Type"):
                 all_answered = True
                 temp_answers = {}
@@ -359,10 +451,10 @@ with tab_test:
                         break
                     val_str = st.session_state[key]
                     temp_answers[q['id']] = {
-                        "Strongly Disagree": -2, "Disagree": -1, "Neutral": 0, 
+                        "Strongly Disagree": -2, "Disagree": -1, "Neutral": 0,
                         "Agree": 1, "Strongly Agree": 2
                     }.get(val_str, 0)
-                
+
                 if all_answered:
                     st.session_state.quiz_answers = temp_answers
                     mbti_type, scores = mbti.calculate_quiz_result(st.session_state.quiz_answers)
@@ -370,69 +462,72 @@ with tab_test:
                     st.session_state.quiz_scores = scores
                     st.session_state.quiz_finished = True
                     st.session_state.interview_history.append({
-                        "role": "assistant", 
+                        "role": "assistant",
                         "content": f"Hello! Based on the test, you seem to be **{mbti_type}**. I'm Dr. Elf. Let's chat!"
                     })
-                    st.rerun()
+                    st.rerun(scope="fragment")
                 else:
                     st.warning("Please answer all questions before submitting.")
     else:
         m_type = st.session_state.quiz_result_mbti
         st.balloons()
         st.success(f"🎉 Your Test Result: **{m_type}**")
-        
+
         fake_result = [{"name": "You", "mbti": m_type, "scores": st.session_state.quiz_scores}]
-        st.plotly_chart(charts.generate_radar_chart(fake_result), use_container_width=True)
-        
+        radar_json = charts.get_charts_json(fake_result, kinds=('radar',))['radar']
+        st.plotly_chart(charts.figure_from_json(radar_json), use_container_width=True)
+
         if st.button("🔄 Retake Test"):
             st.session_state.quiz_finished = False
             st.session_state.quiz_answers = {}
             st.session_state.interview_history = []
-            st.rerun()
+            st.rerun(scope="fragment")
 
-        st.markdown("### 🕵️‍♀️ Dr. Elf's Interview Room")
-        for msg in st.session_state.interview_history:
-            with st.chat_message(msg["role"]): 
-                st.markdown(msg["content"])
-                
-        if user_text := st.chat_input("Reply to Dr. Elf...", key="chat_tab2"):
-            st.session_state.interview_history.append({"role": "user", "content": user_text})
-            with st.chat_message("user"): 
-                st.markdown(user_text)
-            with st.chat_message("assistant"):
-                with st.spinner("Analyzing..."):
-                    try:
-                        reply = agent.run_interview_step(
-                            user_text, st.session_state.interview_history, 
-                            st.session_state.quiz_result_mbti, api_key, api_base, model_name)
-                        st.markdown(reply)
-                        st.session_state.interview_history.append({"role": "assistant", "content": reply})
-                    except Exception as e:
-                        st.error(f"Error: {str(e)}")
+        interview_panel()
 
-# ==========================================
-# TAB 3: Growth
-# ==========================================
-with tab_growth:
-    st.header("🌱 Personal Growth Coach")
+@st.fragment
+def interview_panel():
+    """Dr. Elf's interview; replies rerun only the interview, not the quiz result above it."""
+    st.markdown("### 🕵️‍♀️ Dr. Elf's Interview Room")
+    for msg in st.session_state.interview_history:
+        with st.chat_message(msg["role"]):
+            st.markdown(msg["content"])
+
+    if user_text := st.chat_input("Reply to Dr. Elf...", key="chat_tab2"):
+        st.session_state.interview_history.append({"role": "user", "content": user_text})
+        with st.chat_message("user"):
+            st.markdown(user_text)
+        with st.chat_message("assistant"):
+            with st.spinner("Analyzing..."):
+                try:
+                    reply = agent.run_interview_step(
+                        user_text, st.session_state.interview_history,
+                        st.session_state.quiz_result_mbti, api_key, api_base, model_name)
+                    st.markdown(reply)
+                    st.session_state.interview_history.append({"role": "assistant", "content": reply})
+                except Exception as e:
+                    st.error(f"Error: {str(e)}")
 
+@st.fragment
+def growth_panel():
+    """Personal growth coach; type entry and advice rerun only this region."""
     if not st.session_state.growth_mbti:
         c1, c2 = st.columns([3, 1])
         with c1: user_input_mbti = st.text_input("Enter MBTI (e.g., INTJ):", max_chars=4)
-        with c2: 
+        with c2:
             st.write("")
             st.write("")
             if st.button("Start"):
                 if len(user_input_mbti) == 4:
                     st.session_state.growth_mbti = user_input_mbti.upper()
                     st.session_state.growth_history = [{"role": "assistant", "content": f"Hello {user_input_mbti.upper()}! How can I help?"}]
-                    st.rerun()
+                    st.rerun(scope="fragment")
 
     else:
         st.info(f"Coaching: **{st.session_state.growth_mbti}**")
         if st.button("🔄 Change"):
             st.session_state.growth_mbti = None
-            st.rerun()
+            st.rerun(scope="fragment")
 
         for msg in st.session_state.growth_history:
             with st.chat_message(msg["role"]): st.markdown(msg["content"])
@@ -440,13 +535,147 @@ with tab_growth:
         if prompt := st.chat_input("Ask for advice..."):
             st.session_state.growth_history.append({"role": "user", "content": prompt})
             with st.chat_message("user"): st.markdown(prompt)
-            
+
             with st.chat_message("assistant"):
                 reply = agent.run_growth_advisor_step(
-                    prompt, 
-                    st.session_state.growth_history, 
+                    prompt,
+                    st.session_state.growth_history,
                     st.session_state.growth_mbti,
                     api_key, api_base, model_name
                 )
                 st.markdown(reply)
-                st.session_state.growth_history.append({"role": "assistant", "content": reply})
\ No newline at end of file
+                st.session_state.growth_history.append({"role": "assistant", "content": reply})
+
+# ==========================================
+# Main UI
+# ==========================================
+st.image("https://parade.com/.image/w_1080,q_auto:good,c_limit/MTkwNTgxMDYyNDUyNTIwODI4/santa-facts-jpg.jpg?arena_f_auto", width=150)
+st.title("AI MBTI")
+st.markdown("### *Analyzing personalities, one chat at a time!*")
+
+# Only the open tab's body is built; switching tabs reruns the app for the new one
+tab_upload, tab_test, tab_growth = st.tabs(
+    ["📂 Analyze Chat", "📝 Take Test", "🌱 Personal Growth"], key="main_tab", on_change="rerun")
+
+# ==========================================
+# TAB 1: Chat Analysis
+# ==========================================
+if tab_upload.open:
+    with tab_upload:
+        uploaded_file = st.file_uploader("📂 Drop your chat file here", type=['txt'])
+    
+        if not uploaded_file and not st.session_state.analysis_results:
+            st.info("👋 **Welcome!** Upload a chat history to get started. 🎁")
+    
+        if uploaded_file and api_base:
+            parse_state = session_store.get(st.session_state, "parse_state")
+            speakers = session_store.get(st.session_state, "parsed_speakers")
+            if speakers is None:
+                # Either spilled value may have been evicted from disk; the pair is rebuilt together
+                parse_state = None
+            if st.session_state.parsed_file_id != uploaded_file.file_id or parse_state is None:
+                # Re-uploads of an appended export only parse the new tail
+                # LINE or WhatsApp, UTF-8 or UTF-16; the layout is detected from the first KB
+                content = chat_formats.decode_export(uploaded_file.getvalue())
+                speakers, parse_state = mbti.parse_line_chat_shared(content, parse_state)
+                # Large chats live on disk between reruns instead of in every session's memory
+                session_store.put(st.session_state, "parse_state", parse_state)
+                session_store.put(st.session_state, "parsed_speakers", speakers)
+                st.session_state.parsed_file_id = uploaded_file.file_id
+                st.session_state.chat_fp = store.chat_fingerprint(content)
+
+                # Restore results paid for in earlier sessions of the same group chat
+                if not st.session_state.analysis_results:
+                    try:
+                        stored, fingerprints = store.load_results(st.session_state.chat_fp, model_name)
+                    except Exception as e:
+                        print(f"Store Error: {e}")
+                        stored, fingerprints = [], {}
+                    stored = [p for p in stored if p["name"] in speakers]
+                    if stored:
+                        st.session_state.analysis_results = stored
+                        st.session_state.speaker_fingerprints = fingerprints
+                        try:
+                            st.session_state.speaker_profiles = profiles.profile_context([p["name"] for p in stored])
+                        except Exception as e:
+                            print(f"Profile Error: {e}")
+                        st.session_state.chat_messages = [{
+                            "role": "assistant",
+                            "content": "**Welcome back!** 🎄 Loaded earlier results:\n" +
+                                       "".join(f"\n* **{p['name']}**: `{p['mbti']}`{source_note(p)}" for p in stored)
+                        }]
+
+            speakers = session_store.get(st.session_state, "parsed_speakers", {})
+            if speakers:
+                names = list(speakers.keys())
+            
+                st.markdown("### 👥 Who is on the list?")
+                selected = st.multiselect("Pick friends:", names, default=names)
+            
+                if st.button("🚀 Run Analysis"):
+                    if not selected:
+                        st.warning("Pick someone!")
+                    elif not api_key or not api_base:
+                        st.error("❌ API credentials missing! Please configure in sidebar.")
+                    else:
+                        data = {n: speakers[n] for n in selected}
+                        streams = parse_state["messages"]
+
+                        # Speakers whose messages barely changed since their last analysis keep their result
+                        reused = []
+                        if reuse_results and st.session_state.analysis_results:
+                            previous = {p["name"]: p for p in st.session_state.analysis_results}
+                            changed = set(mbti.changed_speakers(
+                                {n: streams[n] for n in selected}, st.session_state.speaker_fingerprints))
+                            reused = [previous[n] for n in selected if n not in changed and n in previous]
+                        reused_names = {p["name"] for p in reused}
+                        pending = {n: data[n] for n in selected if n not in reused_names}
+
+                        if st.session_state.analysis_job:
+                            jobs.cancel(st.session_state.analysis_job["id"])
+                        try:
+                            job_id = jobs.submit_analysis(pending, api_key, api_base, model_name, quick_precheck,
+                                                      samples=analysis_samples)
+                            st.session_state.analysis_job = {
+                                "id": job_id, "selected": list(selected), "reused": reused,
+                                "pending": list(pending), "model_name": model_name
+                            }
+                        except Exception as e:
+                            st.error(f"❌ Analysis Failed: {str(e)}")
+
+                if st.session_state.analysis_notice:
+                    st.warning(st.session_state.analysis_notice)
+                    st.session_state.analysis_notice = None
+                if st.session_state.analysis_job:
+                    analysis_job_panel()
+
+        # Results & Chat
+        if st.session_state.analysis_results:
+            st.markdown("---")
+
+            if st.session_state.charts_data:
+                st.subheader("📊 Visualizations")
+                chart_tabs = st.tabs([charts.CHART_TITLES[k] for k in st.session_state.charts_data])
+                for chart_tab, fig_json in zip(chart_tabs, st.session_state.charts_data.values()):
+                    with chart_tab:
+                        st.plotly_chart(charts.figure_from_json(fig_json), use_container_width=True)
+
+            elf_chat_panel()
+
+# ==========================================
+# TAB 2: Quiz
+# ==========================================
+if tab_test.open:
+    with tab_test:
+        st.header("🧠 Personality Self-Test")
+        quiz_panel()
+
+# ==========================================
+# TAB 3: Growth
+# ==========================================
+if tab_growth.open:
+    with tab_growth:
+        st.header("🌱 Personal Growth Coach")
+        growth_panel()
+
+profiling.end_run(session_store.session_id(st.session_state))
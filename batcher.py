@@ -0,0 +1,130 @@
+import time
+import heapq
+import itertools
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+
+import config
+import ratelimit
+
+ENABLED = config.env("MBTI_LLM_BATCHING", "1") == "1"
+# Requests the backend decodes side by side; match the server's OLLAMA_NUM_PARALLEL
+NUM_PARALLEL = max(1, int(config.env("OLLAMA_NUM_PARALLEL", "4")))
+# How long the first request of a batch waits for company before the batch is sent
+WINDOW_SECONDS = float(config.env("MBTI_LLM_BATCH_WINDOW_MS", "15")) / 1000
+
+_lanes = {}  # (base_url, model) -> lane; one per backend model, shared by every session
+_slots = {}  # base_url -> semaphore of its parallel slots, shared by all of its models
+_lanes_lock = threading.Lock()
+_tickets = itertools.count()
+
+# ==========================================
+# 1. Lanes
+# ==========================================
+def _lane(base_url, model_name):
+    key = (base_url.rstrip("/"), model_name or "")
+    with _lanes_lock:
+        lane = _lanes.get(key)
+        if lane is None:
+            requests = config.lazy_import("requests")
+            # The server decodes NUM_PARALLEL requests whichever models they are for
+            if key[0] not in _slots:
+                _slots[key[0]] = threading.BoundedSemaphore(NUM_PARALLEL)
+            lane = {
+                "queue": [],                                   # heap of (priority, ticket, request)
+                "cond": threading.Condition(),
+                "slots": _slots[key[0]],
+                "pool": ThreadPoolExecutor(max_workers=NUM_PARALLEL, thread_name_prefix="mbti-llm"),
+                "session": requests.Session(),                 # keep-alive connections to the backend
+                "batches": 0, "requests": 0, "largest": 0,
+            }
+            threading.Thread(target=_dispatch_loop, args=(lane,), daemon=True, name="mbti-llm-batcher").start()
+            _lanes[key] = lane
+        return lane
+
+def _send(lane, request):
+    try:
+        response = lane["session"].post(request["url"], json=request["payload"],
+                                        headers=request["headers"], timeout=request["timeout"])
+        request["future"].set_result(response)
+    except Exception as e:
+        request["future"].set_exception(e)
+    finally:
+        lane["slots"].release()
+
+def _dispatch_loop(lane):
+    """Collect requests for one window (or until every slot is spoken for), then send them together."""
+    while True:
+        with lane["cond"]:
+            while not lane["queue"]:
+                lane["cond"].wait()
+            deadline = time.monotonic() + WINDOW_SECONDS
+            while len(lane["queue"]) < NUM_PARALLEL:
+                left = deadline - time.monotonic()
+                if left <= 0:
+                    break
+                lane["cond"].wait(left)
+
+        sent = 0
+        while sent < NUM_PARALLEL:
+            # A slot is secured before choosing who gets it, so a chat turn arriving while
+            # the backend is full still goes ahead of background work queued earlier
+            lane["slots"].acquire()
+            with lane["cond"]:
+                if not lane["queue"]:
+                    lane["slots"].release()
+                    break
+                _, _, request = heapq.heappop(lane["queue"])
+            lane["pool"].submit(_send, lane, request)
+            sent += 1
+        with lane["cond"]:
+            lane["batches"] += 1
+            lane["requests"] += sent
+            lane["largest"] = max(lane["largest"], sent)
+
+# ==========================================
+# 2. Callers
+# ==========================================
+def post(base_url, model_name, url, payload, headers, timeout=180):
+    """
+    POST a non-streamed chat request through the backend's batcher and return the
+    response. Callers just block as they would on requests.post.
+    """
+    if not ENABLED:
+        requests = config.lazy_import("requests")
+        return requests.post(url, json=payload, headers=headers, timeout=timeout)
+
+    lane = _lane(base_url, model_name)
+    request = {"url": url, "payload": payload, "headers": headers, "timeout": timeout, "future": Future()}
+    with lane["cond"]:
+        heapq.heappush(lane["queue"], (ratelimit.current_priority(), next(_tickets), request))
+        lane["cond"].notify()
+    return request["future"].result()
+
+@contextmanager
+def slot(base_url, model_name):
+    """Hold one of the backend's parallel slots directly, for streamed replies that bypass batching."""
+    if not ENABLED:
+        yield
+        return
+    lane = _lane(base_url, model_name)
+    lane["slots"].acquire()
+    try:
+        yield
+    finally:
+        lane["slots"].release()
+
+def report():
+    rows = {}
+    with _lanes_lock:
+        lanes = dict(_lanes)
+    for (base_url, model_name), lane in lanes.items():
+        with lane["cond"]:
+            rows[f"{model_name}@{base_url}"] = {
+                "waiting": len(lane["queue"]),
+                "batches": lane["batches"],
+                "mean_batch": round(lane["requests"] / lane["batches"], 2) if lane["batches"] else 0.0,
+                "largest_batch": lane["largest"],
+            }
+    return rows
@@ -1,12 +1,45 @@
-import plotly.graph_objects as go
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+
+import config
 # We need this helper to normalize scores for the graphs
 from mbti import align_scores_with_mbti
 
+# Plotly and numpy are imported on the first chart, not when the app starts
+def _go():
+    return config.lazy_import("plotly.graph_objects")
+
+def _np():
+    return config.lazy_import("numpy")
+
+# ==========================================
+# 0. Shared Score Matrix & Figure Cache
+# ==========================================
+def _score_value(s):
+    """A score as a float; missing or malformed ones (None, "n/a", NaN) sit on the midpoint."""
+    try:
+        value = float(s)
+    except (TypeError, ValueError):
+        return 50.0
+    return value if value == value else 50.0
+
+def build_score_matrix(analysis_results):
+    """Aligned [E, N, F, P] scores for every person as one N x 4 int array."""
+    np = _np()
+    rows = [align_scores_with_mbti(p.get('mbti'), [_score_value(s) for s in p.get('scores') or []])
+            for p in analysis_results]
+    return np.rint(np.array(rows, dtype=float)).astype(int).reshape(-1, 4)
+
 # ==========================================
 # 1. Original Spectrum Chart (Dot Plot)
 # ==========================================
-def generate_bipolar_chart(analysis_results):
+def generate_bipolar_chart(analysis_results, score_matrix=None):
+    go = _go()
     try:
+        if score_matrix is None:
+            score_matrix = build_score_matrix(analysis_results)
         dimensions = [
             {"label": "Energy", "left": "Introversion (I)", "right": "Extraversion (E)", "y": 0},
             {"label": "Info", "left": "Sensing (S)", "right": "Intuition (N)", "y": 1},
@@ -27,7 +60,7 @@ def generate_bipolar_chart(analysis_results):
         
         for i, person in enumerate(analysis_results):
             # Ensure we get [E, N, F, P] scores normalized
-            scores = align_scores_with_mbti(person['mbti'], person['scores'])
+            scores = score_matrix[i].tolist()
             color = colors[i % len(colors)]
             
             fig.add_trace(go.Scatter(
@@ -54,14 +87,17 @@ def generate_bipolar_chart(analysis_results):
 # ==========================================
 # 2. Group Bar Chart (Histogram Style)
 # ==========================================
-def generate_group_bar_chart(analysis_results):
+def generate_group_bar_chart(analysis_results, score_matrix=None):
+    go = _go()
     try:
+        if score_matrix is None:
+            score_matrix = build_score_matrix(analysis_results)
         fig = go.Figure()
         traits = ['E/I (Energy)', 'S/N (Info)', 'T/F (Decisions)', 'J/P (Lifestyle)']
         colors = ['#FF69B4', '#1E90FF', '#32CD32', '#FFA500', '#9370DB']
 
         for i, person in enumerate(analysis_results):
-            scores = align_scores_with_mbti(person['mbti'], person['scores'])
+            scores = score_matrix[i].tolist()
             fig.add_trace(go.Bar(
                 name=f"{person['name']} ({person['mbti']})",
                 x=traits,
@@ -84,15 +120,18 @@ def generate_group_bar_chart(analysis_results):
 # ==========================================
 # 3. Radar Chart (Spider Web)
 # ==========================================
-def generate_radar_chart(analysis_results):
+def generate_radar_chart(analysis_results, score_matrix=None):
+    go = _go()
     try:
+        if score_matrix is None:
+            score_matrix = build_score_matrix(analysis_results)
         fig = go.Figure()
         categories = ['Extraversion', 'Intuition', 'Feeling', 'Perceiving']
         colors = ['rgba(255, 105, 180, 0.5)', 'rgba(30, 144, 255, 0.5)', 'rgba(50, 205, 50, 0.5)']
         line_colors = ['#FF69B4', '#1E90FF', '#32CD32']
 
         for i, person in enumerate(analysis_results):
-            scores = align_scores_with_mbti(person['mbti'], person['scores'])
+            scores = score_matrix[i].tolist()
             
             # Close the loop
             r_val = scores + [scores[0]]
@@ -118,4 +157,211 @@ def generate_radar_chart(analysis_results):
         return fig
     except Exception as e:
         print(f"Radar Chart Error: {e}")
-        return go.Figure()
\ No newline at end of file
+        return go.Figure()
+
+# ==========================================
+# 4. Large-Group Charts (aggregate views)
+# ==========================================
+# Above this many people, per-person traces are replaced by aggregate views
+LARGE_GROUP_THRESHOLD = int(config.env("MBTI_LARGE_GROUP_THRESHOLD", "25"))
+
+DIMENSION_LABELS = ['E/I (Energy)', 'S/N (Info)', 'T/F (Decisions)', 'J/P (Lifestyle)']
+ALL_TYPES = [a + b + c + d for a in "EI" for b in "SN" for c in "TF" for d in "JP"]
+
+def is_large_group(analysis_results):
+    return len(analysis_results) > LARGE_GROUP_THRESHOLD
+
+def generate_large_spectrum_chart(analysis_results, score_matrix=None):
+    """Every person on one WebGL trace: x = score, y = dimension (jittered)."""
+    go = _go()
+    np = _np()
+    try:
+        if score_matrix is None:
+            score_matrix = build_score_matrix(analysis_results)
+        n = len(score_matrix)
+        # Deterministic jitter so reruns and cached figures look the same
+        jitter = np.random.default_rng(0).uniform(-0.25, 0.25, size=(n, 4))
+        y = (np.arange(4) + jitter).ravel()
+        labels = np.array([f"{p['name']} ({p['mbti']})" for p in analysis_results], dtype=object)
+
+        fig = go.Figure(go.Scattergl(
+            x=score_matrix.ravel(), y=y, mode='markers',
+            text=np.repeat(labels, 4),
+            hovertemplate="%{text}<br>%{x}<extra></extra>",
+            marker=dict(size=7, color=score_matrix.ravel(), colorscale='Portland', cmin=0, cmax=100, opacity=0.7)
+        ))
+        fig.add_vline(x=50, line=dict(color="#E0E0E0", width=2, dash="dot"))
+        fig.update_layout(
+            title=f"✨ Personality Spectrum ({n} people)",
+            height=450, showlegend=False,
+            xaxis=dict(range=[-5, 105], title="I/S/T/J  ←  score  →  E/N/F/P"),
+            yaxis=dict(tickvals=[0, 1, 2, 3], ticktext=DIMENSION_LABELS, range=[-0.5, 3.5]),
+            plot_bgcolor='rgba(0,0,0,0)'
+        )
+        return fig
+    except Exception as e:
+        print(f"Large Spectrum Error: {e}")
+        return go.Figure()
+
+def generate_type_distribution_chart(analysis_results, score_matrix=None):
+    """How many people fall into each of the 16 types."""
+    go = _go()
+    np = _np()
+    try:
+        types = np.array([(p.get('mbti') or '').upper() for p in analysis_results])
+        found, counts = np.unique(types, return_counts=True)
+        lookup = dict(zip(found.tolist(), counts.tolist()))
+        fig = go.Figure(go.Bar(
+            x=ALL_TYPES, y=[lookup.get(t, 0) for t in ALL_TYPES],
+            marker_color=['#FF69B4' if t[0] == 'E' else '#1E90FF' for t in ALL_TYPES]
+        ))
+        fig.update_layout(
+            title="🧩 Type Distribution",
+            height=400,
+            yaxis=dict(title='People'),
+            plot_bgcolor='rgba(255,255,255,0.1)'
+        )
+        return fig
+    except Exception as e:
+        print(f"Type Distribution Error: {e}")
+        return go.Figure()
+
+def generate_dimension_histograms(analysis_results, score_matrix=None):
+    """One score histogram per dimension."""
+    go = _go()
+    make_subplots = config.lazy_import("plotly.subplots").make_subplots
+    try:
+        if score_matrix is None:
+            score_matrix = build_score_matrix(analysis_results)
+        colors = ['#FF69B4', '#1E90FF', '#32CD32', '#FFA500']
+        fig = make_subplots(rows=2, cols=2, subplot_titles=DIMENSION_LABELS)
+        for d in range(4):
+            fig.add_trace(go.Histogram(
+                x=score_matrix[:, d], xbins=dict(start=0, end=100, size=5),
+                marker_color=colors[d], name=DIMENSION_LABELS[d]
+            ), row=d // 2 + 1, col=d % 2 + 1)
+        fig.update_xaxes(range=[0, 100])
+        fig.update_layout(title="📊 Score Histograms", height=500, showlegend=False)
+        return fig
+    except Exception as e:
+        print(f"Histogram Error: {e}")
+        return go.Figure()
+
+def generate_density_chart(analysis_results, score_matrix=None):
+    """Score density per dimension as violins (4 traces regardless of group size)."""
+    go = _go()
+    try:
+        if score_matrix is None:
+            score_matrix = build_score_matrix(analysis_results)
+        colors = ['#FF69B4', '#1E90FF', '#32CD32', '#FFA500']
+        fig = go.Figure()
+        for d in range(4):
+            fig.add_trace(go.Violin(
+                y=score_matrix[:, d], name=DIMENSION_LABELS[d], line_color=colors[d],
+                box_visible=True, meanline_visible=True, points=False
+            ))
+        fig.update_layout(
+            title="🌊 Score Density",
+            height=450, showlegend=False,
+            yaxis=dict(title='Intensity % (Right Side Trait)', range=[0, 100])
+        )
+        return fig
+    except Exception as e:
+        print(f"Density Chart Error: {e}")
+        return go.Figure()
+
+def generate_compatibility_heatmap(analysis_results, score_matrix=None):
+    """Pairwise compatibility as a single heatmap trace."""
+    go = _go()
+    np = _np()
+    compatibility_matrix = config.lazy_import("compatibility").compatibility_matrix
+    try:
+        matrix = compatibility_matrix(analysis_results, score_matrix)
+        names = [p['name'] for p in analysis_results]
+        fig = go.Figure(go.Heatmap(
+            z=np.round(matrix, 1), x=names, y=names,
+            zmin=0, zmax=100, colorscale='RdYlGn',
+            hovertemplate="%{y} & %{x}: %{z}<extra></extra>"
+        ))
+        fig.update_layout(
+            title="💞 Compatibility",
+            height=max(400, min(1200, 20 * len(names))),
+            yaxis=dict(autorange='reversed')
+        )
+        return fig
+    except Exception as e:
+        print(f"Heatmap Error: {e}")
+        return go.Figure()
+
+# ==========================================
+# 5. Memoized Figure JSON
+# ==========================================
+CHART_BUILDERS = {
+    'spectrum': generate_bipolar_chart,
+    'bar': generate_group_bar_chart,
+    'radar': generate_radar_chart,
+    'spectrum_gl': generate_large_spectrum_chart,
+    'types': generate_type_distribution_chart,
+    'histograms': generate_dimension_histograms,
+    'density': generate_density_chart,
+    'compat': generate_compatibility_heatmap,
+}
+CHART_TITLES = {
+    'spectrum': "✨ Spectrum",
+    'bar': "📊 Bar Chart",
+    'radar': "🕸️ Radar",
+    'spectrum_gl': "✨ Spectrum",
+    'types': "🧩 Types",
+    'histograms': "📊 Histograms",
+    'density': "🌊 Density",
+    'compat': "💞 Compatibility",
+}
+
+def default_chart_kinds(analysis_results):
+    if is_large_group(analysis_results):
+        return ('spectrum_gl', 'types', 'histograms', 'density')
+    return ('spectrum', 'bar', 'radar')
+
+FIGURE_CACHE_SIZE = 64
+
+_figure_cache = OrderedDict()
+_figure_lock = threading.Lock()
+
+def results_key(analysis_results):
+    """Stable hash of a result set (order matters: it decides trace colors)."""
+    payload = [(p.get('name'), p.get('mbti'), p.get('scores')) for p in analysis_results]
+    return hashlib.sha1(json.dumps(payload, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+def get_charts_json(analysis_results, kinds=None):
+    """
+    Serialized figures {kind: json_str} for a result set. Figures are built from
+    one shared score matrix and cached by results hash, so reruns cost a lookup.
+    Without explicit kinds, large groups get the aggregate views.
+    """
+    if kinds is None:
+        kinds = default_chart_kinds(analysis_results)
+    key = results_key(analysis_results)
+    out, missing = {}, []
+    with _figure_lock:
+        for kind in kinds:
+            cached = _figure_cache.get((key, kind))
+            if cached is None:
+                missing.append(kind)
+            else:
+                _figure_cache.move_to_end((key, kind))
+                out[kind] = cached
+
+    if missing:
+        score_matrix = build_score_matrix(analysis_results)
+        built = {kind: CHART_BUILDERS[kind](analysis_results, score_matrix).to_json() for kind in missing}
+        with _figure_lock:
+            for kind, fig_json in built.items():
+                _figure_cache[(key, kind)] = fig_json
+            while len(_figure_cache) > FIGURE_CACHE_SIZE:
+                _figure_cache.popitem(last=False)
+        out.update(built)
+    return {kind: out[kind] for kind in kinds}
+
+def figure_from_json(fig_json):
+    go = _go()
+    return go.Figure(json.loads(fig_json))
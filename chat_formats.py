@@ -0,0 +1,308 @@
+"""
+Chat export formats: decoding, format detection and one fast parser per format.
+
+    python chat_formats.py --bench             # throughput per format
+    python chat_formats.py export.txt          # detected format and counts for real files
+    python chat_formats.py --check export.txt  # LINE exports: same messages as the old parser?
+
+Each format is one compiled pattern run with findall over the whole export (no
+per-line split or regex in Python), plus one compiled matcher for every
+message that should be skipped. register_format() adds new layouts.
+"""
+import re
+import sys
+import time
+import codecs
+import argparse
+
+# Messages containing any of these are system notices, not something a person wrote
+SKIP_KEYWORDS = ["通話時間", "Call time", "Unsend message", "joined the chat", "invite"]
+SKIP_MESSAGES = ["[Photos]", "[Stickers]"]
+INVALID_NAMES = ["You", "you", "System", "Monday", "Tuesday", "Wednesday", "Thursday", "Friday"]
+
+# How much of an export format detection looks at, widening only if nothing matched
+DETECT_SAMPLE_CHARS = 1024
+DETECT_MAX_CHARS = 64 * 1024
+DEFAULT_FORMAT = "line_tab"
+
+FORMATS = {}  # name -> {"pattern", "skip", "invalid_names", "name_suffixes"}; detection tries them in order
+
+# ==========================================
+# 1. Registry
+# ==========================================
+def register_format(name, pattern, skip_keywords=(), skip_messages=(), invalid_names=(), name_suffixes=()):
+    """
+    Add a format. pattern matches one message row starting at the newline before
+    it (the export is given a leading newline) and has two groups, speaker name
+    and message, or four when it accepts two row layouts (one pair each).
+    Starting on a literal newline lets the regex engine jump from row to row
+    instead of trying every position.
+    The skip lists are folded, with the shared ones, into a single matcher.
+    """
+    compiled = re.compile(pattern)
+    if compiled.groups not in (2, 4):
+        raise ValueError(f"format {name!r}: pattern needs 2 groups (name, message) or 4, not {compiled.groups}")
+    keywords = [re.escape(k) for k in list(SKIP_KEYWORDS) + list(skip_keywords)]
+    exact = [re.escape(m) for m in list(SKIP_MESSAGES) + list(skip_messages)]
+    FORMATS[name] = {
+        "pattern": compiled,
+        "skip": re.compile("|".join([rf"^(?:{'|'.join(exact)})$"] + keywords)),
+        "invalid_names": frozenset(INVALID_NAMES) | frozenset(invalid_names),
+        "name_suffixes": tuple(name_suffixes),
+    }
+
+# Every layout allows indentation before a row, as the old line-by-line parser did.
+# LINE with 24-hour times: PC / Android "10:30\tName\tmessage" under "2024/01/05（五）" date
+# headers and iOS "10:30 Name message" under "2024.01.05 Friday". Like the old parser, either
+# kind of row is read wherever it appears, so exports mixing the two lose nothing.
+# "Name Photos" / "Name Stickers" rows belong to Name.
+LINE_24H = r"\n[ \t]*\d{1,2}:\d{2}(?:\t([^\t\n]*)\t([^\t\n]*)| (\S+) ([^\n]*))"
+register_format("line_tab", LINE_24H, name_suffixes=(" Photos", " Stickers"))
+# Detection never picks this over line_tab (same rows, registered later); kept so parse
+# states saved under its name still load
+register_format("line_space", LINE_24H, name_suffixes=(" Photos", " Stickers"))
+# The other layouts read only their own rows: the old parser read none of them
+# 12-hour times: "下午10:30\tName\tmessage", "10:30 PM\tName\tmessage"
+register_format("line_tab_12h",
+                r"\n[ \t]*(?:(?:上午|下午|午前|午後) ?\d{1,2}:\d{2}|\d{1,2}:\d{2} ?[AaPp][Mm])\t([^\t\n]*)\t([^\t\n]*)",
+                name_suffixes=(" Photos", " Stickers"))
+# LINE exports that repeat the date on every row: "2024/01/05(Fri) 10:30\tName\tmessage"
+register_format("line_dated",
+                r"\n[ \t]*\d{4}[./-]\d{1,2}[./-]\d{1,2}(?: ?[(（][^)）\n]*[)）])? \d{1,2}:\d{2}\t([^\t\n]*)\t([^\t\n]*)",
+                name_suffixes=(" Photos", " Stickers"))
+# WhatsApp Android "31/12/2023, 22:30 - Name: message" and iOS "[31/12/2023, 10:30:15 PM] Name: message".
+# Continuation lines of multi-line messages are skipped, as LINE's are.
+register_format("whatsapp",
+                r"\n[ \t]*\u200e?\[?\d{1,4}[./-]\d{1,2}[./-]\d{1,4},? \d{1,2}:\d{2}(?::\d{2})?(?:[ \u202f]?[AaPp]\.? ?[Mm]\.?)?\]? "
+                r"(?:- )?([^:\n]+): ([^\n]*)",
+                skip_keywords=["<Media omitted>", "image omitted", "video omitted", "audio omitted",
+                               "sticker omitted", "GIF omitted", "document omitted", "This message was deleted",
+                               "You deleted this message", "end-to-end encrypted", "Missed voice call",
+                               "Missed video call"])
+
+# ==========================================
+# 2. Decoding & Detection
+# ==========================================
+def decode_export(raw):
+    """Export bytes -> text: honours UTF-8/UTF-16 BOMs and spots BOM-less UTF-16 by its NUL bytes."""
+    if raw.startswith(codecs.BOM_UTF8):
+        return raw[len(codecs.BOM_UTF8):].decode("utf-8", errors="replace")
+    if raw.startswith((codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)):
+        return raw.decode("utf-16", errors="replace")
+    head = raw[:DETECT_SAMPLE_CHARS]
+    if head and head.count(0) > len(head) // 4:
+        # ASCII in UTF-16: the NUL is the high byte, odd positions for little-endian
+        encoding = "utf-16-le" if head[1::2].count(0) >= head[0::2].count(0) else "utf-16-be"
+        return raw.decode(encoding, errors="replace")
+    return raw.decode("utf-8", errors="replace")
+
+def _normalize(text):
+    if text.startswith("\ufeff"):
+        text = text[1:]
+    return "\n" + (text.replace("\r\n", "\n") if "\r" in text else text)
+
+def detect_format(text):
+    """Name of the registered format matching most rows in the export's first KB."""
+    size = DETECT_SAMPLE_CHARS
+    while True:
+        sample = _normalize(text[:size])
+        counts = {name: len(fmt["pattern"].findall(sample)) for name, fmt in FORMATS.items()}
+        best = max(counts, key=counts.get)  # ties keep registration order
+        if counts[best] or size >= DETECT_MAX_CHARS or size >= len(text):
+            return best if counts[best] else DEFAULT_FORMAT
+        size *= 4
+
+# ==========================================
+# 3. Parsing
+# ==========================================
+def iter_rows(text, fmt=None):
+    """(name, msg) for every message row in export order, in the given (or detected) format."""
+    spec = FORMATS[fmt or detect_format(text)]
+    skip, invalid, suffixes = spec["skip"].search, spec["invalid_names"], spec["name_suffixes"]
+    rows = spec["pattern"].findall(_normalize(text))
+    if spec["pattern"].groups == 4:
+        # The pair of the layout that did not match comes back empty
+        rows = ((r[0], r[1]) if r[0] or r[1] else (r[2], r[3]) for r in rows)
+    for name, msg in rows:
+        name, msg = name.strip(), msg.strip()
+        if suffixes and name.endswith(suffixes):
+            for suffix in suffixes:
+                name = name.replace(suffix, "")
+        if not name or not msg or name in invalid or skip(msg):
+            continue
+        yield name, msg
+
+def first_rows(text, n, fmt=None):
+    """The first n message rows, reading only as much of the export as they need."""
+    fmt = fmt or detect_format(text)
+    size = DETECT_SAMPLE_CHARS * 4
+    while True:
+        head = text if size >= len(text) else text[:text.rfind("\n", 0, size) + 1]
+        rows = []
+        for row in iter_rows(head, fmt):
+            rows.append(row)
+            if len(rows) == n:
+                return rows
+        if size >= len(text):
+            return rows
+        size *= 4
+
+def parse_messages(text, fmt=None, messages=None):
+    """Collect {name: [msg, ...]} from export text in the given (or detected) format."""
+    messages = {} if messages is None else messages
+    for name, msg in iter_rows(text, fmt):
+        bucket = messages.get(name)
+        if bucket is None:
+            messages[name] = [msg]
+        else:
+            bucket.append(msg)
+    return messages
+
+def parse_row(line, fmt=None):
+    """(name, msg) for one export row (format detected if not given), or None if it is not a message."""
+    parsed = parse_messages(line.strip(), fmt)
+    if not parsed:
+        return None
+    name, msgs = next(iter(parsed.items()))
+    return name, msgs[0]
+
+# ==========================================
+# 4. Benchmarks
+# ==========================================
+SAMPLE_ROWS = {
+    "line_tab": ["2024/01/05（五）", "10:30\tAlice\tAre we still on for dinner tonight?",
+                 "10:31\tBob Stickers\t[Stickers]", "10:32\tBob\tyes!! see you at 7 哈哈", "10:33\tCarol\t☎ Call time 5:21"],
+    "line_tab_12h": ["2024/01/05（五）", "上午10:30\tAlice\tAre we still on for dinner tonight?",
+                     "上午10:31\tBob Stickers\t[Stickers]", "下午10:32\tBob\tyes!! see you at 7 哈哈",
+                     "下午10:33\tCarol\t☎ Call time 5:21"],
+    "line_space": ["2024.01.05 Friday", "10:30 Alice Are we still on for dinner tonight?",
+                   "10:31 Bob [Stickers]", "10:32 Bob yes!! see you at 7 哈哈", "10:33 Carol Unsend message"],
+    "line_dated": ["2024/01/05(Fri) 10:30\tAlice\tAre we still on for dinner tonight?",
+                   "2024/01/05(Fri) 10:31\tBob Photos\t[Photos]", "2024/01/05(Fri) 10:32\tBob\tyes!! see you at 7 哈哈",
+                   "2024/01/05(Fri) 10:33\tCarol\tCarol joined the chat"],
+    "whatsapp": ["31/12/2023, 22:30 - Alice: Are we still on for dinner tonight?",
+                 "31/12/2023, 22:31 - Bob: <Media omitted>", "[31/12/2023, 10:32:05\u202fPM] Bob: yes!! see you at 7 哈哈",
+                 "this line continues the message above", "31/12/2023, 22:33 - Carol: This message was deleted"],
+}
+# Rows the old parser read that a single strict layout would miss: indentation, tab and space
+# rows in one export, trailing whitespace
+MIXED_LINE_ROWS = ["2024/01/05（五）", "  10:30\tAlice\tAre we still on for dinner tonight?",
+                   "10:31 Bob yes!! see you at 7", "\t10:32\tBob Stickers\t[Stickers]",
+                   "10:33\tCarol\tcan't wait  ", "10:34 Alice 哈哈哈"]
+# Layouts the old parser read; --check compares against it on these
+LEGACY_FORMATS = ("line_tab", "line_space")
+
+def _legacy_parse(text):
+    """The single-layout parser this module replaced (split per line, regex per row), as a baseline."""
+    messages = {}
+    for line in text.split("\n"):
+        line = line.strip()
+        if not line: continue
+        parts = line.split("\t")
+        if len(parts) < 3: parts = line.split(" ", 2)
+        if len(parts) < 3: continue
+        time_str, name, msg = parts[0], parts[1].strip(), parts[2].strip()
+        if not re.match(r"^\d{1,2}:\d{2}$", time_str): continue
+        if name.endswith(" Photos") or name.endswith(" Stickers"): name = name.replace(" Photos", "").replace(" Stickers", "")
+        if any(k in msg for k in SKIP_KEYWORDS): continue
+        if msg in SKIP_MESSAGES: continue
+        if name in INVALID_NAMES: continue
+        messages.setdefault(name, []).append(msg)
+    return messages
+
+def compare_with_legacy(text, fmt=None):
+    """{name: (messages now, messages with the old parser)} for every speaker the two disagree on."""
+    new, old = parse_messages(text, fmt), _legacy_parse(text)
+    return {name: (len(new.get(name, [])), len(old.get(name, [])))
+            for name in set(new) | set(old) if new.get(name) != old.get(name)}
+
+def _best_of(fn, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - t0)
+    return best, result
+
+def benchmark(lines=100000, repeat=3):
+    """Rows per second and MB/s per format, with the old parser alongside where it applies."""
+    rows = []
+    for name, sample in SAMPLE_ROWS.items():
+        text = "\n".join(sample[i % len(sample)] for i in range(lines)) + "\n"
+        mb = len(text.encode("utf-8")) / 1e6
+        detect_s, detected = _best_of(lambda: detect_format(text), repeat)
+        parse_s, messages = _best_of(lambda: parse_messages(text, name), repeat)
+        row = {"format": name, "detected": detected, "rows": lines, "mb": round(mb, 2),
+               "messages": sum(len(v) for v in messages.values()),
+               "detect_ms": round(detect_s * 1000, 2),
+               "rows_per_s": int(lines / parse_s), "mb_per_s": round(mb / parse_s, 1)}
+        legacy_s, legacy = _best_of(lambda: _legacy_parse(text), repeat)
+        row["legacy_rows_per_s"] = int(lines / legacy_s)
+        row["legacy_messages"] = sum(len(v) for v in legacy.values())
+        if name in LEGACY_FORMATS:
+            row["same_as_legacy"] = messages == legacy
+        rows.append(row)
+
+    utf16 = codecs.BOM_UTF16_LE + "\r\n".join(SAMPLE_ROWS["line_tab"] * (lines // 5)).encode("utf-16-le")
+    decode_s, text = _best_of(lambda: decode_export(utf16), repeat)
+    parse_s, messages = _best_of(lambda: parse_messages(text), repeat)
+    rows.append({"format": "line_tab (UTF-16 + BOM)", "detected": detect_format(text), "rows": lines,
+                 "mb": round(len(utf16) / 1e6, 2), "messages": sum(len(v) for v in messages.values()),
+                 "decode_ms": round(decode_s * 1000, 2),
+                 "rows_per_s": int(lines / (decode_s + parse_s)),
+                 "mb_per_s": round(len(utf16) / 1e6 / (decode_s + parse_s), 1)})
+    return rows
+
+def format_benchmark(rows):
+    out = []
+    for r in rows:
+        line = (f"{r['format']:<24} detected={r['detected']:<13} {r['rows_per_s']:>10,} rows/s "
+                f"{r['mb_per_s']:>7} MB/s  ({r['messages']:,} messages kept)")
+        if "legacy_rows_per_s" in r:
+            line += (f"\n{'':<24} {'old parser':<22} {r['legacy_rows_per_s']:>10,} rows/s "
+                     f"({r['legacy_messages']:,} messages kept)")
+        if "same_as_legacy" in r:
+            line += ", same messages" if r["same_as_legacy"] else ", DIFFERENT messages"
+        out.append(line)
+    return "\n".join(out)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Chat export parser throughput per format.")
+    parser.add_argument("--bench", action="store_true", help="run the parser benchmarks")
+    parser.add_argument("--check", action="store_true",
+                        help="compare with the old parser on LINE exports (built-in samples if no files)")
+    parser.add_argument("--lines", type=int, default=100000, help="rows per synthetic export")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per measurement (best is kept)")
+    parser.add_argument("files", nargs="*", help="exports to detect and parse")
+    args = parser.parse_args(argv)
+
+    if args.bench:
+        print(format_benchmark(benchmark(args.lines, args.repeat)))
+    status = 0
+    exports = []
+    for path in args.files:
+        with open(path, "rb") as f:
+            exports.append((path, decode_export(f.read())))
+    if args.check and not exports:
+        exports = [(f"<{name} sample>", "\n".join(SAMPLE_ROWS[name]) + "\n") for name in LEGACY_FORMATS]
+        exports.append(("<mixed LINE sample>", "\n".join(MIXED_LINE_ROWS) + "\n"))
+    for path, text in exports:
+        fmt = detect_format(text)
+        messages = parse_messages(text, fmt)
+        print(f"{path}: {fmt}, {len(messages)} speakers, {sum(len(v) for v in messages.values())} messages")
+        if not args.check:
+            continue
+        if fmt not in LEGACY_FORMATS:
+            print("  not a layout the old parser read")
+            continue
+        differences = compare_with_legacy(text, fmt)
+        for name, (now, before) in sorted(differences.items()):
+            print(f"  {name}: {now} messages, old parser {before}")
+        if differences:
+            status = 1
+        else:
+            print("  same messages as the old parser")
+    return status
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,176 @@
+"""
+Headless batch analysis of LINE chat exports.
+
+    python cli.py exports/ extra_chat.txt --out results.jsonl --charts-dir charts/
+
+Files already present in the output JSONL (same content hash, model and prompt
+version, no error) are skipped, so an interrupted run can simply be started again.
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+import config
+import mbti
+import chat_formats
+import agent
+import jobs
+import ratelimit
+import ensemble
+import store
+import stylometry
+
+# ==========================================
+# 1. Inputs
+# ==========================================
+def collect_files(paths):
+    """Expand directories into the .txt exports they contain (recursively)."""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, names in os.walk(path):
+                files += [os.path.join(root, n) for n in sorted(names) if n.lower().endswith(".txt")]
+        elif os.path.isfile(path):
+            files.append(path)
+        else:
+            print(f"⚠️ Skipping missing path: {path}", file=sys.stderr)
+    return files
+
+def parse_file(path):
+    """Runs in a worker process: read and parse one export."""
+    with open(path, "rb") as f:
+        content = chat_formats.decode_export(f.read())
+    return {
+        "file": path,
+        "content_hash": mbti.content_hash(content),
+        "chat_fp": store.chat_fingerprint(content),
+        "speakers": mbti.parse_line_chat_dynamic(content),
+    }
+
+def load_finished(out_path):
+    """(content_hash, model, prompt_version) of every file already written successfully to the output JSONL."""
+    done = set()
+    if not os.path.exists(out_path):
+        return done
+    with open(out_path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                row = json.loads(line)
+            except ValueError:
+                continue  # a line cut off by an interruption
+            if not row.get("error") and row.get("content_hash"):
+                done.add((row["content_hash"], row.get("model"), row.get("prompt_version")))
+    return done
+
+# ==========================================
+# 2. Analysis
+# ==========================================
+async def analyze_parsed(parsed, backend, semaphore, quick_precheck=False, samples=1):
+    api_key, base_url, model_name = backend
+    speakers = parsed["speakers"]
+    if quick_precheck:
+        results, llm_people = stylometry.preclassify_speakers(speakers)
+    else:
+        results, llm_people = [], list(speakers)
+
+    tasks = []
+    for batch in jobs.split_batches(llm_people):
+        sys_prompt, user_content = mbti.construct_analysis_prompt({n: speakers[n] for n in batch})
+        tasks.append(ensemble.run_ensemble_request_async(
+            sys_prompt, user_content, batch, api_key, base_url, model_name, k=samples, semaphore=semaphore))
+    # Batch work queues behind interactive app/API traffic sharing this process's limiter
+    with ratelimit.priority(ratelimit.BACKGROUND):
+        for res in await asyncio.gather(*tasks):
+            results += res.get("results", [])
+
+    order = {n: i for i, n in enumerate(speakers)}
+    results.sort(key=lambda p: order.get(p.get("name"), len(order)))
+    return results
+
+def write_charts(results, charts_dir, stem):
+    import charts
+    os.makedirs(charts_dir, exist_ok=True)
+    for kind, fig_json in charts.get_charts_json(results).items():
+        charts.figure_from_json(fig_json).write_html(
+            os.path.join(charts_dir, f"{stem}_{kind}.html"), include_plotlyjs="cdn")
+
+async def run_batch(files, out_path, backend, concurrency, workers, charts_dir=None, quick_precheck=False, samples=1):
+    finished = load_finished(out_path)
+    semaphore = asyncio.Semaphore(concurrency)
+    # Files parsed and held while they wait for the backend: enough to keep it busy, no more
+    files_in_flight = asyncio.Semaphore(2 * concurrency)
+    loop = asyncio.get_running_loop()
+    counts = {"done": 0, "skipped": 0, "failed": 0}
+
+    with ProcessPoolExecutor(max_workers=workers) as pool, open(out_path, "a", encoding="utf-8") as out:
+        async def process(path):
+            async with files_in_flight:
+                await process_file(path)
+
+        async def process_file(path):
+            row = {"file": path, "model": backend[2], "prompt_version": mbti.PROMPT_VERSION}
+            try:
+                parsed = await loop.run_in_executor(pool, parse_file, path)
+                if (parsed["content_hash"], row["model"], row["prompt_version"]) in finished:
+                    counts["skipped"] += 1
+                    return
+                row.update(content_hash=parsed["content_hash"], chat_fp=parsed["chat_fp"], analyzed_at=time.time())
+                row["results"] = await analyze_parsed(parsed, backend, semaphore, quick_precheck, samples)
+                if charts_dir and row["results"]:
+                    stem = os.path.splitext(os.path.basename(path))[0] + "_" + parsed["content_hash"][:8]
+                    await asyncio.to_thread(write_charts, row["results"], charts_dir, stem)
+                counts["done"] += 1
+            except Exception as e:
+                row["error"] = str(e)
+                counts["failed"] += 1
+            # One complete line per file, flushed immediately, is what makes resuming safe
+            out.write(json.dumps(row, ensure_ascii=False) + "\n")
+            out.flush()
+            print(f"{'❌' if row.get('error') else '✅'} {path}", file=sys.stderr)
+
+        await asyncio.gather(*(process(p) for p in files))
+    return counts
+
+# ==========================================
+# 3. Entry Point
+# ==========================================
+def build_parser():
+    parser = argparse.ArgumentParser(description="Batch MBTI analysis of LINE chat exports.")
+    parser.add_argument("paths", nargs="+", help=".txt exports or directories containing them")
+    parser.add_argument("--out", default="results.jsonl", help="JSONL file to append results to")
+    parser.add_argument("--charts-dir", default=None, help="write HTML charts per export here")
+    parser.add_argument("--backend", choices=["remote", "local"], default="local")
+    parser.add_argument("--model", default=None, help="override the backend's default model")
+    parser.add_argument("--concurrency", type=int, default=4, help="max LLM requests in flight")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 2, help="parser processes")
+    parser.add_argument("--precheck", action="store_true",
+                        help="score clear-cut speakers with the local style heuristic instead of the LLM")
+    parser.add_argument("--samples", type=int, default=1, help="analysis samples to vote over per batch (e.g. 3)")
+    return parser
+
+def main(argv=None):
+    config.load_config()
+    args = build_parser().parse_args(argv)
+    files = collect_files(args.paths)
+    if not files:
+        print("No .txt exports found.", file=sys.stderr)
+        return 1
+
+    backend = agent.resolve_backend(args.backend, args.model)
+    if not backend[1]:
+        print("❌ No API base URL configured for this backend.", file=sys.stderr)
+        return 1
+
+    counts = asyncio.run(run_batch(
+        files, args.out, backend, max(1, args.concurrency), max(1, args.workers),
+        charts_dir=args.charts_dir, quick_precheck=args.precheck, samples=max(1, args.samples)))
+    print(f"Done: {counts['done']} analysed, {counts['skipped']} already finished, {counts['failed']} failed.",
+          file=sys.stderr)
+    return 1 if counts["failed"] else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,90 @@
+import numpy as np
+
+import participants
+from mbti import align_scores_with_mbti
+
+# ==========================================
+# 1. Compatibility Model
+# ==========================================
+# Per-letter agreement weights for [E/I, S/N, T/F, J/P]. Positive rewards a shared
+# preference, negative rewards complementary ones (classic "balance" pairing).
+LETTER_WEIGHTS = np.array([-0.15, 0.45, -0.15, 0.25])
+# How much closeness of the raw scores adds on top of the letter agreement
+CLOSENESS_WEIGHT = 0.25
+
+COMPAT_KEYWORDS = [
+    "compatib", "get along", "gets along", "best match", "best pair", "worst pair",
+    "chemistry", "clash", "合得來", "合不來", "相處", "配對", "速配"
+]
+
+def letter_signs(mbti_types):
+    """N x 4 array of +1 (E/N/F/P) / -1 (I/S/T/J) / 0 (unknown)."""
+    signs = np.zeros((len(mbti_types), 4))
+    for i, t in enumerate(mbti_types):
+        t = (t or "").upper()
+        for d, (hi, lo) in enumerate([("E", "I"), ("N", "S"), ("F", "T"), ("P", "J")]):
+            signs[i, d] = 1 if hi in t else -1 if lo in t else 0
+    return signs
+
+def compatibility_matrix(analysis_results, score_matrix=None):
+    """
+    N x N compatibility (0-100) for a result set. The diagonal is NaN.
+    score_matrix: optional aligned N x 4 scores (e.g. charts.build_score_matrix).
+    """
+    if score_matrix is None:
+        score_matrix = np.array(
+            [align_scores_with_mbti(p['mbti'], p['scores']) for p in analysis_results], dtype=float
+        ).reshape(-1, 4)
+    centered = (np.asarray(score_matrix, dtype=float) - 50) / 50
+    signs = letter_signs([p.get('mbti') for p in analysis_results])
+
+    agreement = np.einsum('id,jd,d->ij', signs, signs, LETTER_WEIGHTS) / np.abs(LETTER_WEIGHTS).sum()
+    closeness = 1 - np.abs(centered[:, None, :] - centered[None, :, :]).mean(axis=2)
+
+    matrix = np.clip(50 + 50 * ((1 - CLOSENESS_WEIGHT) * agreement + CLOSENESS_WEIGHT * (2 * closeness - 1)), 0, 100)
+    np.fill_diagonal(matrix, np.nan)
+    return matrix
+
+# ==========================================
+# 2. Pair Queries
+# ==========================================
+def top_pairs(matrix, names, k=3, best=True):
+    """k highest (or lowest) scoring pairs as [(name_a, name_b, score)]."""
+    n = len(names)
+    if n < 2:
+        return []
+    rows, cols = np.triu_indices(n, 1)
+    values = matrix[rows, cols]
+    k = min(k, len(values))
+    keyed = -values if best else values
+    idx = np.argpartition(keyed, k - 1)[:k]
+    idx = idx[np.argsort(keyed[idx])]
+    return [(names[rows[i]], names[cols[i]], round(float(values[i]), 1)) for i in idx]
+
+def is_compatibility_question(text):
+    t = text.lower()
+    return any(k in t for k in COMPAT_KEYWORDS)
+
+def answer_compatibility_question(user_input, analysis_results, k=3):
+    """Markdown answer for a compatibility question, computed locally."""
+    names = [p['name'] for p in analysis_results]
+    if len(names) < 2:
+        return "I need at least two analysed people to compare compatibility. 🎄"
+    matrix = compatibility_matrix(analysis_results)
+
+    mentioned = participants.resolve_mentions(participants.index_for(analysis_results), user_input)
+    if len(mentioned) >= 2:
+        lines = ["💞 **Compatibility**\n"]
+        for a in range(len(mentioned)):
+            for b in range(a + 1, len(mentioned)):
+                i, j = mentioned[a], mentioned[b]
+                lines.append(f"* **{names[i]}** & **{names[j]}**: {matrix[i, j]:.0f}/100")
+        return "\n".join(lines)
+
+    best = top_pairs(matrix, names, k=k, best=True)
+    worst = top_pairs(matrix, names, k=k, best=False)
+    lines = ["💞 **Best Matches**\n"]
+    lines += [f"* **{a}** & **{b}**: {s:.0f}/100" for a, b, s in best]
+    lines += ["\n⚡ **Most Likely to Clash**\n"]
+    lines += [f"* **{a}** & **{b}**: {s:.0f}/100" for a, b, s in worst]
+    return "\n".join(lines)
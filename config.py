@@ -0,0 +1,134 @@
+"""
+Process-wide startup: the single .env loader, deferred imports of heavy
+dependencies, and an import-time report.
+
+    python config.py                     # cold-import cost of the app's modules
+    python config.py charts --log startup.jsonl
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import importlib
+import subprocess
+import threading
+
+# Modules a Streamlit worker imports before the first page renders
+APP_MODULES = ("mbti", "charts", "agent", "store", "profiles", "jobs", "images", "session_store")
+
+_loaded = False
+_deferred = {}  # module name -> seconds its first deferred import took
+_lock = threading.Lock()
+
+# ==========================================
+# 1. Configuration
+# ==========================================
+def load_config():
+    """Load .env into the environment once per process; later calls are free."""
+    global _loaded
+    if _loaded:
+        return os.environ
+    with _lock:
+        if not _loaded:
+            try:
+                from dotenv import load_dotenv
+                load_dotenv()
+            except ImportError as e:
+                print(f"Config Error: {e}")
+            _loaded = True
+    return os.environ
+
+def env(name, default=None):
+    """os.getenv, with .env applied first."""
+    load_config()
+    return os.getenv(name, default)
+
+# ==========================================
+# 2. Deferred Imports
+# ==========================================
+def lazy_import(name):
+    """Import a module on first use and remember how long that took."""
+    module = sys.modules.get(name)
+    if module is not None:
+        return module
+    start = time.perf_counter()
+    module = importlib.import_module(name)
+    with _lock:
+        _deferred.setdefault(name, time.perf_counter() - start)
+    return module
+
+def deferred_import_times():
+    """[(module, ms)] for deferred imports this process has paid for, slowest first."""
+    with _lock:
+        rows = [(name, seconds * 1000) for name, seconds in _deferred.items()]
+    return sorted(rows, key=lambda r: r[1], reverse=True)
+
+# ==========================================
+# 3. Import-Time Report
+# ==========================================
+def parse_importtime(stderr):
+    """Rows of `python -X importtime` output as {"module", "depth", "self_ms", "cumulative_ms"}."""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        parts = line[len("import time:"):].split("|")
+        if len(parts) != 3 or not parts[0].strip().isdigit():
+            continue  # the header line
+        name = parts[2].rstrip()
+        stripped = name.lstrip()
+        rows.append({
+            "module": stripped,
+            "depth": (len(name) - len(stripped) - 1) // 2,
+            "self_ms": int(parts[0]) / 1000,
+            "cumulative_ms": int(parts[1]) / 1000,
+        })
+    return rows
+
+def import_time_report(modules=APP_MODULES, top=15):
+    """
+    Cold-import the given modules in a fresh interpreter with -X importtime and
+    summarise: total time, cost per requested module, and the top self-time hotspots.
+    """
+    code = "import " + ", ".join(modules)
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", code],
+                          capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+    if proc.returncode != 0:
+        raise RuntimeError(proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else "import failed")
+    rows = parse_importtime(proc.stderr)
+    top_level = [r for r in rows if r["depth"] == 0]
+    return {
+        "measured_at": time.time(),
+        "python": sys.version.split()[0],
+        "modules": list(modules),
+        "total_ms": round(sum(r["cumulative_ms"] for r in top_level), 1),
+        "by_module": {r["module"]: r["cumulative_ms"] for r in top_level if r["module"] in modules},
+        "hotspots": sorted(rows, key=lambda r: r["self_ms"], reverse=True)[:top],
+    }
+
+def format_report(report):
+    lines = [f"Cold import of {len(report['modules'])} modules: {report['total_ms']:.1f} ms"]
+    for name, ms in sorted(report["by_module"].items(), key=lambda kv: kv[1], reverse=True):
+        lines.append(f"  {name:<24}{ms:>9.1f} ms")
+    lines.append("Top self-time imports:")
+    for r in report["hotspots"]:
+        lines.append(f"  {r['module']:<40}{r['self_ms']:>9.1f} ms")
+    return "\n".join(lines)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Import-time report for the app's modules.")
+    parser.add_argument("modules", nargs="*", default=list(APP_MODULES))
+    parser.add_argument("--top", type=int, default=15, help="hotspots to list")
+    parser.add_argument("--log", default=None, help="append the report as one JSON line to this file")
+    args = parser.parse_args(argv)
+
+    report = import_time_report(args.modules, args.top)
+    print(format_report(report))
+    if args.log:
+        with open(args.log, "a", encoding="utf-8") as f:
+            f.write(json.dumps(report) + "\n")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
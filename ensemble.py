@@ -0,0 +1,163 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import config
+import agent
+import ratelimit
+import participants
+from mbti import align_scores_with_mbti
+
+DEFAULT_SAMPLES = int(config.env("MBTI_ENSEMBLE_SAMPLES", "3"))
+# Sampling a little hotter than the single-shot 0.2 so the votes are not all the same draw
+SAMPLE_TEMPERATURE = float(config.env("MBTI_ENSEMBLE_TEMPERATURE", "0.7"))
+MAX_WORKERS = int(config.env("MBTI_ENSEMBLE_WORKERS", "8"))
+
+# Letter pairs per dimension; the second letter is the high end of the [E, N, F, P] scores
+LETTER_PAIRS = [("I", "E"), ("S", "N"), ("T", "F"), ("J", "P")]
+
+_executor = None
+_lock = threading.Lock()
+
+# ==========================================
+# 1. Voting
+# ==========================================
+def _pool():
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="mbti-ensemble")
+        return _executor
+
+def quorum(k):
+    """Votes a letter needs before the remaining samples can no longer outvote it."""
+    return k // 2 + 1
+
+def _valid_type(mbti_type):
+    t = (mbti_type or "").upper().strip()
+    return t if len(t) == 4 and all(t[i] in LETTER_PAIRS[i] for i in range(4)) else None
+
+def tally(samples, names):
+    """
+    {name: {"letters": [{letter: votes}] * 4, "scores": [aligned score lists]}} over successful
+    samples, keyed by the requested names: a sample writing "amy" or "Amy C." still votes for "Amy Chen".
+    """
+    votes = {}
+    for results in samples:
+        voted = set()  # one vote per speaker per sample, even if the model lists them twice
+        for person in results:
+            mbti_type = _valid_type(person.get("mbti"))
+            name = participants.match_name(person.get("name"), names)
+            if not mbti_type or not name or name in voted:
+                continue
+            voted.add(name)
+            entry = votes.setdefault(name, {"letters": [{} for _ in LETTER_PAIRS], "scores": []})
+            for i, letter in enumerate(mbti_type):
+                entry["letters"][i][letter] = entry["letters"][i].get(letter, 0) + 1
+            try:
+                entry["scores"].append([float(s) for s in align_scores_with_mbti(mbti_type, person.get("scores") or [])])
+            except (TypeError, ValueError):
+                pass
+    return votes
+
+def has_quorum(votes, names, k):
+    """True once every speaker's every letter has a majority of the k planned samples."""
+    need = quorum(k)
+    return all(
+        name in votes and all(max(letters.values(), default=0) >= need for letters in votes[name]["letters"])
+        for name in names)
+
+def vote(votes, names):
+    """Per-letter majority type, mean scores aligned to it, and agreement (weakest letter's vote share)."""
+    results = []
+    for name in names:
+        entry = votes.get(name)
+        if not entry:
+            continue
+        n_scores = len(entry["scores"])
+        mean = [sum(col) / n_scores for col in zip(*entry["scores"])] if n_scores else [50.0] * 4
+        letters, shares = "", []
+        for i, counts in enumerate(entry["letters"]):
+            low, high = LETTER_PAIRS[i]
+            if counts.get(low, 0) == counts.get(high, 0):
+                letter = high if mean[i] >= 50 else low  # tie: the averaged score decides
+            else:
+                letter = high if counts.get(high, 0) > counts.get(low, 0) else low
+            letters += letter
+            shares.append(counts.get(letter, 0) / max(1, sum(counts.values())))
+        results.append({
+            "name": name,
+            "mbti": letters,
+            "scores": [int(round(s)) for s in align_scores_with_mbti(letters, mean)],
+            "agreement": round(min(shares), 2),
+            "votes": sum(entry["letters"][0].values()),
+        })
+    return results
+
+# ==========================================
+# 2. Ensemble Request
+# ==========================================
+def run_ensemble_request(system_prompt, user_content, selected_people, api_key, base_url, model_name,
+                         k=DEFAULT_SAMPLES, should_stop=None, on_result=None):
+    """
+    k concurrent run_analysis_request samples, voted per speaker and letter. Stops
+    waiting (and cancels samples not yet started) once every speaker has a quorum.
+    Samples already on the wire finish in the background and are discarded.
+    A single sample (k=1) streams, calling on_result(person) as each speaker arrives.
+    """
+    if k <= 1:
+        return agent.run_analysis_request(system_prompt, user_content, selected_people, api_key, base_url, model_name,
+                                          on_result=on_result)
+
+    level = ratelimit.current_priority()
+    def sample():
+        with ratelimit.priority(level):
+            return agent.run_analysis_request(system_prompt, user_content, selected_people,
+                                              api_key, base_url, model_name, temperature=SAMPLE_TEMPERATURE)
+
+    pending = {_pool().submit(sample) for _ in range(k)}
+    samples, raws, errors, stopped = [], [], [], False
+    try:
+        while pending:
+            done, pending = wait(pending, timeout=1.0, return_when=FIRST_COMPLETED)
+            for fut in done:
+                try:
+                    res = fut.result()
+                    samples.append(res.get("results", []))
+                    if res.get("raw"):
+                        raws.append(res["raw"])
+                except Exception as e:
+                    errors.append(e)
+            if samples and has_quorum(tally(samples, selected_people), selected_people, k):
+                break
+            if should_stop and should_stop():
+                stopped = True
+                break
+    finally:
+        for fut in pending:
+            fut.cancel()
+
+    if not samples and stopped:
+        return {"results": [], "raw": None, "samples": 0}
+    if not samples:
+        raise errors[-1] if errors else Exception("Analysis failed: no samples finished")
+    votes = tally(samples, selected_people)
+    missing = [name for name in selected_people if name not in votes]
+    if missing and not stopped:
+        # As loud as the single call's count check: nobody is dropped silently
+        raise Exception(f"Analysis failed: no sample analysed {', '.join(missing)} ({len(samples)} samples)")
+    return {
+        "results": vote(votes, selected_people),
+        "raw": "\n".join(raws) or None,
+        "samples": len(samples),
+    }
+
+async def run_ensemble_request_async(system_prompt, user_content, selected_people, api_key, base_url, model_name,
+                                     k=DEFAULT_SAMPLES, semaphore=None):
+    """Non-blocking run_ensemble_request; the semaphore counts the whole ensemble as one slot."""
+    if semaphore is None:
+        return await asyncio.to_thread(
+            run_ensemble_request, system_prompt, user_content, selected_people, api_key, base_url, model_name, k)
+    async with semaphore:
+        return await asyncio.to_thread(
+            run_ensemble_request, system_prompt, user_content, selected_people, api_key, base_url, model_name, k)
@@ -0,0 +1,181 @@
+import os
+import io
+import hashlib
+import threading
+import urllib.parse
+
+import config
+import jobs
+import ratelimit
+
+IMAGE_DIR = config.env("MBTI_IMAGE_DIR", ".image_cache")
+MAX_CACHE_BYTES = int(config.env("MBTI_IMAGE_CACHE_MB", "200")) * 1024 * 1024
+THUMB_SIZE = (256, 256)
+STYLE_SUFFIX = ", cute style, digital art, 4k"
+# Leading bytes -> (file extension, MIME type) of the formats the image API returns
+IMAGE_SIGNATURES = [
+    (b"\x89PNG", ("png", "image/png")),
+    (b"\xff\xd8\xff", ("jpg", "image/jpeg")),
+    (b"GIF8", ("gif", "image/gif")),
+    (b"RIFF", ("webp", "image/webp")),
+]
+
+_inflight = {}  # image key -> job id, so identical prompts in flight share one request
+_lock = threading.Lock()
+
+# ==========================================
+# 1. Blob Store
+# ==========================================
+def seed_for(prompt):
+    """Deterministic seed, so the same prompt maps to the same cached image."""
+    return int(hashlib.sha1(prompt.encode("utf-8")).hexdigest(), 16) % 99999 + 1
+
+def image_key(prompt, seed, width, height):
+    return hashlib.sha1(f"{prompt}|{seed}|{width}x{height}".encode("utf-8")).hexdigest()
+
+def blob_path(key, thumb=False):
+    return os.path.join(IMAGE_DIR, key[:2], f"{key}{'_thumb.jpg' if thumb else '.img'}")
+
+def get_cached(key, thumb=False):
+    """Path of a stored image (touched for LRU), or None."""
+    path = blob_path(key, thumb)
+    if not os.path.exists(path):
+        return None
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+    return path
+
+def read_image(key):
+    """Bytes of a stored full-size image (empty if it has been evicted since)."""
+    path = get_cached(key)
+    if path is None:
+        return b""
+    with open(path, "rb") as f:
+        return f.read()
+
+def image_format(key):
+    """(extension, MIME type) of a stored full-size image, from its first bytes; PNG if unknown."""
+    path = blob_path(key)
+    try:
+        with open(path, "rb") as f:
+            head = f.read(12)
+    except OSError:
+        head = b""
+    for magic, fmt in IMAGE_SIGNATURES:
+        if head.startswith(magic):
+            return fmt
+    return IMAGE_SIGNATURES[0][1]
+
+def _write_atomic(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.{threading.get_ident()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+def _make_thumbnail(data):
+    try:
+        from PIL import Image
+        img = Image.open(io.BytesIO(data))
+        img.thumbnail(THUMB_SIZE)
+        out = io.BytesIO()
+        img.convert("RGB").save(out, format="JPEG", quality=80)
+        return out.getvalue()
+    except Exception as e:
+        print(f"Thumbnail Error: {e}")
+        return None
+
+def store_image(key, data):
+    _write_atomic(blob_path(key), data)
+    thumb = _make_thumbnail(data)
+    if thumb:
+        _write_atomic(blob_path(key, thumb=True), thumb)
+    evict()
+
+def evict(max_bytes=MAX_CACHE_BYTES):
+    """Delete least recently used blobs until the store fits in max_bytes."""
+    entries = []
+    for root, _, names in os.walk(IMAGE_DIR):
+        for name in names:
+            path = os.path.join(root, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+            total -= size
+        except OSError:
+            pass
+
+# ==========================================
+# 2. Generation
+# ==========================================
+def fetch_pollinations(prompt, seed, width, height, api_key=None):
+    """Download one image from Pollinations.ai; raises on any non-image response."""
+    safe_prompt = urllib.parse.quote(prompt + STYLE_SUFFIX)
+    url = f"https://image.pollinations.ai/prompt/{safe_prompt}?width={width}&height={height}&seed={seed}&model=flux&nologo=true"
+
+    headers = {
+        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
+        "Accept": "image/*"
+    }
+    if api_key:
+        headers["Authorization"] = f"Bearer {api_key}"
+
+    requests = config.lazy_import("requests")
+    ratelimit.acquire("images")
+    response = requests.get(url, headers=headers, timeout=30)
+    if response.status_code == 429:
+        ratelimit.backoff("images", ratelimit.retry_after_seconds(response))
+    if response.status_code != 200:
+        raise Exception(f"API Error {response.status_code}: {response.text[:200]}")
+    if "image" not in response.headers.get("Content-Type", ""):
+        raise Exception("API returned text/html instead of an image.")
+    return response.content
+
+def _image_job(job, key, prompt, seed, width, height, api_key):
+    try:
+        if not get_cached(key):
+            jobs.report(job, 0, 1, "Painting...")
+            store_image(key, fetch_pollinations(prompt, seed, width, height, api_key))
+        return {"key": key}
+    finally:
+        with _lock:
+            _inflight.pop(key, None)
+
+def request_image(prompt, width=1024, height=1024, seed=None, api_key=None):
+    """
+    Reference to an image for prompt: {"key", "job_id"}. Cache hits come back
+    with job_id None; misses are generated in the background job pool.
+    """
+    seed = seed or seed_for(prompt)
+    key = image_key(prompt, seed, width, height)
+    if get_cached(key):
+        return {"key": key, "job_id": None}
+    api_key = api_key or config.env("POLL_API_KEY")
+    with _lock:
+        job_id = _inflight.get(key)
+        if not job_id:
+            job_id = jobs.submit(_image_job, key, prompt, seed, width, height, api_key)
+            _inflight[key] = job_id
+    return {"key": key, "job_id": job_id}
+
+def image_status(ref):
+    """("ready", path) / ("pending", None) / ("failed", error message)."""
+    path = get_cached(ref["key"])
+    if path:
+        return "ready", path
+    job = jobs.get_job(ref["job_id"]) if ref.get("job_id") else None
+    if job and job["status"] in ("queued", "running"):
+        return "pending", None
+    if job and job["status"] == "failed":
+        return "failed", job["error"]
+    return "failed", "Image is no longer available."
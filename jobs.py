@@ -0,0 +1,156 @@
+import time
+import uuid
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import config
+import mbti
+import ratelimit
+import ensemble
+
+MAX_WORKERS = int(config.env("MBTI_JOB_WORKERS", "4"))
+# Jobs waiting or running at once, across all sessions; beyond this new jobs are refused
+MAX_PENDING_JOBS = int(config.env("MBTI_MAX_PENDING_JOBS", "32"))
+ANALYSIS_BATCH_SIZE = int(config.env("MBTI_ANALYSIS_BATCH_SIZE", "5"))
+# Finished jobs are kept this long so a polling session can still pick up the result
+JOB_TTL_SECONDS = 600
+
+_executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="mbti-job")
+_jobs = {}
+_lock = threading.Lock()
+
+class JobCancelled(Exception):
+    pass
+
+# ==========================================
+# 1. Job Registry
+# ==========================================
+def _prune():
+    now = time.time()
+    for job_id in [j for j, job in _jobs.items()
+                   if job["finished_at"] and now - job["finished_at"] > JOB_TTL_SECONDS]:
+        del _jobs[job_id]
+
+def _run(job, fn, args, kwargs):
+    if job["cancel"].is_set():
+        _finish(job, "cancelled")
+        return
+    with _lock:
+        job["status"] = "running"
+        job["started_at"] = time.time()
+    try:
+        result = fn(job, *args, **kwargs)
+        _finish(job, "done", result=result)
+    except JobCancelled:
+        _finish(job, "cancelled")
+    except Exception as e:
+        _finish(job, "failed", error=str(e))
+
+def _finish(job, status, result=None, error=None):
+    with _lock:
+        job["status"] = status
+        job["result"] = result
+        job["error"] = error
+        job["finished_at"] = time.time()
+
+def submit(fn, *args, **kwargs):
+    """
+    Run fn(job, *args, **kwargs) on the shared worker pool and return its job id.
+    fn reports progress with report() and should call check_cancelled() between steps.
+    """
+    with _lock:
+        _prune()
+        active = sum(1 for j in _jobs.values() if j["status"] in ("queued", "running"))
+        if active >= MAX_PENDING_JOBS:
+            raise RuntimeError("The North Pole is busy right now, please try again in a minute. 🦌")
+        job = {
+            "id": uuid.uuid4().hex,
+            "status": "queued",
+            "done": 0, "total": 0, "message": "Waiting for a free elf...",
+            "partial": None, "result": None, "error": None,
+            "cancel": threading.Event(),
+            "created_at": time.time(), "started_at": None, "finished_at": None,
+        }
+        _jobs[job["id"]] = job
+    _executor.submit(_run, job, fn, args, kwargs)
+    return job["id"]
+
+def get_job(job_id):
+    """Snapshot of a job's public fields, or None if unknown/expired."""
+    with _lock:
+        job = _jobs.get(job_id)
+        if not job:
+            return None
+        return {k: v for k, v in job.items() if k != "cancel"}
+
+def cancel(job_id):
+    with _lock:
+        job = _jobs.get(job_id)
+    if job:
+        job["cancel"].set()
+
+def report(job, done, total, message="", partial=None):
+    with _lock:
+        job["done"], job["total"], job["message"] = done, total, message
+        if partial is not None:
+            job["partial"] = list(partial)
+
+def check_cancelled(job):
+    if job["cancel"].is_set():
+        raise JobCancelled()
+
+# ==========================================
+# 2. Analysis Job
+# ==========================================
+def split_batches(names, size=ANALYSIS_BATCH_SIZE):
+    names = list(names)
+    return [names[i:i + size] for i in range(0, len(names), size)]
+
+def is_complete_result(person):
+    """A streamed speaker object with enough in it to list and chart."""
+    scores = person.get("scores")
+    return (isinstance(person.get("mbti"), str) and len(person["mbti"].strip()) == 4
+            and isinstance(scores, list) and len(scores) == 4
+            and all(isinstance(s, (int, float)) for s in scores))
+
+def run_analysis_job(job, speakers_data, api_key, base_url, model_name, quick_precheck=False, samples=1):
+    """Pre-classify locally, then analyse the remaining speakers in LLM batches (queued behind chat)."""
+    with ratelimit.priority(ratelimit.BACKGROUND):
+        return _analyse_batches(job, speakers_data, api_key, base_url, model_name, quick_precheck, samples)
+
+def _analyse_batches(job, speakers_data, api_key, base_url, model_name, quick_precheck, samples):
+    if quick_precheck:
+        stylometry = config.lazy_import("stylometry")
+        results, llm_people = stylometry.preclassify_speakers(speakers_data)
+    else:
+        results, llm_people = [], list(speakers_data)
+
+    batches = split_batches(llm_people)
+    report(job, 0, len(batches), f"{len(results)} speakers scored locally, {len(llm_people)} to analyse", results)
+
+    raws = []
+    for i, batch in enumerate(batches):
+        check_cancelled(job)
+        sys_prompt, user_content = mbti.construct_analysis_prompt({n: speakers_data[n] for n in batch})
+        streamed = []
+
+        def on_result(person, i=i, batch=batch, streamed=streamed):
+            # Published as partial results so the app can show each speaker before the batch finishes
+            if person.get("name") in batch and is_complete_result(person):
+                streamed.append(person)
+                report(job, i, len(batches), f"Analysed {len(results) + len(streamed)} / {len(speakers_data)} speakers",
+                       results + streamed)
+
+        # samples > 1 votes over concurrent samples and stops early once every speaker agrees
+        res = ensemble.run_ensemble_request(sys_prompt, user_content, batch, api_key, base_url, model_name,
+                                            k=samples, should_stop=job["cancel"].is_set, on_result=on_result)
+        results += res.get("results", [])
+        if res.get("raw"):
+            raws.append(res["raw"])
+        report(job, i + 1, len(batches), f"Analysed {len(results)} / {len(speakers_data)} speakers", results)
+
+    return {"results": results, "raw": "\n".join(raws) or None}
+
+def submit_analysis(speakers_data, api_key, base_url, model_name, quick_precheck=False, samples=1):
+    return submit(run_analysis_job, speakers_data, api_key, base_url, model_name,
+                  quick_precheck=quick_precheck, samples=samples)
@@ -1,5 +1,11 @@
 import re
 import json
+import hashlib
+import threading
+from collections import OrderedDict
+
+import config
+import chat_formats
 
 # ==========================================
 # 1. Language Helper
@@ -36,36 +42,119 @@ def align_scores_with_mbti(mbti_type, raw_scores):
 # ==========================================
 # 3. File Parser
 # ==========================================
-def parse_line_chat_dynamic(file_content):
-    lines = file_content.split('\n')
-    messages = {}
-    
-    skip_keywords = ["通話時間", "Call time", "Unsend message", "joined the chat", "invite"]
-    invalid_names = ["You", "you", "System", "Monday", "Tuesday", "Wednesday", "Thursday", "Friday"]
-
-    for line in lines:
-        line = line.strip()
-        if not line: continue
-        parts = line.split('\t')
-        if len(parts) < 3: parts = line.split(' ', 2)
-
-        if len(parts) >= 3:
-            time_str, name, msg = parts[0], parts[1].strip(), parts[2].strip()
-            
-            if not re.match(r'^\d{1,2}:\d{2}$', time_str): continue
-            if name.endswith(" Photos") or name.endswith(" Stickers"): name = name.replace(" Photos", "").replace(" Stickers", "")
-            if any(k in msg for k in skip_keywords): continue
-            if msg in ["[Photos]", "[Stickers]"]: continue 
-            if name in invalid_names: continue
-
-            if name not in messages: messages[name] = []
-            messages[name].append(msg)
-            
+# LINE, WhatsApp and other layouts live in chat_formats; these names stay for existing callers
+SKIP_KEYWORDS = chat_formats.SKIP_KEYWORDS
+INVALID_NAMES = chat_formats.INVALID_NAMES
+
+def parse_line(line):
+    """Parse one export row into (name, msg), or None if the row should be skipped."""
+    return chat_formats.parse_row(line)
+
+def parse_line_chat_messages(file_content, messages=None, fmt=None):
+    """Collect {name: [msg, ...]} from raw export text, appending to `messages` if given."""
+    return chat_formats.parse_messages(file_content, fmt, messages)
+
+def join_speaker_messages(messages):
+    """Join message lists into the {name: text} shape, dropping speakers with < 3 messages."""
     return {k: "\n".join(v) for k, v in messages.items() if len(v) >= 3}
 
+def parse_line_chat_dynamic(file_content):
+    return join_speaker_messages(parse_line_chat_messages(file_content))
+
+# ==========================================
+# 3b. Incremental Parsing & Fingerprints
+# ==========================================
+def content_hash(text):
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+def parse_line_chat_incremental(file_content, state=None):
+    """
+    Parse a chat export, re-reading only the appended tail when the file
+    starts with the content parsed in `state` (from a previous call).
+    Returns (speakers, new_state).
+    """
+    offset, messages, fmt = 0, {}, None
+    if state and len(file_content) >= state["offset"] and \
+            content_hash(file_content[:state["offset"]]) == state["prefix_hash"]:
+        offset = state["offset"]
+        messages = {k: list(v) for k, v in state["messages"].items()}
+        fmt = state.get("format")
+    # Detected once from the head of the export, so appended tails parse with the same layout
+    fmt = fmt or chat_formats.detect_format(file_content)
+
+    # Only complete lines are committed to the state; a trailing partial line is re-read next time
+    end = max(file_content.rfind('\n') + 1, offset)
+    parse_line_chat_messages(file_content[offset:end], messages, fmt)
+
+    new_state = {"offset": end, "prefix_hash": content_hash(file_content[:end]), "messages": messages,
+                 "format": fmt}
+
+    if end < len(file_content):
+        messages = parse_line_chat_messages(file_content[end:], {k: list(v) for k, v in messages.items()}, fmt)
+    return join_speaker_messages(messages), new_state
+
+def fingerprint_messages(msgs):
+    """Fingerprint of one speaker's message stream."""
+    return {"hash": content_hash("\n".join(msgs)), "count": len(msgs)}
+
+def changed_speakers(messages, fingerprints, threshold=0.2):
+    """
+    Names from {name: [msg, ...]} whose stream differs from its stored fingerprint.
+    Pure appends only count as changed when the new messages exceed `threshold`
+    (a fraction of the previously analysed message count).
+    """
+    changed = []
+    for name, msgs in messages.items():
+        fp = fingerprints.get(name)
+        if not fp or len(msgs) < fp["count"] or content_hash("\n".join(msgs[:fp["count"]])) != fp["hash"]:
+            changed.append(name)
+            continue
+        if (len(msgs) - fp["count"]) / max(fp["count"], 1) > threshold:
+            changed.append(name)
+    return changed
+
+# ==========================================
+# 3c. Shared Parse Cache
+# ==========================================
+# Process-wide, so many sessions uploading the same export parse it once
+PARSE_CACHE_BYTES = int(float(config.env("MBTI_PARSE_CACHE_MB", "64")) * 1024 * 1024)
+
+_parse_cache = OrderedDict()  # content hash -> (speakers, state, estimated bytes)
+_parse_cache_bytes = 0
+_parse_cache_lock = threading.Lock()
+
+def parse_line_chat_shared(file_content, state=None):
+    """
+    parse_line_chat_incremental with a shared cache keyed by the file's content
+    hash. The returned objects are shared between sessions: do not mutate them.
+    """
+    global _parse_cache_bytes
+    key = content_hash(file_content)
+    with _parse_cache_lock:
+        hit = _parse_cache.get(key)
+        if hit:
+            _parse_cache.move_to_end(key)
+            return hit[0], hit[1]
+
+    speakers, new_state = parse_line_chat_incremental(file_content, state)
+    # Raw messages, joined speaker text and dict overhead: roughly 3x the file
+    size = 3 * len(file_content)
+    if size <= PARSE_CACHE_BYTES:
+        with _parse_cache_lock:
+            if key not in _parse_cache:
+                _parse_cache[key] = (speakers, new_state, size)
+                _parse_cache_bytes += size
+            while _parse_cache_bytes > PARSE_CACHE_BYTES:
+                _, (_, _, evicted) = _parse_cache.popitem(last=False)
+                _parse_cache_bytes -= evicted
+    return speakers, new_state
+
 # ==========================================
 # 4. Prompt Constructor
 # ==========================================
+# Bump whenever the analysis prompt changes so stored results are not reused across prompts
+PROMPT_VERSION = "1"
+
 def construct_analysis_prompt(selected_speakers_data):
     conversation_sample = ""
     for name, text in selected_speakers_data.items():
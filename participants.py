@@ -0,0 +1,162 @@
+import re
+import threading
+from collections import OrderedDict
+
+CJK_RE = re.compile(r"[\u4e00-\u9fff]")
+CJK_RUN_RE = re.compile(r"[\u4e00-\u9fff]+")
+LATIN_TOKEN_RE = re.compile(r"[a-z0-9][a-z0-9'._-]*")
+# Common Chinese nickname prefixes: 小明 / 阿明 for 王小明
+CJK_NICK_PREFIXES = ("小", "阿")
+# Latin words shorter than this are never fuzzy-matched ("me", "at", ...)
+FUZZY_MIN_LEN = 4
+FUZZY_MIN_SIMILARITY = 0.5
+INDEX_CACHE_SIZE = 32
+
+_indexes = OrderedDict()  # tuple of names -> index, so each analysed group is indexed once
+_lock = threading.Lock()
+
+# ==========================================
+# 1. Aliases
+# ==========================================
+def name_aliases(name):
+    """Every way a participant is likely to be mentioned: full name, name parts and Chinese nicknames."""
+    lowered = name.lower().strip()
+    aliases = {lowered, re.sub(r"\s+", "", lowered)}
+    tokens = LATIN_TOKEN_RE.findall(lowered)
+    aliases.update(t for t in tokens if len(t) >= 2)
+    for run in CJK_RUN_RE.findall(lowered):
+        aliases.add(run)
+        if len(run) >= 3:
+            given = run[-2:]  # 王小明 -> 小明
+            aliases.add(given)
+            aliases.update(p + run[-1] for p in CJK_NICK_PREFIXES)
+    return {a for a in aliases if a}
+
+def _trigrams(word):
+    padded = f" {word} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+# ==========================================
+# 2. Index
+# ==========================================
+def build_index(results):
+    """
+    Alias table (a hashed trie: every alias is a key, probed by length) plus a
+    trigram posting list for typo-tolerant Latin matches.
+    """
+    aliases = {}   # alias -> [person index]; shared first names map to several people
+    grams = {}     # trigram -> set of Latin aliases containing it
+    for i, person in enumerate(results):
+        for alias in name_aliases(person.get("name", "")):
+            owners = aliases.setdefault(alias, [])
+            if i not in owners:
+                owners.append(i)
+            if not CJK_RE.search(alias) and len(alias) >= FUZZY_MIN_LEN:
+                for g in _trigrams(alias):
+                    grams.setdefault(g, set()).add(alias)
+    return {
+        "people": list(results),
+        "aliases": aliases,
+        "grams": grams,
+        "max_len": max((len(a) for a in aliases), default=0),
+    }
+
+def index_for(results):
+    """Cached index for an analysis result list."""
+    key = tuple(p.get("name", "") for p in results)
+    with _lock:
+        if key in _indexes:
+            _indexes.move_to_end(key)
+            index = _indexes[key]
+            if index["people"] == list(results):
+                return index
+    index = build_index(results)
+    with _lock:
+        _indexes[key] = index
+        while len(_indexes) > INDEX_CACHE_SIZE:
+            _indexes.popitem(last=False)
+    return index
+
+# ==========================================
+# 3. Resolution
+# ==========================================
+def _is_boundary(text, pos):
+    return pos < 0 or pos >= len(text) or not text[pos].isalnum() or CJK_RE.match(text[pos]) is not None
+
+def _fuzzy_alias(index, word):
+    candidates = {}
+    for g in _trigrams(word):
+        for alias in index["grams"].get(g, ()):
+            candidates[alias] = candidates.get(alias, 0) + 1
+    best, best_score = None, FUZZY_MIN_SIMILARITY
+    word_grams = len(_trigrams(word))
+    for alias, shared in candidates.items():
+        score = shared / (word_grams + len(_trigrams(alias)) - shared)
+        if score >= best_score:
+            best, best_score = alias, score
+    return best
+
+def _compact(name):
+    return re.sub(r"\s+", "", (name or "").lower())
+
+def match_name(name, names):
+    """
+    Which of names a name written back by the model means (case, spacing, a
+    nickname or dropped surname, a small typo), or None if it is not clear.
+    """
+    if name in names:
+        return name
+    key = _compact(name)
+    if not key:
+        return None
+    for candidates in ([n for n in names if _compact(n) == key],
+                       [n for n in names if key in name_aliases(n)]):
+        if len(candidates) == 1:
+            return candidates[0]
+    grams = _trigrams(key)
+    scored = sorted(((len(grams & _trigrams(_compact(n))) / len(grams | _trigrams(_compact(n))), n) for n in names),
+                    reverse=True)
+    if scored and scored[0][0] >= FUZZY_MIN_SIMILARITY and (len(scored) == 1 or scored[1][0] < scored[0][0]):
+        return scored[0][1]
+    return None
+
+def resolve_mentions(index, text, fuzzy=True):
+    """
+    Indices of the people mentioned in text, in order of first mention. Each position probes the
+    alias table once per alias length, so the cost does not grow with group size.
+    """
+    text = (text or "").lower()
+    first_seen, spans = {}, []
+    i, max_len = 0, index["max_len"]
+    while i < len(text):
+        match = None
+        for length in range(min(max_len, len(text) - i), 0, -1):
+            alias = text[i:i + length]
+            owners = index["aliases"].get(alias)
+            if not owners:
+                continue
+            # Latin aliases must stand as whole words; Chinese text has no word breaks
+            if CJK_RE.match(alias[0]) or (_is_boundary(text, i - 1) and _is_boundary(text, i + length)):
+                match = (owners[0], length)
+                break
+        if match:
+            first_seen.setdefault(match[0], i)
+            spans.append((i, i + match[1]))
+            i += match[1]
+        else:
+            i += 1
+
+    if fuzzy and index["grams"]:
+        for m in LATIN_TOKEN_RE.finditer(text):
+            if len(m.group()) < FUZZY_MIN_LEN or any(s <= m.start() < e for s, e in spans):
+                continue
+            alias = _fuzzy_alias(index, m.group())
+            if alias:
+                first_seen.setdefault(index["aliases"][alias][0], m.start())
+    return sorted(first_seen, key=first_seen.get)
+
+def find_people(text, results, fuzzy=True):
+    """Result dicts of the people mentioned in text."""
+    if not results:
+        return []
+    return [results[i] for i in resolve_mentions(index_for(results), text, fuzzy)]
@@ -0,0 +1,254 @@
+import re
+
+import config
+import store
+import similarity
+
+# Size of the frequent-terms sketch kept per speaker
+TOP_TERMS_K = 40
+# Chats remembered individually per speaker; beyond this the least recently seen is forgotten.
+# A forgotten chat stays in the totals, but if it is uploaded again it is merged again.
+MAX_TRACKED_CHATS = int(config.env("MBTI_PROFILE_MAX_CHATS", "50"))
+
+TERM_RE = re.compile(r"[a-z']{3,}|[\u4e00-\u9fff]{2}")
+
+# Stylometry pulls in numpy; only needed once a profile is built or summarised
+def _stylometry():
+    return config.lazy_import("stylometry")
+
+# ==========================================
+# 1. Streaming Statistics
+# ==========================================
+def new_profile(name):
+    return {
+        "name": name,
+        "chats": {},          # chat_fp -> {"seen", "stats", "result"}, at most MAX_TRACKED_CHATS
+        "chat_count": 0,      # distinct chats ever merged
+        "messages": 0,
+        "chars": 0,
+        "feature_means": [0.0] * len(_stylometry().FEATURE_NAMES),
+        "analyses": 0,
+        "score_mean": [0.0] * 4,
+        "score_m2": [0.0] * 4,
+        "types": {},
+        "terms": {},
+    }
+
+def _merge_moments(n_a, mean_a, m2_a, n_b, mean_b, m2_b):
+    """Chan et al. parallel update of (count, mean, M2) per dimension."""
+    n = n_a + n_b
+    if n == 0:
+        return mean_a, m2_a
+    mean, m2 = [], []
+    for ma, sa, mb, sb in zip(mean_a, m2_a, mean_b, m2_b):
+        delta = mb - ma
+        mean.append(ma + delta * n_b / n)
+        m2.append(sa + sb + delta * delta * n_a * n_b / n)
+    return mean, m2
+
+def _merge_terms(a, b, k=TOP_TERMS_K):
+    """Misra-Gries merge: add counters, then keep only the k heaviest after subtracting the (k+1)-th."""
+    merged = dict(a)
+    for term, c in b.items():
+        merged[term] = merged.get(term, 0) + c
+    if len(merged) <= k:
+        return merged
+    cutoff = sorted(merged.values(), reverse=True)[k]
+    return {t: c - cutoff for t, c in merged.items() if c > cutoff}
+
+def _empty_stats():
+    return {"messages": 0, "chars": 0, "feature_means": [0.0] * len(_stylometry().FEATURE_NAMES), "terms": {}}
+
+def _batch_stats(msgs):
+    text = "\n".join(msgs)
+    features, n = _stylometry().extract_features(text)
+    terms = {}
+    for term in TERM_RE.findall(text.lower()):
+        terms[term] = terms.get(term, 0) + 1
+    return {"messages": n, "chars": len(text), "feature_means": list(features), "terms": _merge_terms({}, terms)}
+
+def _fold_stats(target, stats, sign=1):
+    """Add (sign=1) or take back out (sign=-1) a batch's message statistics."""
+    n_old, n_b = target["messages"], stats["messages"]
+    n = n_old + sign * n_b
+    if n <= 0:
+        target.update(_empty_stats())
+        return target
+    target["feature_means"] = [
+        (old * n_old + sign * new * n_b) / n for old, new in zip(target["feature_means"], stats["feature_means"])
+    ]
+    target["messages"] = n
+    target["chars"] = max(0, target["chars"] + sign * stats["chars"])
+    if sign > 0:
+        target["terms"] = _merge_terms(target["terms"], stats["terms"])
+    else:
+        target["terms"] = {t: c - stats["terms"].get(t, 0) for t, c in target["terms"].items()
+                           if c > stats["terms"].get(t, 0)}
+    return target
+
+def add_messages(profile, msgs):
+    """Fold a batch of new messages into the profile without keeping them."""
+    if msgs:
+        _fold_stats(profile, _batch_stats(msgs))
+    return profile
+
+def add_result(profile, result):
+    """Fold one analysis result ({"mbti", "scores"}) into the running score statistics."""
+    scores = result.get("scores") or []
+    if len(scores) == 4:
+        profile["score_mean"], profile["score_m2"] = _merge_moments(
+            profile["analyses"], profile["score_mean"], profile["score_m2"],
+            1, [float(s) for s in scores], [0.0] * 4)
+        profile["analyses"] += 1
+    mbti_type = (result.get("mbti") or "").upper()
+    if mbti_type:
+        profile["types"][mbti_type] = profile["types"].get(mbti_type, 0) + 1
+    return profile
+
+def remove_result(profile, result):
+    """Undo add_result for a result that is being replaced."""
+    scores = result.get("scores") or []
+    n = profile["analyses"]
+    if len(scores) == 4 and n > 0:
+        x = [float(s) for s in scores]
+        if n == 1:
+            profile["score_mean"], profile["score_m2"] = [0.0] * 4, [0.0] * 4
+        else:
+            mean = profile["score_mean"]
+            new_mean = [(m * n - xi) / (n - 1) for m, xi in zip(mean, x)]
+            profile["score_m2"] = [max(0.0, s - (xi - nm) * (xi - m))
+                                   for s, xi, nm, m in zip(profile["score_m2"], x, new_mean, mean)]
+            profile["score_mean"] = new_mean
+        profile["analyses"] = n - 1
+    mbti_type = (result.get("mbti") or "").upper()
+    if profile["types"].get(mbti_type, 0) > 1:
+        profile["types"][mbti_type] -= 1
+    else:
+        profile["types"].pop(mbti_type, None)
+    return profile
+
+def merge_profiles(a, b):
+    """Combine two profiles of the same person (e.g. from different servers or back-fills)."""
+    merged = new_profile(a["name"])
+    chats_a, chats_b = _tracked_chats(a), _tracked_chats(b)
+    merged["chats"] = dict(chats_a)
+    for chat_fp, entry in chats_b.items():
+        if entry["seen"] > merged["chats"].get(chat_fp, {"seen": -1})["seen"]:
+            merged["chats"][chat_fp] = entry
+    # Untracked (forgotten) chats on either side still count
+    merged["chat_count"] = len(merged["chats"]) + sum(
+        max(0, p.get("chat_count", len(c)) - len(c)) for p, c in ((a, chats_a), (b, chats_b)))
+    while len(merged["chats"]) > MAX_TRACKED_CHATS:
+        merged["chats"].pop(next(iter(merged["chats"])))
+
+    n_a, n_b = a["messages"], b["messages"]
+    merged["messages"] = n_a + n_b
+    merged["chars"] = a["chars"] + b["chars"]
+    if merged["messages"]:
+        merged["feature_means"] = [
+            (fa * n_a + fb * n_b) / merged["messages"] for fa, fb in zip(a["feature_means"], b["feature_means"])
+        ]
+
+    merged["analyses"] = a["analyses"] + b["analyses"]
+    merged["score_mean"], merged["score_m2"] = _merge_moments(
+        a["analyses"], a["score_mean"], a["score_m2"], b["analyses"], b["score_mean"], b["score_m2"])
+
+    merged["types"] = dict(a["types"])
+    for t, c in b["types"].items():
+        merged["types"][t] = merged["types"].get(t, 0) + c
+    merged["terms"] = _merge_terms(a["terms"], b["terms"])
+    return merged
+
+# ==========================================
+# 2. Profile Summary
+# ==========================================
+def summarize_profile(profile):
+    """Compact, JSON-friendly view of a profile for prompts and the UI."""
+    n = profile["analyses"]
+    variance = [m2 / (n - 1) if n > 1 else 0.0 for m2 in profile["score_m2"]]
+    top_terms = sorted(profile["terms"].items(), key=lambda kv: kv[1], reverse=True)[:10]
+    return {
+        "name": profile["name"],
+        "chats": profile.get("chat_count", len(profile["chats"])),
+        "messages": profile["messages"],
+        "avg_message_chars": round(profile["chars"] / profile["messages"], 1) if profile["messages"] else 0,
+        "most_common_type": max(profile["types"], key=profile["types"].get) if profile["types"] else None,
+        "type_counts": profile["types"],
+        "score_mean": [round(m, 1) for m in profile["score_mean"]],
+        "score_std": [round(v ** 0.5, 1) for v in variance],
+        "style": {k: round(v, 3) for k, v in zip(_stylometry().FEATURE_NAMES, profile["feature_means"])},
+        "top_terms": [t for t, _ in top_terms],
+    }
+
+# ==========================================
+# 3. Persistence Helpers
+# ==========================================
+def _tracked_chats(profile):
+    """profile["chats"] in the current shape; profiles saved before kept only a message count."""
+    return {fp: entry if isinstance(entry, dict) else {"seen": entry, "stats": None, "result": None}
+            for fp, entry in profile["chats"].items()}
+
+def _chat_entry(profile, chat_fp):
+    """This chat's entry, made most recent; the least recent is forgotten beyond MAX_TRACKED_CHATS."""
+    chats = profile["chats"] = _tracked_chats(profile)
+    profile.setdefault("chat_count", len(chats))
+    entry = chats.pop(chat_fp, None)
+    if entry is None:
+        entry = {"seen": 0, "stats": _empty_stats(), "result": None}
+        profile["chat_count"] += 1
+    chats[chat_fp] = entry
+    while len(chats) > MAX_TRACKED_CHATS:
+        chats.pop(next(iter(chats)))
+    return entry
+
+def record_speaker(name, chat_fp, msgs, result=None):
+    """
+    Merge one speaker's messages from a chat (only those not merged before)
+    and an optional analysis result into their stored cross-chat profile.
+    A re-analysis of the same chat replaces that chat's earlier result.
+    """
+    profile = store.load_profile(name) or new_profile(name)
+    entry = _chat_entry(profile, chat_fp)
+    seen = entry["seen"]
+    rewritten = len(msgs) < seen
+    if rewritten:
+        # The export was rewritten rather than appended: take this chat's old messages back out
+        # and merge it from scratch. Chats recorded before per-chat stats existed cannot be
+        # taken out, so their old totals are kept and the rewrite is not merged on top.
+        seen = 0
+        if entry["stats"] is not None:
+            _fold_stats(profile, entry["stats"], -1)
+            entry["stats"] = _empty_stats()
+    if entry["stats"] is not None and len(msgs) > seen:
+        stats = _batch_stats(msgs[seen:])
+        _fold_stats(profile, stats)
+        _fold_stats(entry["stats"], stats)
+    # Chats merged before the similarity index existed have no signature: index the whole chat once
+    indexed = seen if seen and similarity.has_speaker(name, chat_fp) else 0
+    similarity.add_speaker(name, chat_fp, msgs[indexed:], replace=indexed == 0)
+    entry["seen"] = len(msgs)
+
+    if result:
+        if entry["result"]:
+            remove_result(profile, entry["result"])
+        add_result(profile, result)
+        entry["result"] = {"mbti": result.get("mbti"), "scores": list(result.get("scores") or [])}
+    store.save_profile(name, profile)
+    return profile
+
+def profile_context(names):
+    """
+    {name: summary} for every name with a stored profile seen in more than one chat,
+    plus "writes_like": stored speakers from any chat whose writing is closest to theirs.
+    """
+    context = {}
+    for name in names:
+        profile = store.load_profile(name)
+        if profile and profile.get("chat_count", len(profile["chats"])) > 1:
+            context[name] = summarize_profile(profile)
+    try:
+        for name, neighbours in similarity.writes_like(names).items():
+            context.setdefault(name, {"name": name})["writes_like"] = neighbours
+    except Exception as e:
+        print(f"Similarity Error: {e}")
+    return context
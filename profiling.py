@@ -0,0 +1,178 @@
+"""
+Opt-in profiling: MBTI_PROFILE=1 streamlit run app.py
+
+Each script run and each decorated agent tool call is profiled deterministically
+(cProfile, for the hotspot table) while a sampler thread records stacks for a
+flame graph. Only one cProfile can be active at a time on Python 3.12+, so a
+profile that overlaps another one keeps just its stacks and spans. With the flag
+off, profiled() returns functions untouched and begin_run()/end_run() return
+immediately.
+"""
+import sys
+import time
+import inspect
+import threading
+import functools
+from collections import deque
+from contextlib import contextmanager
+
+import config
+
+ENABLED = config.env("MBTI_PROFILE", "0") == "1"
+MAX_PROFILES = int(config.env("MBTI_PROFILE_KEEP", "20"))
+SAMPLE_INTERVAL_SECONDS = float(config.env("MBTI_PROFILE_INTERVAL_MS", "5")) / 1000
+TOP_FUNCTIONS = 30
+
+_profiles = deque(maxlen=MAX_PROFILES)  # newest last
+_open_runs = {}                         # session key -> active run, closed on that session's next run
+_local = threading.local()              # .active: the profile running in this thread, if any
+_lock = threading.Lock()
+
+# ==========================================
+# 1. Collectors
+# ==========================================
+def _frame_label(code):
+    return f"{code.co_name} ({code.co_filename.rsplit('/', 1)[-1]}:{code.co_firstlineno})"
+
+def _sample(active, thread_id):
+    stacks = active["stacks"]
+    while not active["stop"].wait(SAMPLE_INTERVAL_SECONDS):
+        frame = sys._current_frames().get(thread_id)
+        names = []
+        while frame is not None:
+            names.append(_frame_label(frame.f_code))
+            frame = frame.f_back
+        if names:
+            key = ";".join(reversed(names))
+            stacks[key] = stacks.get(key, 0) + 1
+
+def _start(label):
+    import cProfile
+    active = {
+        "label": label, "started_at": time.time(), "t0": time.perf_counter(),
+        "profiler": cProfile.Profile(), "stacks": {}, "spans": [],
+        "stop": threading.Event(), "thread": threading.get_ident(),
+    }
+    active["sampler"] = threading.Thread(
+        target=_sample, args=(active, active["thread"]), daemon=True, name="mbti-profiler")
+    active["sampler"].start()
+    _local.active = active
+    try:
+        active["profiler"].enable()
+    except ValueError:
+        # 3.12+: another thread's profile holds the process-wide cProfile hook
+        active["profiler"] = None
+    return active
+
+def _finish(active):
+    """Stop a profile and store it; safe from any thread, and more than once."""
+    import pstats
+    if active["stop"].is_set():
+        return
+    active["stop"].set()
+    profiler = active["profiler"]
+    # Before 3.12 disable() unhooks the calling thread, so another thread's profiler is left
+    # to its own (finished) thread; from 3.12 the hook is process-wide and must be released
+    if profiler is not None and (active["thread"] == threading.get_ident() or sys.version_info >= (3, 12)):
+        profiler.disable()
+    if getattr(_local, "active", None) is active:
+        _local.active = None
+    seconds = time.perf_counter() - active["t0"]
+
+    rows = []
+    stats = pstats.Stats(profiler).stats if profiler is not None else {}
+    for (filename, line, func), (_, calls, tottime, cumtime, _) in stats.items():
+        rows.append({
+            "function": f"{func} ({filename.rsplit('/', 1)[-1]}:{line})",
+            "calls": calls,
+            "self_ms": round(tottime * 1000, 2),
+            "total_ms": round(cumtime * 1000, 2),
+        })
+    rows.sort(key=lambda r: r["self_ms"], reverse=True)
+    with _lock:
+        _profiles.append({
+            "label": active["label"],
+            "started_at": active["started_at"],
+            "seconds": seconds,
+            "hotspots": rows[:TOP_FUNCTIONS],
+            "deterministic": profiler is not None,
+            "stacks": active["stacks"],
+            "spans": active["spans"],
+        })
+
+# ==========================================
+# 2. Hooks
+# ==========================================
+def begin_run(session_key, label="app.py rerun"):
+    """Start profiling a script run; a run cut short by st.rerun/st.stop is closed here next time."""
+    if not ENABLED:
+        return
+    with _lock:
+        dangling = _open_runs.pop(session_key, None)
+    if dangling:
+        # Usually started on an earlier script thread: its sampler and cProfile hook stop here
+        _finish(dangling)
+    if getattr(_local, "active", None) is None:
+        with _lock:
+            _open_runs[session_key] = _start(label)
+
+def end_run(session_key):
+    if not ENABLED:
+        return
+    with _lock:
+        active = _open_runs.pop(session_key, None)
+    if active:
+        _finish(active)
+
+def profiled(fn):
+    """Decorator for agent tools: its own profile, or a timed span inside the current run's profile."""
+    if not ENABLED:
+        return fn
+    label = f"{fn.__module__}.{fn.__qualname__}"
+
+    if inspect.isgeneratorfunction(fn):
+        # Measured from the first next() until the generator is exhausted or closed
+        @functools.wraps(fn)
+        def generator_wrapper(*args, **kwargs):
+            with _measured(label):
+                return (yield from fn(*args, **kwargs))
+        return generator_wrapper
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        with _measured(label):
+            return fn(*args, **kwargs)
+    return wrapper
+
+@contextmanager
+def _measured(label):
+    """A timed span inside this thread's running profile, or a profile of its own."""
+    outer = getattr(_local, "active", None)
+    if outer is not None and not outer["stop"].is_set():
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            outer["spans"].append((label, time.perf_counter() - t0))
+        return
+    active = _start(label)
+    try:
+        yield
+    finally:
+        _finish(active)
+
+# ==========================================
+# 3. Reports
+# ==========================================
+def recent_profiles():
+    """Stored profiles, newest first."""
+    with _lock:
+        return list(reversed(_profiles))
+
+def folded_stacks(profile):
+    """Flame-graph input in folded format ("a;b;c count"), for flamegraph.pl or speedscope."""
+    return "\n".join(f"{stack} {count}" for stack, count in sorted(profile["stacks"].items()))
+
+def clear():
+    with _lock:
+        _profiles.clear()
@@ -0,0 +1,161 @@
+import time
+import itertools
+import threading
+import contextvars
+from contextlib import contextmanager
+
+import config
+
+# Priorities: lower is served first. Chat turns a user is waiting on go ahead of batch work.
+INTERACTIVE = 0
+BACKGROUND = 1
+
+# Longest a caller waits for a token before getting Busy, per priority
+MAX_WAIT_SECONDS = {
+    INTERACTIVE: float(config.env("MBTI_INTERACTIVE_WAIT", "15")),
+    BACKGROUND: float(config.env("MBTI_BACKGROUND_WAIT", "120")),
+}
+
+# Requests per second, burst size and wait-queue length for each upstream, shared by every session
+UPSTREAMS = {
+    "llm": {
+        "rate": float(config.env("MBTI_LLM_RATE", "2")),
+        "burst": int(config.env("MBTI_LLM_BURST", "4")),
+        "max_waiting": int(config.env("MBTI_LLM_QUEUE", "32")),
+    },
+    "places": {
+        "rate": float(config.env("MBTI_PLACES_RATE", "5")),
+        "burst": int(config.env("MBTI_PLACES_BURST", "10")),
+        "max_waiting": int(config.env("MBTI_PLACES_QUEUE", "32")),
+    },
+    "images": {
+        "rate": float(config.env("MBTI_IMAGES_RATE", "0.5")),
+        "burst": int(config.env("MBTI_IMAGES_BURST", "2")),
+        "max_waiting": int(config.env("MBTI_IMAGES_QUEUE", "16")),
+    },
+}
+
+_priority = contextvars.ContextVar("mbti_request_priority", default=INTERACTIVE)
+_tickets = itertools.count()
+_buckets = {}
+_buckets_lock = threading.Lock()
+
+class Busy(Exception):
+    pass
+
+# ==========================================
+# 1. Buckets
+# ==========================================
+def _bucket(upstream):
+    with _buckets_lock:
+        bucket = _buckets.get(upstream)
+        if bucket is None:
+            settings = UPSTREAMS[upstream]
+            bucket = {
+                **settings,
+                "tokens": float(settings["burst"]),
+                "updated": time.monotonic(),
+                "blocked_until": 0.0,   # set when the upstream answers 429
+                "waiting": [],          # sorted (priority, ticket) of queued callers
+                "granted": 0, "rejected": 0,
+                "cond": threading.Condition(),
+            }
+            _buckets[upstream] = bucket
+        return bucket
+
+def _refill(bucket, now):
+    if now < bucket["blocked_until"]:
+        bucket["updated"] = now
+        return
+    elapsed = now - max(bucket["updated"], bucket["blocked_until"])
+    bucket["tokens"] = min(bucket["burst"], bucket["tokens"] + elapsed * bucket["rate"])
+    bucket["updated"] = now
+
+def _next_token_in(bucket, now):
+    blocked = max(0.0, bucket["blocked_until"] - now)
+    missing = max(0.0, 1.0 - bucket["tokens"])
+    return blocked + (missing / bucket["rate"] if bucket["rate"] > 0 else 1.0)
+
+# ==========================================
+# 2. Admission
+# ==========================================
+@contextmanager
+def priority(level):
+    """Calls made inside this block (and threads/tasks started from it) queue at `level`."""
+    token = _priority.set(level)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+def current_priority():
+    """Priority of the calling context, for handing on to worker threads (which start with a fresh context)."""
+    return _priority.get()
+
+def acquire(upstream, level=None, timeout=None):
+    """
+    Take one request token for upstream, waiting in priority order. Raises Busy
+    at once when the wait queue is full, or after `timeout` seconds without a token.
+    """
+    level = _priority.get() if level is None else level
+    timeout = MAX_WAIT_SECONDS.get(level, MAX_WAIT_SECONDS[BACKGROUND]) if timeout is None else timeout
+    bucket = _bucket(upstream)
+    with bucket["cond"]:
+        now = time.monotonic()
+        _refill(bucket, now)
+        if not bucket["waiting"] and bucket["tokens"] >= 1:
+            bucket["tokens"] -= 1
+            bucket["granted"] += 1
+            return
+        if len(bucket["waiting"]) >= bucket["max_waiting"]:
+            bucket["rejected"] += 1
+            raise Busy(f"The North Pole is busy right now ({upstream}), please try again in a moment. 🦌")
+
+        ticket = (level, next(_tickets))
+        waiting = bucket["waiting"]
+        waiting.append(ticket)
+        waiting.sort()
+        deadline = now + timeout
+        try:
+            while True:
+                now = time.monotonic()
+                _refill(bucket, now)
+                if waiting[0] == ticket and bucket["tokens"] >= 1:
+                    bucket["tokens"] -= 1
+                    bucket["granted"] += 1
+                    return
+                if now >= deadline:
+                    bucket["rejected"] += 1
+                    raise Busy(f"The North Pole is busy right now ({upstream}), please try again in a moment. 🦌")
+                bucket["cond"].wait(min(deadline - now, _next_token_in(bucket, now)))
+        finally:
+            waiting.remove(ticket)
+            bucket["cond"].notify_all()
+
+def backoff(upstream, retry_after=None):
+    """The upstream said 429: stop handing out tokens for retry_after seconds (default: one refill)."""
+    bucket = _bucket(upstream)
+    with bucket["cond"]:
+        pause = retry_after if retry_after else 1.0 / bucket["rate"] if bucket["rate"] > 0 else 1.0
+        bucket["tokens"] = 0.0
+        bucket["blocked_until"] = max(bucket["blocked_until"], time.monotonic() + pause)
+
+def retry_after_seconds(response):
+    try:
+        return float(response.headers.get("Retry-After", ""))
+    except ValueError:
+        return None
+
+def report():
+    rows = {}
+    for name in UPSTREAMS:
+        bucket = _bucket(name)
+        with bucket["cond"]:
+            _refill(bucket, time.monotonic())
+            rows[name] = {
+                "tokens": round(bucket["tokens"], 2),
+                "waiting": len(bucket["waiting"]),
+                "granted": bucket["granted"],
+                "rejected": bucket["rejected"],
+            }
+    return rows
@@ -0,0 +1,254 @@
+"""
+Headless HTTP API over the same functions the Streamlit app uses.
+
+    uvicorn server:app --host 0.0.0.0 --port 8000 --workers 4
+
+Handlers keep no per-user state, so any number of workers/hosts can sit
+behind a load balancer.
+"""
+import json
+import asyncio
+from contextlib import asynccontextmanager
+
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Route
+
+import config
+import mbti
+import chat_formats
+import agent
+import batcher
+import jobs
+import ratelimit
+import ensemble
+import store
+import stylometry
+
+# LLM-backed requests allowed in flight per worker; extra requests wait up to QUEUE_TIMEOUT then get 503
+MAX_LLM_REQUESTS = int(config.env("MBTI_MAX_LLM_REQUESTS", "8"))
+QUEUE_TIMEOUT_SECONDS = float(config.env("MBTI_QUEUE_TIMEOUT", "5"))
+# Backend calls per analysis request (batches of speakers)
+ANALYSIS_CONCURRENCY = int(config.env("MBTI_ANALYSIS_CONCURRENCY", "4"))
+# Upper bound on "samples" (self-consistency votes per batch) a client may ask for
+MAX_SAMPLES = 5
+MAX_UPLOAD_BYTES = int(config.env("MBTI_MAX_UPLOAD_BYTES", str(20 * 1024 * 1024)))
+
+_llm_slots = asyncio.Semaphore(MAX_LLM_REQUESTS)
+
+# Worker slots and the shared upstream limiter both answer 503 when saturated
+Busy = ratelimit.Busy
+
+async def acquire_llm_slot():
+    try:
+        await asyncio.wait_for(_llm_slots.acquire(), QUEUE_TIMEOUT_SECONDS)
+    except asyncio.TimeoutError:
+        raise Busy()
+
+@asynccontextmanager
+async def llm_slot():
+    await acquire_llm_slot()
+    try:
+        yield
+    finally:
+        _llm_slots.release()
+
+def error(message, status=400):
+    return JSONResponse({"error": message}, status_code=status)
+
+def busy():
+    return JSONResponse({"error": "busy, try again shortly"}, status_code=503, headers={"Retry-After": "5"})
+
+async def read_json(request):
+    try:
+        return await request.json()
+    except ValueError:
+        return None
+
+def valid_results(results):
+    """A non-empty list of {"name": str, "mbti": str, "scores": [number or null, ...]} as /analyze returns."""
+    return isinstance(results, list) and bool(results) and all(
+        isinstance(p, dict) and isinstance(p.get("name"), str) and isinstance(p.get("mbti"), str)
+        and isinstance(p.get("scores"), list)
+        and all(s is None or isinstance(s, (int, float)) and not isinstance(s, bool) for s in p["scores"])
+        for p in results)
+
+def valid_history(history):
+    return isinstance(history, list) and all(
+        isinstance(m, dict) and m.get("role") in ("user", "assistant") and isinstance(m.get("content"), str)
+        for m in history)
+
+def backend_from(body):
+    return agent.resolve_backend(body.get("backend", "local"), body.get("model"))
+
+# ==========================================
+# 1. Parse
+# ==========================================
+async def health(request):
+    return JSONResponse({"status": "ok", "upstreams": ratelimit.report(), "llm_batches": batcher.report()})
+
+async def parse(request):
+    """Raw export text in the body -> speakers and their message counts."""
+    raw = await request.body()
+    if len(raw) > MAX_UPLOAD_BYTES:
+        return error("file too large", 413)
+    content = chat_formats.decode_export(raw)
+    speakers = await asyncio.to_thread(mbti.parse_line_chat_dynamic, content)
+    return JSONResponse({
+        "chat_fp": store.chat_fingerprint(content),
+        "content_hash": mbti.content_hash(content),
+        "speakers": {name: text.count("\n") + 1 for name, text in speakers.items()},
+    })
+
+# ==========================================
+# 2. Analyze
+# ==========================================
+async def _analysis_events(speakers, people, body):
+    """Yield one dict per finished piece of work: local results first, then each LLM batch."""
+    api_key, base_url, model_name = backend_from(body)
+    data = {n: speakers[n] for n in people}
+    if body.get("precheck", False):
+        local, llm_people = stylometry.preclassify_speakers(data)
+    else:
+        local, llm_people = [], list(data)
+    if local:
+        yield {"results": local}
+
+    samples = max(1, min(MAX_SAMPLES, int(body.get("samples") or 1)))
+    semaphore = asyncio.Semaphore(ANALYSIS_CONCURRENCY)
+    tasks = []
+    # Tasks copy the context they are created in, so analysis queues behind /chat upstream
+    with ratelimit.priority(ratelimit.BACKGROUND):
+        for batch in jobs.split_batches(llm_people):
+            sys_prompt, user_content = mbti.construct_analysis_prompt({n: data[n] for n in batch})
+            tasks.append(asyncio.ensure_future(ensemble.run_ensemble_request_async(
+                sys_prompt, user_content, batch, api_key, base_url, model_name, k=samples, semaphore=semaphore)))
+    try:
+        for fut in asyncio.as_completed(tasks):
+            try:
+                res = await fut
+                yield {"results": res.get("results", [])}
+            except Busy as e:
+                yield {"error": str(e), "busy": True}
+            except Exception as e:
+                yield {"error": str(e)}
+    finally:
+        for t in tasks:
+            t.cancel()
+
+async def analyze(request):
+    """
+    JSON body: {"content": export text} or {"speakers": {name: text}},
+    optional "people", "backend", "model", "precheck", "samples", "stream".
+    With "stream": true the response is NDJSON, one line per finished batch;
+    a busy server answers with a single {"error", "busy": true} line instead of a 503.
+    """
+    body = await read_json(request)
+    if not isinstance(body, dict):
+        return error("expected a JSON object")
+    if "speakers" in body:
+        speakers = body["speakers"]
+        if not isinstance(speakers, dict) or not all(
+                isinstance(k, str) and isinstance(v, str) for k, v in speakers.items()):
+            return error("'speakers' must map names to message text")
+    elif "content" in body:
+        if not isinstance(body["content"], str):
+            return error("'content' must be the export text")
+        speakers = await asyncio.to_thread(mbti.parse_line_chat_dynamic, body["content"])
+    else:
+        return error("provide 'content' or 'speakers'")
+    people = body.get("people") or list(speakers)
+    if not isinstance(people, list):
+        return error("'people' must be a list of names")
+    people = [p for p in people if isinstance(p, str) and p in speakers]
+    if not people:
+        return error("no analysable speakers")
+    try:
+        int(body.get("samples") or 1)
+    except (TypeError, ValueError):
+        return error("samples must be an integer")
+
+    if body.get("stream"):
+        # The slot is taken inside the generator: a client gone before the first chunk
+        # never starts it, so a slot taken out here would never be given back
+        async def ndjson():
+            try:
+                async with llm_slot():
+                    async for event in _analysis_events(speakers, people, body):
+                        yield json.dumps(event, ensure_ascii=False) + "\n"
+            except Busy as e:
+                yield json.dumps({"error": str(e) or "busy, try again shortly", "busy": True}) + "\n"
+        return StreamingResponse(ndjson(), media_type="application/x-ndjson")
+
+    try:
+        await acquire_llm_slot()
+    except Busy:
+        return busy()
+    try:
+        results, errors, busy_upstream = [], [], False
+        async for event in _analysis_events(speakers, people, body):
+            results += event.get("results", [])
+            if "error" in event:
+                errors.append(event["error"])
+                busy_upstream = busy_upstream or event.get("busy", False)
+    finally:
+        _llm_slots.release()
+    if errors and not results:
+        return busy() if busy_upstream else error("; ".join(errors), 502)
+    order = {n: i for i, n in enumerate(people)}
+    results.sort(key=lambda p: order.get(p.get("name"), len(order)))
+    return JSONResponse({"results": results, "errors": errors})
+
+# ==========================================
+# 3. Quiz & Chat
+# ==========================================
+async def quiz_questions(request):
+    return JSONResponse({"questions": mbti.get_quiz_questions()})
+
+async def quiz_score(request):
+    """JSON body: {"answers": {question_id: -2..2}}"""
+    body = await read_json(request)
+    if not isinstance(body, dict) or not isinstance(body.get("answers"), dict):
+        return error("expected {'answers': {id: score}}")
+    try:
+        answers = {int(k): max(-2, min(2, int(v))) for k, v in body["answers"].items()}
+    except (TypeError, ValueError):
+        return error("answers must map question ids to integers")
+    mbti_type, scores = mbti.calculate_quiz_result(answers)
+    return JSONResponse({"mbti": mbti_type, "scores": scores})
+
+async def chat(request):
+    """
+    JSON body: {"message", "results", optional "history", "backend", "model"}.
+    Returns {"reply", "extra"}; reply may be a TOOL:* marker as in the app.
+    """
+    body = await read_json(request)
+    if not isinstance(body, dict) or not body.get("message") or not body.get("results"):
+        return error("expected 'message' and 'results'")
+    if not isinstance(body["message"], str):
+        return error("'message' must be a string")
+    if not valid_results(body["results"]):
+        return error("'results' must be a list of {'name', 'mbti', 'scores'} objects")
+    if not valid_history(body.get("history") or []):
+        return error("'history' must be a list of {'role', 'content'} messages")
+    api_key, base_url, model_name = backend_from(body)
+    try:
+        async with llm_slot():
+            reply, extra = await asyncio.to_thread(
+                agent.generate_chat_response,
+                body["message"], body.get("history") or [], body["results"],
+                api_key, base_url, model_name, mbti.is_chinese)
+    except Busy:
+        return busy()
+    return JSONResponse({"reply": reply, "extra": extra})
+
+routes = [
+    Route("/health", health, methods=["GET"]),
+    Route("/parse", parse, methods=["POST"]),
+    Route("/analyze", analyze, methods=["POST"]),
+    Route("/quiz", quiz_questions, methods=["GET"]),
+    Route("/quiz", quiz_score, methods=["POST"]),
+    Route("/chat", chat, methods=["POST"]),
+]
+
+app = Starlette(routes=routes)
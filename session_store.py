@@ -0,0 +1,194 @@
+import os
+import time
+import uuid
+import pickle
+import shutil
+import threading
+from collections import OrderedDict
+
+import config
+
+SPILL_DIR = config.env("MBTI_SPILL_DIR", ".session_spill")
+MB = 1024 * 1024
+# In-memory bytes one session may hold in managed values before new values go to disk
+SESSION_BUDGET_BYTES = int(float(config.env("MBTI_SESSION_BUDGET_MB", "4")) * MB)
+# Managed bytes held in memory across all sessions: in-memory values plus the LRU cache of
+# values loaded back from disk. Past it, new values spill and the cache shrinks.
+GLOBAL_BUDGET_BYTES = int(float(config.env("MBTI_GLOBAL_BUDGET_MB", "128")) * MB)
+DISK_BUDGET_BYTES = int(float(config.env("MBTI_SPILL_DISK_MB", "2048")) * MB)
+# Values at least this big always spill, whatever the session's usage
+SPILL_MIN_BYTES = 256 * 1024
+# Chat histories keep at most this many messages per session
+MAX_HISTORY = int(config.env("MBTI_MAX_HISTORY", "100"))
+# Sessions not seen for this long are dropped from the accounting and their spill files deleted
+SESSION_TTL_SECONDS = 6 * 3600
+
+SESSION_ID_KEY = "_session_store_id"
+SPILLED = "__spilled__"
+
+_sizes = {}            # session id -> {name: (bytes, "memory" | "disk")}
+_last_seen = {}        # session id -> last put/get time
+_hot = OrderedDict()   # (session id, name) -> (value, bytes) loaded back from disk
+_hot_bytes = 0
+_lock = threading.Lock()
+
+# ==========================================
+# 1. Helpers
+# ==========================================
+def session_id(state):
+    if SESSION_ID_KEY not in state:
+        state[SESSION_ID_KEY] = uuid.uuid4().hex
+    return state[SESSION_ID_KEY]
+
+def _spill_path(sid, name):
+    return os.path.join(SPILL_DIR, sid, f"{name}.pkl")
+
+def _is_spilled(value):
+    return isinstance(value, dict) and SPILLED in value
+
+def _drop_hot(key):
+    global _hot_bytes
+    entry = _hot.pop(key, None)
+    if entry:
+        _hot_bytes -= entry[1]
+
+def _memory_usage(sid, exclude=None):
+    return sum(size for name, (size, where) in _sizes.get(sid, {}).items()
+               if where == "memory" and name != exclude)
+
+def _global_memory_usage():
+    return sum(_memory_usage(sid) for sid in _sizes)
+
+def _prune_sessions():
+    """Forget sessions that went away without clearing (closed tabs); call with _lock held."""
+    cutoff = time.time() - SESSION_TTL_SECONDS
+    for sid in [s for s, seen in _last_seen.items() if seen < cutoff]:
+        _last_seen.pop(sid, None)
+        _sizes.pop(sid, None)
+        for key in [k for k in _hot if k[0] == sid]:
+            _drop_hot(key)
+        shutil.rmtree(os.path.join(SPILL_DIR, sid), ignore_errors=True)
+
+def _evict_disk():
+    entries = []
+    for root, _, names in os.walk(SPILL_DIR):
+        for name in names:
+            path = os.path.join(root, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= DISK_BUDGET_BYTES:
+            break
+        try:
+            os.remove(path)
+            total -= size
+        except OSError:
+            pass
+
+# ==========================================
+# 2. Managed Values
+# ==========================================
+def put(state, name, value):
+    """
+    Store a value in session state, spilling it to disk when it is large or
+    the session is over its in-memory budget.
+    """
+    sid = session_id(state)
+    data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+    size = len(data)
+    with _lock:
+        _prune_sessions()
+        _last_seen[sid] = time.time()
+        _drop_hot((sid, name))
+        sizes = _sizes.setdefault(sid, {})
+        own = _memory_usage(sid, exclude=name)
+        others = _global_memory_usage() - _memory_usage(sid)
+        spill = (size >= SPILL_MIN_BYTES or own + size > SESSION_BUDGET_BYTES
+                 or others + own + _hot_bytes + size > GLOBAL_BUDGET_BYTES)
+        sizes[name] = (size, "disk" if spill else "memory")
+
+    if not spill:
+        state[name] = value
+        return
+
+    path = _spill_path(sid, name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+    state[name] = {SPILLED: path, "size": size}
+    _evict_disk()
+
+def get(state, name, default=None):
+    """Read a managed value; spilled values are loaded (and cached) on demand."""
+    global _hot_bytes
+    value = state.get(name, default)
+    if not _is_spilled(value):
+        return value
+
+    sid = session_id(state)
+    key = (sid, name)
+    with _lock:
+        _last_seen[sid] = time.time()
+        if key in _hot:
+            _hot.move_to_end(key)
+            return _hot[key][0]
+    try:
+        with open(value[SPILLED], "rb") as f:
+            loaded = pickle.load(f)
+        os.utime(value[SPILLED])
+    except (OSError, pickle.PickleError, EOFError):
+        # Evicted from disk: callers treat this like a value that was never set
+        return default
+
+    with _lock:
+        _hot[key] = (loaded, value["size"])
+        _hot_bytes += value["size"]
+        # The cache gets whatever in-memory values leave of the budget, keeping at least this value
+        while _hot_bytes > GLOBAL_BUDGET_BYTES - _global_memory_usage() and len(_hot) > 1:
+            _, (_, size) = _hot.popitem(last=False)
+            _hot_bytes -= size
+    return loaded
+
+def trim_history(history, max_len=MAX_HISTORY):
+    """Drop the oldest messages in place so a history list stays bounded."""
+    if len(history) > max_len:
+        del history[:len(history) - max_len]
+    return history
+
+def clear(state):
+    """Forget everything this session spilled (call before st.session_state.clear())."""
+    sid = state.get(SESSION_ID_KEY)
+    if not sid:
+        return
+    with _lock:
+        _sizes.pop(sid, None)
+        _last_seen.pop(sid, None)
+        for key in [k for k in _hot if k[0] == sid]:
+            _drop_hot(key)
+    shutil.rmtree(os.path.join(SPILL_DIR, sid), ignore_errors=True)
+
+# ==========================================
+# 3. Reporting
+# ==========================================
+def session_report(state):
+    """[(name, bytes, "memory" | "disk")] for this session's managed values, largest first."""
+    sid = session_id(state)
+    with _lock:
+        rows = [(name, size, where) for name, (size, where) in _sizes.get(sid, {}).items()]
+    return sorted(rows, key=lambda r: r[1], reverse=True)
+
+def global_report():
+    with _lock:
+        return {
+            "sessions": len(_sizes),
+            "memory_bytes": sum(_memory_usage(sid) for sid in _sizes),
+            "disk_bytes": sum(size for s in _sizes.values() for size, where in s.values() if where == "disk"),
+            "hot_cache_bytes": _hot_bytes,
+            "checked_at": time.time(),
+        }
@@ -0,0 +1,201 @@
+"""
+"Who writes like whom": a MinHash LSH index over every analysed speaker.
+
+Each (speaker, chat) gets a MinHash signature of the character n-grams in their
+messages. Signatures are cut into bands; two speakers sharing any band land in
+the same bucket, so a query only scores the speakers it collides with instead
+of every stored pair. Signatures persist in the results store and merge
+incrementally (the MinHash of a union is the element-wise minimum).
+"""
+import re
+import zlib
+import threading
+
+import config
+import store
+
+NUM_HASHES = 128
+# 32 bands of 4 rows: pairs above ~0.42 estimated Jaccard are likely to share a bucket
+BANDS = int(config.env("MBTI_LSH_BANDS", "32"))
+ROWS = NUM_HASHES // BANDS
+NGRAM_SIZE = int(config.env("MBTI_LSH_NGRAM", "3"))
+# Below this a neighbour is noise; above DUPLICATE_SIMILARITY it is probably the same person
+MIN_SIMILARITY = float(config.env("MBTI_LSH_MIN_SIMILARITY", "0.3"))
+DUPLICATE_SIMILARITY = float(config.env("MBTI_LSH_DUPLICATE", "0.8"))
+HASH_CHUNK = 4096  # n-grams hashed per numpy step, bounding memory for very chatty speakers
+
+WHITESPACE_RE = re.compile(r"\s+")
+
+_PRIME = (1 << 31) - 1
+_coeffs = None   # (a, b) permutation arrays, built on first use
+_entries = None  # (speaker, chat_fp) -> {"sig", "messages"}; loaded from the store on first use
+_buckets = {}    # (band, band bytes) -> set of entry keys
+_chats = {}      # speaker -> chat_fps they have signatures for
+_lock = threading.Lock()
+
+# ==========================================
+# 1. Signatures
+# ==========================================
+def _np():
+    return config.lazy_import("numpy")
+
+def ngrams(msgs, size=NGRAM_SIZE):
+    """Character n-grams of each message (lowercased, whitespace collapsed)."""
+    grams = set()
+    for msg in msgs:
+        text = f" {WHITESPACE_RE.sub(' ', msg.lower()).strip()} "
+        if len(text) <= size:
+            grams.add(text)
+        else:
+            grams.update(text[i:i + size] for i in range(len(text) - size + 1))
+    return grams
+
+def signature(msgs):
+    """MinHash (NUM_HASHES uint32 values) of the messages' n-grams, or None for no text."""
+    global _coeffs
+    np = _np()
+    if _coeffs is None:
+        rng = np.random.default_rng(2024)
+        _coeffs = (rng.integers(1, _PRIME, NUM_HASHES, dtype=np.uint64),
+                   rng.integers(0, _PRIME, NUM_HASHES, dtype=np.uint64))
+    grams = ngrams(msgs)
+    if not grams:
+        return None
+    a, b = _coeffs
+    x = np.fromiter((zlib.crc32(g.encode("utf-8")) % _PRIME for g in grams), dtype=np.uint64, count=len(grams))
+    sig = np.full(NUM_HASHES, _PRIME, dtype=np.uint64)
+    for i in range(0, len(x), HASH_CHUNK):
+        sig = np.minimum(sig, ((np.outer(x[i:i + HASH_CHUNK], a) + b) % _PRIME).min(axis=0))
+    return sig.astype(np.uint32)
+
+def estimate_similarity(sig_a, sig_b):
+    """Estimated Jaccard similarity: the share of matching MinHash values."""
+    return float((sig_a == sig_b).mean())
+
+# ==========================================
+# 2. Index
+# ==========================================
+def _band_keys(sig):
+    return [(band, sig[band * ROWS:(band + 1) * ROWS].tobytes()) for band in range(BANDS)]
+
+def _index(key, sig):
+    for bucket in _band_keys(sig):
+        _buckets.setdefault(bucket, set()).add(key)
+    _chats.setdefault(key[0], set()).add(key[1])
+
+def _unindex(key, sig):
+    for bucket in _band_keys(sig):
+        members = _buckets.get(bucket)
+        if members:
+            members.discard(key)
+            if not members:
+                del _buckets[bucket]
+
+def _load():
+    """Build the in-memory buckets from stored signatures (call with _lock held)."""
+    global _entries
+    if _entries is not None:
+        return
+    np = _np()
+    _entries = {}
+    try:
+        rows = store.load_signatures()
+    except Exception as e:
+        print(f"Store Error: {e}")
+        rows = []
+    for name, chat_fp, blob, count in rows:
+        sig = np.frombuffer(blob, dtype=np.uint32).copy()
+        if len(sig) != NUM_HASHES:
+            continue  # written with other settings; rebuilt the next time that speaker is recorded
+        _entries[(name, chat_fp)] = {"sig": sig, "messages": count}
+        _index((name, chat_fp), sig)
+
+def add_speaker(name, chat_fp, msgs, replace=False):
+    """
+    Fold new messages of one speaker in one chat into the index. Only pass messages
+    not added before; replace=True starts that speaker's chat signature afresh.
+    """
+    sig = signature(msgs)
+    if sig is None and not replace:
+        return
+    np = _np()
+    key = (name, chat_fp)
+    with _lock:
+        _load()
+        old = _entries.get(key)
+        if sig is None and old is None:
+            return  # nothing to replace and nothing to index
+        if old is not None:
+            _unindex(key, old["sig"])
+            if not replace and sig is not None:
+                sig = np.minimum(old["sig"], sig)
+            elif sig is None:
+                sig = old["sig"]
+        count = len(msgs) + (old["messages"] if old and not replace else 0)
+        _entries[key] = {"sig": sig, "messages": count}
+        _index(key, sig)
+    try:
+        store.save_signature(name, chat_fp, sig.tobytes(), count)
+    except Exception as e:
+        print(f"Store Error: {e}")
+
+def has_speaker(name, chat_fp):
+    """Whether this speaker's messages in this chat are in the index yet."""
+    with _lock:
+        _load()
+        return (name, chat_fp) in _entries
+
+# ==========================================
+# 3. Queries
+# ==========================================
+def _query(sig, k, min_similarity, exclude_name=None):
+    with _lock:
+        _load()
+        candidates = set()
+        for bucket in _band_keys(sig):
+            candidates |= _buckets.get(bucket, set())
+        scored = [(estimate_similarity(sig, _entries[key]["sig"]), key)
+                  for key in candidates if key[0] != exclude_name]
+
+    best = {}  # one row per speaker: their most similar chat
+    for score, (name, chat_fp) in scored:
+        if score >= min_similarity and score > best.get(name, (-1.0, None))[0]:
+            best[name] = (score, chat_fp)
+    ranked = sorted(best.items(), key=lambda kv: kv[1][0], reverse=True)[:k]
+    return [{
+        "name": name,
+        "chat_fp": chat_fp,
+        "similarity": round(score, 2),
+        "possible_duplicate": score >= DUPLICATE_SIMILARITY,
+    } for name, (score, chat_fp) in ranked]
+
+def similar_to(name, k=5, min_similarity=MIN_SIMILARITY):
+    """Top-k other speakers who write most like `name` (across all of their chats)."""
+    np = _np()
+    with _lock:
+        _load()
+        sigs = [_entries[(name, chat_fp)]["sig"] for chat_fp in _chats.get(name, ())]
+    if not sigs:
+        return []
+    return _query(np.minimum.reduce(sigs), k, min_similarity, exclude_name=name)
+
+def similar_to_messages(msgs, k=5, min_similarity=MIN_SIMILARITY):
+    """Top-k stored speakers whose writing resembles these messages."""
+    sig = signature(msgs)
+    return _query(sig, k, min_similarity) if sig is not None else []
+
+def writes_like(names, k=3):
+    """{name: neighbours} for each name with at least one stylistic neighbour, for the chat agent."""
+    out = {}
+    for name in names:
+        neighbours = similar_to(name, k)
+        if neighbours:
+            out[name] = [{"name": n["name"], "similarity": n["similarity"],
+                          "possible_duplicate": n["possible_duplicate"]} for n in neighbours]
+    return out
+
+def index_stats():
+    with _lock:
+        _load()
+        return {"speakers": len(_entries), "buckets": len(_buckets),
+                "largest_bucket": max((len(m) for m in _buckets.values()), default=0)}
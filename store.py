@@ -0,0 +1,276 @@
+import json
+import time
+import sqlite3
+import threading
+
+import config
+import chat_formats
+from mbti import content_hash, PROMPT_VERSION
+
+DB_PATH = config.env("MBTI_DB_PATH", "mbti_results.db")
+
+# Appended exports of the same group share their first messages, so this stays stable week to week
+CHAT_FINGERPRINT_ROWS = 50
+CHAT_FINGERPRINT_BYTES = 4096
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS raw_outputs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    chat_fp TEXT NOT NULL,
+    model TEXT NOT NULL,
+    output TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS analysis_results (
+    chat_fp TEXT NOT NULL,
+    speaker TEXT NOT NULL,
+    model TEXT NOT NULL,
+    prompt_version TEXT NOT NULL,
+    mbti TEXT NOT NULL,
+    score_e INTEGER, score_n INTEGER, score_f INTEGER, score_p INTEGER,
+    source TEXT,
+    speaker_hash TEXT,
+    message_count INTEGER,
+    raw_id INTEGER REFERENCES raw_outputs(id),
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (chat_fp, speaker, model, prompt_version)
+);
+CREATE INDEX IF NOT EXISTS idx_results_speaker ON analysis_results(speaker);
+CREATE INDEX IF NOT EXISTS idx_results_group ON analysis_results(chat_fp, updated_at);
+CREATE INDEX IF NOT EXISTS idx_results_mbti ON analysis_results(mbti);
+CREATE TABLE IF NOT EXISTS speaker_profiles (
+    speaker TEXT PRIMARY KEY,
+    profile TEXT NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS style_guides (
+    mbti TEXT NOT NULL,
+    model TEXT NOT NULL,
+    template_version TEXT NOT NULL,
+    content TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    PRIMARY KEY (mbti, model, template_version)
+);
+CREATE TABLE IF NOT EXISTS speaker_signatures (
+    speaker TEXT NOT NULL,
+    chat_fp TEXT NOT NULL,
+    signature BLOB NOT NULL,
+    message_count INTEGER NOT NULL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (speaker, chat_fp)
+);
+"""
+
+_conn = None
+_lock = threading.Lock()
+
+# ==========================================
+# Connection
+# ==========================================
+def get_connection():
+    """Shared connection for the whole process (Streamlit runs sessions in threads)."""
+    global _conn
+    with _lock:
+        if _conn is None:
+            _conn = sqlite3.connect(DB_PATH, check_same_thread=False)
+            _conn.row_factory = sqlite3.Row
+            _conn.execute("PRAGMA journal_mode=WAL")
+            _conn.executescript(SCHEMA)
+        return _conn
+
+def chat_fingerprint(file_content):
+    """
+    Hash of the export's first message rows. Header lines such as LINE's
+    "Saved on: <date>" change on every re-export, so they are left out.
+    """
+    rows = chat_formats.first_rows(file_content, CHAT_FINGERPRINT_ROWS)
+    if not rows:
+        return content_hash(file_content[:CHAT_FINGERPRINT_BYTES])
+    return content_hash("\n".join(f"{name}\t{msg}" for name, msg in rows))
+
+def _row_to_result(row):
+    return {
+        "name": row["speaker"],
+        "mbti": row["mbti"],
+        "scores": [row["score_e"], row["score_n"], row["score_f"], row["score_p"]],
+        "source": row["source"],
+    }
+
+# ==========================================
+# Writes
+# ==========================================
+def save_results(chat_fp, results, model_name, fingerprints=None, raw_output=None, prompt_version=PROMPT_VERSION):
+    """
+    Upsert analysis results for one chat.
+    fingerprints: optional {name: {"hash", "count"}} from mbti.fingerprint_messages.
+    """
+    fingerprints = fingerprints or {}
+    now = time.time()
+    conn = get_connection()
+    with _lock, conn:
+        raw_id = None
+        if raw_output:
+            cur = conn.execute(
+                "INSERT INTO raw_outputs (chat_fp, model, output, created_at) VALUES (?, ?, ?, ?)",
+                (chat_fp, model_name, raw_output, now))
+            raw_id = cur.lastrowid
+
+        rows = []
+        for person in results:
+            scores = (list(person.get("scores") or []) + [None] * 4)[:4]
+            fp = fingerprints.get(person["name"], {})
+            # Stylometry results are not model output, so they are keyed separately
+            model = "stylometry" if person.get("source") == "stylometry" else model_name
+            rows.append((
+                chat_fp, person["name"], model, prompt_version, person["mbti"], *scores,
+                person.get("source", "llm"), fp.get("hash"), fp.get("count"),
+                raw_id if model == model_name else None, now, now
+            ))
+
+        conn.executemany("""
+            INSERT INTO analysis_results (
+                chat_fp, speaker, model, prompt_version, mbti,
+                score_e, score_n, score_f, score_p,
+                source, speaker_hash, message_count, raw_id, created_at, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (chat_fp, speaker, model, prompt_version) DO UPDATE SET
+                mbti = excluded.mbti,
+                score_e = excluded.score_e, score_n = excluded.score_n,
+                score_f = excluded.score_f, score_p = excluded.score_p,
+                source = excluded.source,
+                speaker_hash = excluded.speaker_hash,
+                message_count = excluded.message_count,
+                raw_id = excluded.raw_id,
+                updated_at = excluded.updated_at
+        """, rows)
+
+# ==========================================
+# Reads
+# ==========================================
+def load_results(chat_fp, model_name, prompt_version=PROMPT_VERSION):
+    """
+    Latest stored results for a chat (including stylometry results).
+    Returns (results, fingerprints) in the same shapes the app keeps in session state.
+    """
+    conn = get_connection()
+    with _lock:
+        rows = conn.execute("""
+            SELECT * FROM analysis_results
+            WHERE chat_fp = ? AND model IN (?, 'stylometry') AND prompt_version = ?
+            ORDER BY updated_at
+        """, (chat_fp, model_name, prompt_version)).fetchall()
+
+    # If a speaker has both a stylometry and an LLM row, the most recent one wins
+    results, fingerprints = {}, {}
+    for row in rows:
+        results[row["speaker"]] = _row_to_result(row)
+        if row["speaker_hash"]:
+            fingerprints[row["speaker"]] = {"hash": row["speaker_hash"], "count": row["message_count"]}
+    return list(results.values()), fingerprints
+
+def results_for_speaker(name):
+    """Every stored result for a speaker across all chats, newest first."""
+    conn = get_connection()
+    with _lock:
+        rows = conn.execute(
+            "SELECT * FROM analysis_results WHERE speaker = ? ORDER BY updated_at DESC", (name,)
+        ).fetchall()
+    return [dict(_row_to_result(r), chat_fp=r["chat_fp"], model=r["model"], updated_at=r["updated_at"]) for r in rows]
+
+def raw_output(raw_id):
+    conn = get_connection()
+    with _lock:
+        row = conn.execute("SELECT output FROM raw_outputs WHERE id = ?", (raw_id,)).fetchone()
+    return row["output"] if row else None
+
+# ==========================================
+# Aggregate Queries
+# ==========================================
+def type_distribution(chat_fp=None):
+    """{mbti: count} across all chats, or within one chat."""
+    sql = "SELECT mbti, COUNT(*) AS n FROM analysis_results"
+    args = ()
+    if chat_fp:
+        sql += " WHERE chat_fp = ?"
+        args = (chat_fp,)
+    sql += " GROUP BY mbti ORDER BY n DESC"
+    conn = get_connection()
+    with _lock:
+        return {r["mbti"]: r["n"] for r in conn.execute(sql, args).fetchall()}
+
+def group_summaries():
+    """Per-chat speaker counts and mean [E, N, F, P] scores."""
+    conn = get_connection()
+    with _lock:
+        rows = conn.execute("""
+            SELECT chat_fp, COUNT(DISTINCT speaker) AS speakers,
+                   AVG(score_e) AS e, AVG(score_n) AS n, AVG(score_f) AS f, AVG(score_p) AS p,
+                   MAX(updated_at) AS last_updated
+            FROM analysis_results
+            GROUP BY chat_fp
+            ORDER BY last_updated DESC
+        """).fetchall()
+    return [
+        {"chat_fp": r["chat_fp"], "speakers": r["speakers"], "mean_scores": [r["e"], r["n"], r["f"], r["p"]],
+         "last_updated": r["last_updated"]}
+        for r in rows
+    ]
+
+# ==========================================
+# Speaker Profiles
+# ==========================================
+def load_profile(name):
+    conn = get_connection()
+    with _lock:
+        row = conn.execute("SELECT profile FROM speaker_profiles WHERE speaker = ?", (name,)).fetchone()
+    return json.loads(row["profile"]) if row else None
+
+def save_profile(name, profile):
+    conn = get_connection()
+    with _lock, conn:
+        conn.execute("""
+            INSERT INTO speaker_profiles (speaker, profile, updated_at) VALUES (?, ?, ?)
+            ON CONFLICT (speaker) DO UPDATE SET profile = excluded.profile, updated_at = excluded.updated_at
+        """, (name, json.dumps(profile, ensure_ascii=False), time.time()))
+
+# ==========================================
+# Style Guides
+# ==========================================
+def load_style_guide(mbti_type, model_name, template_version):
+    conn = get_connection()
+    with _lock:
+        row = conn.execute("""
+            SELECT content FROM style_guides WHERE mbti = ? AND model = ? AND template_version = ?
+        """, (mbti_type, model_name, template_version)).fetchone()
+    return row["content"] if row else None
+
+def save_style_guide(mbti_type, model_name, template_version, content):
+    conn = get_connection()
+    with _lock, conn:
+        conn.execute("""
+            INSERT OR REPLACE INTO style_guides (mbti, model, template_version, content, created_at)
+            VALUES (?, ?, ?, ?, ?)
+        """, (mbti_type, model_name, template_version, content, time.time()))
+
+# ==========================================
+# Speaker Signatures
+# ==========================================
+def load_signatures():
+    """Every stored (speaker, chat_fp, signature bytes, message_count) row."""
+    conn = get_connection()
+    with _lock:
+        rows = conn.execute("SELECT speaker, chat_fp, signature, message_count FROM speaker_signatures").fetchall()
+    return [(r["speaker"], r["chat_fp"], r["signature"], r["message_count"]) for r in rows]
+
+def save_signature(name, chat_fp, signature, message_count):
+    conn = get_connection()
+    with _lock, conn:
+        conn.execute("""
+            INSERT INTO speaker_signatures (speaker, chat_fp, signature, message_count, updated_at)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (speaker, chat_fp) DO UPDATE SET
+                signature = excluded.signature,
+                message_count = excluded.message_count,
+                updated_at = excluded.updated_at
+        """, (name, chat_fp, signature, message_count, time.time()))
@@ -0,0 +1,119 @@
+import threading
+
+import config
+import agent
+import jobs
+import store
+import images
+import ratelimit
+
+ALL_TYPES = [a + b + c + d for a in "EI" for b in "SN" for c in "TF" for d in "JP"]
+# Generate all 16 guides for a model in the background the first time the app sees it
+WARM_ON_START = config.env("MBTI_WARM_STYLE_GUIDES", "1") == "1"
+
+_guides = {}     # (type, model, template version) -> markdown
+_inflight = {}   # (type, model, template version) -> job id of the generation that will fill it
+_warmed = set()  # models a warming job was submitted for in this process
+_lock = threading.Lock()
+
+# ==========================================
+# 1. Lookup
+# ==========================================
+def _key(mbti_type, model_name):
+    return (mbti_type.upper(), model_name or "", agent.STYLE_TEMPLATE_VERSION)
+
+def image_prompt(mbti_type):
+    return f"A fashionable person wearing {mbti_type.upper()} personality style outfit, full body, modern, stylish"
+
+def cached_guide(mbti_type, model_name):
+    """Guide from memory or the results store, or None."""
+    key = _key(mbti_type, model_name)
+    with _lock:
+        if key in _guides:
+            return _guides[key]
+    try:
+        content = store.load_style_guide(*key)
+    except Exception as e:
+        print(f"Store Error: {e}")
+        content = None
+    if content:
+        with _lock:
+            _guides[key] = content
+    return content
+
+# ==========================================
+# 2. Generation
+# ==========================================
+def _generate(job, types, api_key, base_url, model_name, level=ratelimit.INTERACTIVE):
+    try:
+        with ratelimit.priority(level):
+            for i, mbti_type in enumerate(types):
+                jobs.check_cancelled(job)
+                if not cached_guide(mbti_type, model_name):
+                    content = agent.fetch_style_guide(mbti_type, api_key, base_url, model_name)
+                    key = _key(mbti_type, model_name)
+                    with _lock:
+                        _guides[key] = content
+                    try:
+                        store.save_style_guide(*key, content)
+                    except Exception as e:
+                        print(f"Store Error: {e}")
+                jobs.report(job, i + 1, len(types), f"Tailored {i + 1} / {len(types)} style guides")
+        return list(types)
+    finally:
+        with _lock:
+            for mbti_type in types:
+                if _inflight.get(_key(mbti_type, model_name)) == job["id"]:
+                    del _inflight[_key(mbti_type, model_name)]
+
+def _ensure_job(mbti_type, api_key, base_url, model_name):
+    key = _key(mbti_type, model_name)
+    with _lock:
+        job_id = _inflight.get(key)
+        if not job_id:
+            job_id = jobs.submit(_generate, [key[0]], api_key, base_url, model_name)
+            _inflight[key] = job_id
+    return job_id
+
+def warm_in_background(api_key, base_url, model_name):
+    """Start generating every missing guide for this model (once per process)."""
+    if not WARM_ON_START or not base_url:
+        return
+    with _lock:
+        if model_name in _warmed:
+            return
+    missing = [t for t in ALL_TYPES if not cached_guide(t, model_name)]
+    with _lock:
+        if model_name in _warmed:
+            return
+        # Types someone is already waiting on keep their own job
+        missing = [t for t in missing if _key(t, model_name) not in _inflight]
+        if missing:
+            try:
+                # Queued behind interactive requests, so warming never slows a live chat
+                job_id = jobs.submit(_generate, missing, api_key, base_url, model_name, level=ratelimit.BACKGROUND)
+            except RuntimeError as e:
+                # Not marked as warmed, so the next rerun tries again
+                print(f"Style Warm Error: {e}")
+                return
+            for mbti_type in missing:
+                _inflight[_key(mbti_type, model_name)] = job_id
+        _warmed.add(model_name)
+
+def get_style_guide(mbti_type, api_key, base_url, model_name):
+    """
+    (markdown, image reference, None) for a warm type, or (None, None, job) for a cold
+    one: the guide is generated on the shared pool and the pending job is returned at
+    once. The outfit picture goes through the image blob store and arrives asynchronously;
+    a cold type only starts it, so asking again does not repeat the picture.
+    """
+    content = cached_guide(mbti_type, model_name)
+    if content is not None:
+        return content, images.request_image(image_prompt(mbti_type)), None
+    job = jobs.get_job(_ensure_job(mbti_type, api_key, base_url, model_name))
+    if job and job["status"] == "failed":
+        with _lock:
+            _inflight.pop(_key(mbti_type, model_name), None)
+        raise Exception(job["error"])
+    images.request_image(image_prompt(mbti_type))
+    return None, None, job
@@ -0,0 +1,129 @@
+import re
+import numpy as np
+
+# ==========================================
+# 1. Feature Patterns
+# ==========================================
+CJK_RE = re.compile(r'[\u4e00-\u9fff]')
+LATIN_RE = re.compile(r'[A-Za-z]')
+EMOJI_RE = re.compile(
+    r'[\U0001F300-\U0001FAFF\u2600-\u27bf]|\[Sticker\]|\[貼圖\]|\(emoji\)|[:;]-?[)(DPp]'
+)
+QUESTION_RE = re.compile(r'[?？]|嗎|呢')
+EXCLAIM_RE = re.compile(r'[!！]|哈哈|haha|lol', re.IGNORECASE)
+SELF_RE = re.compile(r"\b(?:i|i'm|me|my|mine|myself)\b|我(?!們)", re.IGNORECASE)
+SOCIAL_RE = re.compile(r"\b(?:we|us|our|you|your|let's|guys)\b|我們|大家|你們|你", re.IGNORECASE)
+HEDGE_RE = re.compile(
+    r"\b(?:maybe|perhaps|probably|might|kinda|sort of|i guess|i think|whatever)\b|可能|應該|好像|或許|隨便|都可以",
+    re.IGNORECASE
+)
+
+FEATURE_NAMES = [
+    "avg_length", "emoji_rate", "question_rate", "exclaim_rate",
+    "self_rate", "social_rate", "hedge_rate", "cjk_share"
+]
+
+# ==========================================
+# 2. Scoring Model
+# ==========================================
+# Typical group-chat values for each feature; deviations from these drive the scores.
+# Chinese chats are blended towards their own baseline by each speaker's cjk_share.
+BASELINE_LATIN = np.array([3.0, 0.15, 0.15, 0.15, 0.25, 0.20, 0.06, 0.0])
+BASELINE_CJK = np.array([2.4, 0.15, 0.20, 0.10, 0.15, 0.15, 0.10, 1.0])
+
+# Heuristic weights, one column per dimension in [E, N, F, P] order.
+# Columns: E (Extraversion), N (Intuition), F (Feeling), P (Perceiving).
+FEATURE_WEIGHTS = np.array([
+    #   E      N      F      P
+    [ -8.0,   9.0,  -2.0,  -4.0],  # avg_length (log chars per message)
+    [ 45.0,   5.0,  40.0,  25.0],  # emoji_rate
+    [ 10.0,  35.0,   5.0,  10.0],  # question_rate
+    [ 40.0,   5.0,  30.0,  20.0],  # exclaim_rate
+    [-30.0,  10.0,  10.0,   0.0],  # self_rate
+    [ 45.0,   0.0,  25.0,   5.0],  # social_rate
+    [ -5.0,  20.0,  25.0,  60.0],  # hedge_rate
+    [  0.0,   0.0,   0.0,   0.0],  # cjk_share (only selects the baseline)
+])
+
+# Number of messages at which the stylometric signal is considered fully reliable
+FULL_RELIABILITY_MESSAGES = 40
+
+def extract_features(text):
+    """Turn one speaker's joined messages into a stylometric feature vector."""
+    msgs = [m for m in text.split('\n') if m.strip()]
+    n = max(len(msgs), 1)
+
+    cjk = len(CJK_RE.findall(text))
+    latin = len(LATIN_RE.findall(text))
+
+    # CJK text packs more meaning per character, so weight it like ~2 Latin chars
+    avg_len = sum(len(CJK_RE.sub('xx', m)) for m in msgs) / n
+
+    return [
+        float(np.log1p(avg_len)),
+        sum(1 for m in msgs if EMOJI_RE.search(m)) / n,
+        sum(1 for m in msgs if QUESTION_RE.search(m)) / n,
+        sum(1 for m in msgs if EXCLAIM_RE.search(m)) / n,
+        len(SELF_RE.findall(text)) / n,
+        len(SOCIAL_RE.findall(text)) / n,
+        len(HEDGE_RE.findall(text)) / n,
+        cjk / (cjk + latin) if (cjk + latin) else 0.0,
+    ], len(msgs)
+
+def score_features(feature_matrix, message_counts):
+    """
+    Score all speakers in one matrix operation.
+    Returns (scores N x 4, confidence N x 4) where confidence is 0-50.
+    """
+    X = np.asarray(feature_matrix, dtype=float).reshape(-1, len(FEATURE_NAMES))
+    counts = np.asarray(message_counts, dtype=float).reshape(-1, 1)
+
+    cjk_share = X[:, -1:]
+    baseline = BASELINE_LATIN * (1 - cjk_share) + BASELINE_CJK * cjk_share
+    scores = np.clip(50 + (X - baseline) @ FEATURE_WEIGHTS, 0, 100)
+    reliability = np.clip(counts / FULL_RELIABILITY_MESSAGES, 0, 1)
+    confidence = np.abs(scores - 50) * reliability
+    return np.rint(scores).astype(int), confidence
+
+def scores_to_mbti(scores):
+    """Convert [E, N, F, P] scores (0-100) to a type string."""
+    return (
+        ("E" if scores[0] >= 50 else "I") +
+        ("N" if scores[1] >= 50 else "S") +
+        ("F" if scores[2] >= 50 else "T") +
+        ("P" if scores[3] >= 50 else "J")
+    )
+
+# ==========================================
+# 3. Pre-classifier
+# ==========================================
+def preclassify_speakers(speakers_data, min_confidence=25):
+    """
+    Provisional local analysis for {name: joined_text}.
+    Returns (confident_results, uncertain_names). Confident results use the
+    same {"name", "mbti", "scores"} shape as run_analysis_request output.
+    """
+    names = list(speakers_data.keys())
+    if not names:
+        return [], []
+
+    extracted = [extract_features(speakers_data[n]) for n in names]
+    features = [f for f, _ in extracted]
+    counts = [c for _, c in extracted]
+    scores, confidence = score_features(features, counts)
+
+    confident_mask = (confidence >= min_confidence).all(axis=1)
+
+    confident, uncertain = [], []
+    for i, name in enumerate(names):
+        if confident_mask[i]:
+            person_scores = scores[i].tolist()
+            confident.append({
+                "name": name,
+                "mbti": scores_to_mbti(person_scores),
+                "scores": person_scores,
+                "source": "stylometry"
+            })
+        else:
+            uncertain.append(name)
+    return confident, uncertain